@@ -0,0 +1,211 @@
+         ### Libraries ###
+from array import array                     # Compact delay tables
+from machine import Pin                     # To hand the direction pins back to stepper_controller
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # Pins, activation pin and ThreadSafeFlag
+from motion_queue import segment_counter    # Same step pulses and direction handling as the queue
+asyncio = ctrl.asyncio
+
+# acceleration runs each move with a trapezoidal speed profile: ramp up from
+# start_rate, cruise at top_rate and ramp down again. A stepper can only be
+# started at a rate it can pull in from standstill, but once it is moving it can
+# be accelerated far beyond that, so the ramp raises the usable top speed.
+#
+# Every motor gets a precomputed table of delays that a DMA channel streams into
+# ramp_speed (a step_speed variant) as the motor steps, so Python does nothing
+# per step. Each table word holds a delay and how many steps use it:
+#     (repeats - 1) << 16 | delay
+# Equal delays are merged and the cruise is a single word, so with the default
+# settings a table stays around a thousand words (4 kB) however long the move is.
+
+         ### Ramp settings ###
+start_rate = 500     # [steps/s] the motors can start at from standstill
+top_rate = 20_000    # [steps/s] cruise speed
+accel = 20_000       # [steps/s^2] acceleration and retardation
+sc_freq = 1_000_000  # segment_counter frequency
+ss_freq = 1_000_000  # ramp_speed frequency, one delay count is 1 us at 1 MHz
+_OVERHEAD = 9        # PIO cycles per step on top of the delay loop (IRQ handshake and table bookkeeping)
+_MAX_DELAY = 0xFFFF
+_MAX_REPEAT = 0x10000
+
+         ### Global Variables ###
+_done = [ctrl.ThreadSafeFlag() for _ in range(4)] # Set by the completion IRQ of each motor
+_counters = []                                    # segment_counter state machines for x, y, z and r
+_speeds = []                                      # ramp_speed state machines for x, y, z and r
+_dma = []                                         # One DMA channel per motor
+_moves = 0                                        # Moves since start(), segment_counter alternates the level it waits for
+_running = False
+
+         ### PIO functions ###
+# ramp_speed pulls one table word at a time. The low half is the delay and the
+# high half tells how many more steps should use it before the next word is pulled.
+# It uses the same relative IRQ flags as segment_speed in motion_queue.py.
+@asm_pio(out_shiftdir=PIO.SHIFT_RIGHT, fifo_join=PIO.JOIN_TX)
+def ramp_speed():
+    label("entry")
+    pull(block)                    # next table word, put there by DMA
+    out(y, 16)                     # low half is the delay, OSR keeps the repeat count
+    label("step")
+    wait(1, irq, rel(7))           # waiting for the step from segment_counter (flag 4 or 6)
+    mov(x, y)                      # load the delay
+    label("delay")
+    jmp(x_dec, "delay")            # delay loop
+    irq(clear, rel(4))             # clear flag 5 or 7, allowing segment_counter to continue
+    mov(x, osr)                    # steps left on this delay
+    jmp(not_x, "entry")            # none, fetch the next word
+    jmp(x_dec, "again")            # one less (x is not 0 here so this always jumps)
+    label("again")
+    mov(osr, x)
+    jmp("step")
+
+     ### Delay tables ###
+def _delay(cycles): # Step period in PIO cycles to ramp_speed delay
+    cycles -= _OVERHEAD
+    if cycles < 0:
+        return 0
+    if cycles > _MAX_DELAY:
+        return _MAX_DELAY
+    return cycles
+
+def _pack(words, delay, repeats): # Appends a run of equal delays, split if it's too long for one word
+    while repeats > _MAX_REPEAT:
+        words.append((_MAX_REPEAT - 1) << 16 | delay)
+        repeats -= _MAX_REPEAT
+    if repeats:
+        words.append((repeats - 1) << 16 | delay)
+
+def ramp_table(steps, rate=None, acc=None): # rate and acc default to top_rate and accel
+    # Uses the integer form of David Austin's "Generate stepper-motor speed profiles in real time":
+    #     c(n) = c(n-1) - 2 * c(n-1) / (4n + 1)
+    # where c is the step period, kept << 16 so the steps don't round away near the top.
+    # Starting at n0 = start_rate^2 / (2 accel) makes the ramp begin at start_rate
+    # instead of at a standstill.
+    rate = top_rate if rate is None else rate
+    acc = accel if acc is None else acc
+    steps = abs(steps)
+    table = array("I")
+    if steps == 0:
+        return table
+    c = (ss_freq << 16) // start_rate
+    c_min = (ss_freq << 16) // rate
+    n = start_rate * start_rate // (2 * acc)
+    up = array("I")                  # (delay, repeats) pairs of the ramp up
+    ramp = 0
+    run_delay = _delay(c >> 16)
+    run = 0
+    while ramp < steps // 2 and c > c_min:
+        delay = _delay(c >> 16)
+        if delay != run_delay:
+            up.append(run_delay)
+            up.append(run)
+            run_delay = delay
+            run = 0
+        run += 1
+        ramp += 1
+        n += 1
+        c -= 2 * c // (4 * n + 1)
+    if run:
+        up.append(run_delay)
+        up.append(run)
+    for i in range(0, len(up), 2):
+        _pack(table, up[i], up[i + 1])
+    _pack(table, _delay(max(c, c_min) >> 16), steps - 2 * ramp)   # cruise, or the odd step at the peak
+    for i in range(len(up) - 2, -1, -2):                      # ramp down is the ramp up backwards
+        _pack(table, up[i], up[i + 1])
+    return table
+
+     ### PIO interupt handlers ###
+def pio_0_handler(sm): # Motor 1
+    _done[0].set()
+
+def pio_1_handler(sm): # Motor 2
+    _done[1].set()
+
+def pio_2_handler(sm): # Motor 3
+    _done[2].set()
+
+def pio_3_handler(sm): # Motor 4
+    _done[3].set()
+
+     ### DMA ###
+# Each ramp_speed gets its table through DMA, paced by the data request (DREQ)
+# of its TX FIFO so DMA only writes when there is room.
+_PIO_BASE = (0x50200000, 0x50300000)
+_TXF0 = 0x10
+
+def _tx_fifo(sm_id): # Address of a state machine's TX FIFO
+    return _PIO_BASE[sm_id // 4] + _TXF0 + 4 * (sm_id % 4)
+
+def _dreq(sm_id): # DREQ number of a state machine's TX FIFO
+    return (sm_id // 4) * 8 + sm_id % 4
+
+     ### Acceleration mode ###
+def start(): # Takes over the state machines, like motion_queue.start()
+    global _counters, _speeds, _dma, _moves, _running
+    if _running:
+        return
+    ctrl.release_state_machines()
+    ctrl.activation_pin.value(0)      # The first move starts on 1
+    _moves = 0
+    #          (counter, speed, step pin,       direction pin,   handler)
+    motors = ((0, 1, ctrl.step_pin_1, ctrl.dir_pin_1, pio_0_handler),   # Motor 1 - Pio Block 0
+              (4, 5, ctrl.step_pin_2, ctrl.dir_pin_2, pio_1_handler),   # Motor 2 - Pio Block 1
+              (2, 3, ctrl.step_pin_3, ctrl.dir_pin_3, pio_2_handler),   # Motor 3 - Pio Block 0
+              (6, 7, ctrl.step_pin_4, ctrl.dir_pin_4, pio_3_handler))   # Motor 4 - Pio Block 1
+    _counters = []
+    _speeds = []
+    _dma = []
+    for counter, speed, step_pin, dir_pin, handler in motors:
+        sm = StateMachine(counter, segment_counter, freq=sc_freq, sideset_base=step_pin, out_base=dir_pin)
+        sm.irq(handler)
+        _counters.append(sm)
+        _speeds.append(StateMachine(speed, ramp_speed, freq=ss_freq))
+        _dma.append(rp2.DMA())
+    for axis in range(4):
+        _counters[axis].active(1)
+        _speeds[axis].active(1)
+    _running = True
+
+def stop(): # Hands the state machines back to stepper_controller
+    global _running
+    for axis in range(4):
+        _counters[axis].active(0)
+        _speeds[axis].active(0)
+        _dma[axis].close()
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(segment_counter)
+        rp2.PIO(block).remove_program(ramp_speed)
+    for pin in (ctrl.dir_pin_1, ctrl.dir_pin_2, ctrl.dir_pin_3, ctrl.dir_pin_4):
+        pin.init(Pin.OUT, value=0)
+    ctrl.activation_pin.value(0)
+    _running = False
+    ctrl.setup_state_machines()
+
+async def move_steps(x, y, z, r, rate=None, acc=None): # Like ctrl.move_steps() but with ramps
+    global _moves
+    start()
+    speed_ids = (1, 5, 3, 7)
+    moves = (x, y, z, r)
+    tables = [ramp_table(steps, rate, acc) for steps in moves]   # All planning before the motors start
+    for axis in range(4):
+        _done[axis].clear()
+        steps = moves[axis]
+        _counters[axis].put(-steps << 1 | 1 if steps < 0 else steps << 1)
+        table = tables[axis]
+        if len(table):
+            _dma[axis].config(read=table, write=_tx_fifo(speed_ids[axis]), count=len(table),
+                              ctrl=_dma[axis].pack_ctrl(size=2, inc_write=False, treq_sel=_dreq(speed_ids[axis])),
+                              trigger=True)
+    ctrl.x_last += x
+    ctrl.y_last += y
+    ctrl.z_last += z
+    ctrl.r_last += r
+    ctrl.activation_pin.value(1 if _moves % 2 == 0 else 0) # The level this move waits for, see motion_queue
+    _moves += 1
+    for flag in _done:
+        await flag.wait()
+
+def steps(x, y, z, r, rate=None, acc=None): # Blocking version of move_steps(), hands the state machines back when done
+    asyncio.run(move_steps(x, y, z, r, rate, acc))
+    stop()
@@ -0,0 +1,291 @@
+         ### Libraries ###
+import json                                 # Header of a saved capture
+try:
+    import rp2                              # Capturing needs a Pico, or the emulator
+    from machine import Pin
+    import stepper_controller as ctrl       # Which state machines the motors run on
+except ImportError:
+    rp2 = None                              # On a computer: decoding only, python analyzer.py capture.bin
+try:
+    import uctypes                          # Address of the buffer, the DMA ring has to be aligned to its size
+except ImportError:
+    uctypes = None
+try:
+    import pio_emulator                     # from_trace(): the emulator's pin trace
+except ImportError:
+    pio_emulator = None
+
+# analyzer is a logic analyzer for the step and direction pins. A spare state
+# machine samples the pins of every axis in axes at rate with one in_() per
+# sample, autopush packs the samples into words and DMA writes them from the RX
+# FIFO into a ring buffer, so the CPU does nothing while it captures. The decoder turns the samples
+# into the edges of every pin and from those into steps, pulse widths, step
+# periods, direction setup times and the start and end skew between the axes.
+#
+#     ctrl.init({"motors": 3})                 (state machine 7 is free for the analyzer)
+#     analyzer.start()                         (waits for the activation pin, then samples)
+#     ctrl.steps(40, -20, 10, 0)
+#     analyzer.stop()
+#     analyzer.report()                        (a line per axis, times in us)
+#     analyzer.stats()                         ({"axes": [{"steps": 40, "pulse_min_us": 2.0, ...}, ...], ...})
+#     analyzer.save("capture.bin")             (python analyzer.py capture.bin decodes it on a computer)
+#
+# The samples are rate apart, so every time is measured to one sample: 0.5 us at
+# the default 2 MHz. The ring is 2**ring_bits bytes and keeps the last samples
+# before stop(), 16 kB is 8192 samples of 16 pins, 4 ms at 2 MHz. once = True
+# keeps the first ones after the trigger instead. A pulse counts as too short
+# when it is shorter than min_pulse_us by more than a sample, a step as too soon
+# after a direction change when the same goes for min_setup_us.
+#
+# On the emulator from_trace() gives the same edges from the pin trace, exact to
+# the system clock cycle: analyzer.stats(analyzer.from_trace()) checks the capture.
+# The decoder needs no hardware, load() and stats() also run on a computer.
+
+         ### Settings ###
+axes = ((17, 16), (4, 5), (6, 7), (8, 9)) # (step pin, direction pin) per axis, stepper_controller's motors
+sm = 7               # State machine that samples. stepper_controller uses 6 and 7 for motor 4 only,
+                     # on an RP2350 8-11 (PIO block 2) are free with every motor up
+rate = 2_000_000     # [samples/s]
+trigger = 25         # Sampling starts when this pin goes high (the activation pin), None = right away
+ring_bits = 14       # The buffer is 2**ring_bits bytes, 15 at most (the largest ring the DMA wraps)
+once = False         # True keeps the first samples after the trigger instead of the last before stop()
+min_pulse_us = 1.9   # Shortest step pulse the drivers take, 1.9 for a DRV8825, 1 for an A4988
+min_setup_us = 0.65  # Direction setup time before a step, 0.65 for a DRV8825, 0.2 for an A4988
+
+         ### Global Variables ###
+_PIO_BASE = (0x50200000, 0x50300000, 0x50400000)
+_RXF0 = 0x20
+_COUNT = 0x3FFFFFFF                               # DMA transfers of a ring capture, stop() comes first
+_program = None                                   # The assembled sampler and its (width, trigger)
+_built = None
+_raw = None                                       # The buffer, twice the ring on a Pico so it can be aligned
+_ring = None                                      # The capture, 2**ring_bits bytes
+_sm = None
+_dma = None
+_running = False
+_first = 0                                        # Byte of the oldest sample in _ring
+_kept = 0                                         # Bytes of samples in _ring
+_wrapped = False                                  # The ring went round, it holds the end of the capture
+_rate = rate                                      # Settings of the capture in _ring
+_base = 0                                         # Pin of bit 0
+_width = 16                                       # Bits per sample
+_axes = axes
+_since = _until = 0                               # Emulator cycles of start() and stop()
+
+         ### PIO functions ###
+# sampler waits for the trigger pin, then shifts width pins from in_base into ISR
+# every cycle. Autopush hands ISR to the RX FIFO every 32 bits, the oldest sample
+# in the low bits, and the joined 8 word FIFO gives the DMA time to take them.
+def _assemble(width, trigger): # Assembles the sampler again when the width or the trigger changes
+    global _program, _built
+    if _built == (width, trigger):
+        return
+    def sampler():
+        if trigger is not None:
+            wait(1, gpio, trigger)     # the move starts
+        wrap_target()
+        in_(pins, width)               # one sample
+        wrap()
+    _program = rp2.asm_pio(in_shiftdir=rp2.PIO.SHIFT_RIGHT, autopush=True, push_thresh=32,
+                           fifo_join=rp2.PIO.JOIN_RX)(sampler)
+    _built = (width, trigger)
+
+     ### Capture ###
+def _buffer(): # The ring, aligned to its size on a Pico
+    global _raw, _ring
+    size = 1 << ring_bits
+    if _ring is None or len(_ring) != size:
+        _ring = _raw = None
+        if uctypes:
+            _raw = bytearray(2 * size)
+            skip = -uctypes.addressof(_raw) % size
+        else:
+            _raw = bytearray(size)
+            skip = 0
+        _ring = memoryview(_raw)[skip:skip + size]
+    return _ring
+
+def start(): # Arms the capture, sampling runs from the trigger until stop()
+    global _sm, _dma, _running, _first, _kept, _wrapped, _rate, _base, _width, _axes, _since
+    if _running:
+        stop()
+    if sm < 8 and sm in (0, 1, 4, 5, 2, 3, 6, 7)[:2 * ctrl.motors]:
+        raise ValueError("state machine {} runs a motor, ctrl.init({{'motors': 3}}) frees 6 and 7".format(sm))
+    watched = [pin for axis in axes for pin in axis if pin is not None]
+    _base = min(watched)
+    span = max(watched) - _base + 1
+    _width = 8 if span <= 8 else 16 if span <= 16 else 32
+    _axes, _rate = axes, rate
+    _assemble(_width, trigger)
+    ring = _buffer()
+    _first = _kept = 0
+    _wrapped = False
+    _sm = rp2.StateMachine(sm, _program, freq=rate, in_base=Pin(_base))
+    _dma = rp2.DMA()
+    _dma.config(read=_PIO_BASE[sm // 4] + _RXF0 + 4 * (sm % 4), write=ring,
+                count=len(ring) // 4 if once else _COUNT,
+                ctrl=_dma.pack_ctrl(size=2, inc_read=False, treq_sel=(sm // 4) * 8 + 4 + sm % 4,
+                                    ring_size=0 if once else ring_bits, ring_sel=True),
+                trigger=True)
+    _sm.active(1)
+    if pio_emulator:
+        _since = pio_emulator.emulator.cycles()
+    _running = True
+
+def stop(): # Stops sampling, the capture stays until the next start()
+    global _sm, _dma, _running, _first, _kept, _wrapped, _until
+    if not _running:
+        return
+    _sm.active(0)
+    if pio_emulator:
+        _until = pio_emulator.emulator.cycles()
+    size = len(_ring)
+    written = 4 * ((size // 4 if once else _COUNT) - _dma.count)
+    _kept = min(written, size)
+    _wrapped = written > size
+    _first = written % size if _wrapped else 0
+    _dma.close()
+    rp2.PIO(sm // 4).remove_program(_program)
+    _sm = _dma = None
+    _running = False
+
+def save(path): # Writes the capture: a JSON header line, then the samples oldest first
+    with open(path, "wb") as f:
+        f.write(json.dumps({"rate": _rate, "base": _base, "width": _width, "axes": _axes, "bytes": _kept}).encode())
+        f.write(b"\n")
+        end = _first + _kept
+        f.write(_ring[_first:min(end, len(_ring))])
+        if end > len(_ring):
+            f.write(_ring[:end - len(_ring)])
+
+def load(path): # Reads a capture written by save(), stats() and report() decode it
+    global _ring, _raw, _first, _kept, _wrapped, _rate, _base, _width, _axes
+    with open(path, "rb") as f:
+        info = json.loads(f.readline())
+        _raw = f.read()
+    _ring = memoryview(_raw)
+    _rate, _base, _width = info["rate"], info["base"], info["width"]
+    _axes = tuple(tuple(axis) for axis in info["axes"])
+    _first, _kept, _wrapped = 0, info["bytes"], False
+
+         ### Decoding ###
+def samples(): # Yields every sample of the capture oldest first, bit 0 is pin _base
+    size = len(_ring)
+    step = _width // 8
+    for offset in range(_first, _first + _kept, step):
+        i = offset % size
+        value = _ring[i]
+        for k in range(1, step):
+            value |= _ring[i + k] << (8 * k)
+        yield value
+
+def edges(): # {pin: [(us, level), ...]} of every step and direction pin, from the first sample on
+    period = 1_000_000 / _rate
+    watched = [pin for axis in _axes for pin in axis if pin is not None]
+    result = {pin: [] for pin in watched}
+    last = None
+    for i, value in enumerate(samples()):
+        if value != last and last is not None:
+            changed = value ^ last
+            for pin in watched:
+                bit = pin - _base
+                if changed >> bit & 1:
+                    result[pin].append((i * period, value >> bit & 1))
+        last = value
+    return result
+
+def from_trace(): # edges() from the emulator's pin trace over the time the capture kept, exact to the cycle
+    e = pio_emulator.emulator
+    samples_kept = _kept * 8 // _width
+    length = samples_kept * e.sys_freq // _rate   # [cycles]
+    if _wrapped:
+        start = _until - length                   # The ring kept the end
+    else:
+        start = _since
+        if trigger is not None:
+            rises = [t for t, level in e.edges(trigger) if level and t >= _since]
+            if rises:
+                start = rises[0]
+    scale = 1_000_000 / e.sys_freq
+    result = {}
+    for axis in _axes:
+        for pin in axis:
+            if pin is not None:
+                result[pin] = [((t - start) * scale, level) for t, level in e.edges(pin) if start <= t < start + length]
+    return result
+
+def _spread(values):
+    return round(max(values) - min(values), 3) if values else None
+
+def _summary(values): # (min, avg, max) rounded, Nones without values
+    if not values:
+        return None, None, None
+    return round(min(values), 3), round(sum(values) / len(values), 3), round(max(values), 3)
+
+def stats(pin_edges=None, resolution_us=None): # Steps, pulses, periods and setup times per axis, and the skew between them
+    # pin_edges from edges() (the default) or from_trace(), resolution_us defaults to a sample
+    if pin_edges is None:
+        pin_edges = edges()
+    if resolution_us is None:
+        resolution_us = 1_000_000 / _rate
+    axes = []
+    for axis, (step, direction) in enumerate(_axes):
+        rises = []
+        widths = []
+        setups = []
+        turns = [t for t, level in pin_edges[direction]] if direction is not None else []
+        turn = 0                                   # Next direction change
+        changed = None                             # Last direction change since the last step
+        high = None
+        for t, level in pin_edges[step]:
+            if level:
+                while turn < len(turns) and turns[turn] <= t:
+                    changed = turns[turn]
+                    turn += 1
+                if changed is not None:
+                    setups.append(t - changed)
+                    changed = None
+                rises.append(t)
+                high = t
+            elif high is not None:                 # A pulse that started in the capture
+                widths.append(t - high)
+                high = None
+        periods = [b - a for a, b in zip(rises, rises[1:])]
+        pulse = _summary(widths)
+        period = _summary(periods)
+        axes.append({"axis": axis, "steps": len(rises),
+                     "first_us": round(rises[0], 3) if rises else None,
+                     "last_us": round(rises[-1], 3) if rises else None,
+                     "pulse_min_us": pulse[0], "pulse_avg_us": pulse[1], "pulse_max_us": pulse[2],
+                     "period_min_us": period[0], "period_avg_us": period[1], "period_max_us": period[2],
+                     "setup_min_us": _summary(setups)[0],
+                     "short_pulses": sum(1 for w in widths if w < min_pulse_us - resolution_us),
+                     "short_setups": sum(1 for s in setups if s < min_setup_us - resolution_us)})
+    moved = [row for row in axes if row["steps"]]
+    return {"axes": axes, "resolution_us": round(resolution_us, 3),
+            "start_skew_us": _spread([row["first_us"] for row in moved]),
+            "end_skew_us": _spread([row["last_us"] for row in moved])}
+
+def report(result=None, out=None): # Prints a line per axis (or out(line) for each), stats() of the capture by default
+    if result is None:
+        result = stats()
+    _write("{:4} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+        "axis", "steps", "first", "pulse min", "pulse max", "period min", "period avg", "setup min", "short"), out)
+    for row in result["axes"]:
+        _write("{:4} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+            row["axis"], row["steps"], str(row["first_us"]), str(row["pulse_min_us"]), str(row["pulse_max_us"]),
+            str(row["period_min_us"]), str(row["period_avg_us"]), str(row["setup_min_us"]),
+            row["short_pulses"] + row["short_setups"]), out)
+    _write("start skew {} us, end skew {} us, resolution {} us".format(
+        result["start_skew_us"], result["end_skew_us"], result["resolution_us"]), out)
+
+def _write(line, out):
+    if out is None:
+        print(line)
+    else:
+        out(line)
+
+if __name__ == "__main__":
+    import sys
+    load(sys.argv[1])
+    report()
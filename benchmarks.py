@@ -0,0 +1,850 @@
+         ### Libraries ###
+import sys
+import time                      # ticks_us() timestamps on a Pico
+import gc                        # realtime's heap growth
+import json                      # Results are written as JSON so runs can be compared
+from array import array          # Preallocated edge buffers, the capture runs in a hard IRQ
+import machine
+from machine import Pin
+import rp2
+import stepper_controller as ctrl
+import motion_queue as mq
+import step_driver
+import kinematics
+import homing
+import jog
+import planner
+import sync_start
+import program_cache
+import encoder
+import profiler
+import realtime
+import path
+import telemetry
+import analyzer
+import acceleration
+import interpolator
+asyncio = ctrl.asyncio
+try:
+    import pio_emulator          # Running on a computer through emulator/run.py
+    import tracemalloc           # CPython's gc has no mem_alloc()
+except ImportError:
+    pio_emulator = None          # Running on a Pico
+
+# Measures how fast the controller really is and writes it to a JSON file:
+# - step_rate: sustained step rate of motor 1 for several sc_freq / ss_freq pairs (stepper_controller)
+#   and delay values (step_driver and experimental's base_delay)
+# - feed_rate: motor 1 at several feed_rate()s, the rate asked for, the rate feed_rate() reports
+#   and the rate measured on the pin. Their step periods must be less than half a state machine cycle apart
+# - latency: from calling steps() / angle() to the first step edge, and from jog.speed() to the first
+#   step at another speed
+# - dead_time: the gap between the last step of one instructor() / step_instructor() segment and the
+#   first step of the next, motion_queue as reference
+# - ramp: one acceleration.steps() move on motor 1, the steps counted on the pin and the fastest
+#   step rate measured against top_rate, then a steps() move to check the state machines came back
+# - interpolator: interpolator_move and back, the edges per motor against the move and how far
+#   apart the motors make their last step, which the DDA puts on the same tick. A steps() move
+#   after each checks that interpolator handed the state machines back
+# - segment_sync: an L through motion_queue, how long after the last step of one axis the next axis
+#   makes its first step. Negative means the segments overlapped
+# - start_skew: cycles between the two PIO blocks starting in sync_start.release(), and between the
+#   first step of motor 1 (block 0) and motor 2 (block 1) in a steps() move
+# - end_skew: how far apart the motors start and stop in a motor_sync() move (experimental)
+# - kinematics: waypoints solved per second with the lookup tables and with math, and how
+#   many steps they differ by
+# - planner: kinematics waypoints planned on core 1 and stepped through motion_queue on core 0,
+#   segments planned per second of core 1 and how long they wait in the ring for the motors
+# - program_cache: packing a task of cache_segments segments the first time and finding it in the
+#   cache the next time, in steps and in degrees, and a cached run checked against its step count
+# - profile: profiler's phases of profile_moves steps() moves, min/avg/max per phase, and what a
+#   lap() costs the CPU
+# - path: segments of a full circle of curve_radius steps and of a spline per second, their largest
+#   distance from the true circle and the circle run through planner, underruns and steps counted
+# - realtime: realtime_moves moves through realtime.play() with the garbage collector off, how much
+#   the heap grew and what was allocated during the loop. On a Pico nothing is collected while gc is
+#   off, so gc.mem_alloc() counts every allocation and both have to be 0. On a computer CPython frees
+#   temporaries right away: growth is what the motion modules kept, allocated is tracemalloc's peak
+#   above the start, which also holds the emulator's and CPython's own temporaries (ints above 256)
+# - boot: stepper_controller imported again from scratch, then init() with boot_motors motors and
+#   the first steps() move: the time each takes and when the first step edge comes after the import
+#   started. Its own imports (rp2, sync_start, profiler ...) are loaded already, so this is the time
+#   stepper_controller itself adds to startup
+# - analyzer: analyzer_move on 3 motors captured by analyzer (state machine 7), per axis the steps,
+#   pulse widths, step periods and direction setup time, and on the emulator the same decoded from
+#   the pin trace to check the capture against
+# - homing: (emulator only) axis 0 homed against a simulated switch from several start positions,
+#   how long each approach takes to stop after the switch triggers, how far it overshoots and
+#   where the axis ends up
+# - encoder: (emulator only) axis 0 with a simulated quadrature encoder, a clean move, a move that
+#   loses encoder_lost steps and one that stalls, the corrections made and how far off the axis ends
+#
+# On a computer:  python emulator/run.py benchmarks.py [results.json]
+# On a Pico:      import benchmarks; benchmarks.run()          (writes benchmark_results.json)
+# Comparing:      python emulator/run.py benchmarks.py --compare old.json new.json
+#
+# The emulator takes the edges from its pin trace, exact to the system clock cycle. Its latency
+# comes from the cost it charges per rp2/machine call, so compare emulator runs with emulator runs.
+# A Pico timestamps the step pins with ticks_us() in a hard IRQ. That keeps up to roughly 20 kHz,
+# faster rates are still right from the first to the last edge but the period min/max are not.
+
+         ### Settings ###
+rate_steps = 2000                                 # Steps per step rate run
+freqs = ((1_000_000, 1_000_000),                  # (sc_freq, ss_freq) pairs for stepper_controller
+         (5_000_000, 5_000_000),
+         (25_000_000, 25_000_000),
+         (25_000_000, 1_000_000),
+         (1_000_000, 25_000_000))
+delays = (50, 100, 200, 400)                      # Delays for step_driver and base_delay values for experimental
+feed_rates = (50, 1234.5, 3000, 20_000, 100_000)  # [steps/s] for stepper_controller.feed_rate()
+feed_steps = 200                                  # Steps per feed rate run
+latency_runs = 5                                  # Moves per latency measurement
+latency_steps = 10
+jog_speeds = (1000, 2000)                         # [steps/s] jog latency switches between
+segments = ((400, 0, 0, 0),) * 5                  # instructor() / step_instructor() tuple for dead_time
+ramp_steps = 3000                                 # Steps of the acceleration move
+ramp_acc = 200_000                                # [steps/s^2] reaches top_rate within a third of ramp_steps
+interpolator_move = (300, 200, 100, 0)            # Linear move of the interpolator run, and back
+l_segments = ((100, 0, 0, 0), (0, 100, 0, 0), (-100, -100, 0, 0)) # motion_queue L for segment_sync, and back
+skew_moves = ((3200, 1200, 800, 300),             # motor_sync() moves for end_skew
+              (1000, 999, 333, 1),
+              (-2000, 1500, -17, 700))
+# experimental's step_speed only pulls its delay when the motor steps, so a motor that stays put
+# keeps it in the FIFO and the 5th such move blocks in put(). Its moves therefore use every motor.
+capture_size = 2048                               # Edges kept per pin, after that only the last one
+ex_pins = (19, 16, 26, 28)                        # Step pins in experimental.py
+ik_points = 500                                   # Waypoints per kinematics run
+plan_points = 200                                 # Waypoints per planner run
+cache_segments = 200                              # Segments of the program_cache task
+profile_moves = 10                                # Moves per profile run
+realtime_moves = 10_000                           # Moves of the heap growth check
+curve_radius = 1600                               # [steps] of the path circle
+curve_points = [(400 * i, (i % 2) * 600 - 300, 20 * i, 0) for i in range(1, 21)] # Waypoints of the path spline
+boot_motors = (1, 4)                              # init({"motors": n}) of the boot runs
+analyzer_move = (40, -20, 10, 0)                  # Steps of the analyzer capture, 3 ms at the default rate
+home_starts = (1000, 2345, 777, 3200, 1)          # Steps from the switch axis 0 starts homing at
+home_hysteresis = 3                               # Steps the simulated switch needs to release
+encoder_steps = 800                               # Steps per encoder move
+encoder_lost = 5                                  # Steps the simulated motor misses in the second move
+encoder_pins = (10, 4000)                         # (pin A, counts per revolution) of the simulated encoder on axis 0
+encoder_freq = 2_000_000                          # Decoder frequency on the emulator, the system clock is slow to emulate
+
+_platform = "emulator" if pio_emulator else "rp2"
+_t0 = 0                                           # Start of the capture, cycles or ticks_us()
+_pins = ()
+_stamps = [array("i", [0] * capture_size) for _ in range(4)]
+_counts = array("I", [0, 0, 0, 0])
+
+         ### Edge capture ###
+def _capture(i): # Hard IRQ handler storing the time of each rising edge of one pin
+    stamps = _stamps[i]
+    last = capture_size - 1
+    def handler(pin):
+        n = _counts[i]
+        stamps[n if n < last else last] = time.ticks_diff(time.ticks_us(), _t0)
+        _counts[i] = n + 1
+    return handler
+
+def _arm(pins): # Starts recording the rising edges of up to 4 pins
+    global _t0, _pins
+    _pins = pins
+    if pio_emulator:
+        pio_emulator.emulator.clear_trace()
+        _t0 = pio_emulator.emulator.cycles()
+        return
+    _t0 = time.ticks_us()
+    for i in range(len(pins)):
+        _counts[i] = 0
+        Pin(pins[i]).irq(_capture(i), Pin.IRQ_RISING, hard=True)
+
+def _disarm():
+    if not pio_emulator:
+        for pin in _pins:
+            Pin(pin).irq(None)
+
+def _now(): # [us] since _arm(), same clock as the edges
+    if pio_emulator:
+        e = pio_emulator.emulator
+        return (e.cycles() - _t0) * 1_000_000 / e.sys_freq
+    return time.ticks_diff(time.ticks_us(), _t0)
+
+def _edges(pin): # [us] of the rising edges of pin since _arm(), and how many there were
+    if pio_emulator:
+        e = pio_emulator.emulator
+        edges = [(t - _t0) * 1_000_000 / e.sys_freq for t in e.rising(pin)]
+        return edges, len(edges)
+    i = _pins.index(pin)
+    n = _counts[i]
+    return list(_stamps[i][:min(n, capture_size)]), n
+
+def _us(value):
+    return round(value, 3)
+
+def _periods(edges, n): # Mean, min and max step period of n edges, edges may miss some in the middle
+    if n < 2 or len(edges) < 2:
+        return 0, 0, 0
+    diffs = [b - a for a, b in zip(edges, edges[1:])]
+    return (edges[-1] - edges[0]) / (n - 1), min(diffs), max(diffs)
+
+         ### Benchmarks ###
+def _reload(sc_freq, ss_freq): # Restarts stepper_controller's state machines at other frequencies
+    ctrl.release_state_machines()
+    ctrl.sc_freq = sc_freq
+    ctrl.ss_freq = ss_freq
+    ctrl.setup_state_machines()
+
+def _rate(name, pin, run, steps): # One step rate run, run() makes steps steps on pin
+    _arm((pin,))
+    run()
+    _disarm()
+    edges, n = _edges(pin)
+    period, fastest, slowest = _periods(edges, n)
+    return {"name": name, "steps": steps, "edges": n,
+            "rate_hz": round(1_000_000 / period, 1) if period else 0,
+            "period_us": _us(period), "period_min_us": _us(fastest), "period_max_us": _us(slowest)}
+
+# Each benchmark measures stepper_controller, or experimental when it is passed in as ex.
+def step_rate(ex=None): # Motor 1 at every (sc_freq, ss_freq) in freqs, or every base_delay in delays
+    results = []
+    if ex is None:
+        sc_freq, ss_freq = ctrl.sc_freq, ctrl.ss_freq
+        for sc, ss in freqs:
+            _reload(sc, ss)
+            result = _rate("ctrl sc={} ss={}".format(sc, ss), 17,
+                           lambda: ctrl.steps(rate_steps, 0, 0, 0), rate_steps)
+            result["sc_freq"] = sc
+            result["ss_freq"] = ss
+            results.append(result)
+            ctrl.steps(-rate_steps, 0, 0, 0)
+        _reload(sc_freq, ss_freq)
+        for delay in (0,) + delays:
+            result = _rate("step_driver delay={}".format(delay), step_driver.axes[0][0],
+                           lambda: step_driver.steps(rate_steps, delays=[delay] * 8), rate_steps)
+            result["delay"] = delay
+            results.append(result)
+        step_driver.stop()
+    else:
+        base_delay = ex.base_delay
+        for delay in delays:
+            ex.base_delay = delay
+            result = _rate("experimental delay={}".format(delay), ex_pins[0],
+                           lambda: ex.steps(rate_steps, rate_steps, rate_steps, rate_steps), rate_steps)
+            result["delay"] = delay
+            results.append(result)
+        ex.base_delay = base_delay
+    return results
+
+def feed_rate(): # Motor 1 at every rate in feed_rates: asked for, reported by feed_rate() and measured, which must agree
+    results = []
+    clkdiv, delay = ctrl._clkdiv[0], ctrl._delay[0]
+    for rate in feed_rates:
+        delivered = ctrl.feed_rate(rate)[0]
+        result = _rate("feed_rate {}".format(rate), 17, lambda: ctrl.steps(feed_steps, 0, 0, 0), feed_steps)
+        result["asked_hz"] = rate
+        result["delivered_hz"] = round(delivered, 3)
+        result["clkdiv"] = ctrl._clkdiv[0] / 256
+        result["delay"] = ctrl._delay[0]
+        cycle_us = ctrl._clkdiv[0] / 256 / machine.freq() * 1_000_000 # One state machine cycle at this rate
+        result["error_cycles"] = round((result["period_us"] - 1_000_000 / delivered) / cycle_us, 2)
+        assert abs(result["error_cycles"]) < 0.5, "feed_rate({}) reports {} Hz, the pin steps at {} Hz".format(
+            rate, result["delivered_hz"], result["rate_hz"])
+        results.append(result)
+        ctrl.steps(-feed_steps, 0, 0, 0)
+    ctrl._clkdiv[0], ctrl._delay[0] = clkdiv, delay
+    _reload(ctrl.sc_freq, ctrl.ss_freq)  # Back to the rate motor 1 had
+    return results
+
+def _latency(name, pin, call): # Call to first step edge, latency_runs times
+    times = []
+    for _ in range(latency_runs):
+        _arm((pin,))
+        start = _now()
+        call()
+        _disarm()
+        edges, n = _edges(pin)
+        if n:
+            times.append(edges[0] - start)
+    if not times:
+        return {"name": name, "runs": 0}
+    return {"name": name, "runs": len(times), "latency_us": _us(sum(times) / len(times)),
+            "latency_min_us": _us(min(times)), "latency_max_us": _us(max(times))}
+
+async def _jog_latency(): # jog.speed() to the first step that runs at a different speed, latency_runs times
+    pin = step_driver.axes[0][0]
+    task = asyncio.create_task(jog.run())
+    jog.speed(jog_speeds[0])
+    await asyncio.sleep_ms(200)
+    times = []
+    for i in range(latency_runs):
+        old = 1_000_000 / jog_speeds[i % 2]       # [us] step period before speed()
+        _arm((pin,))
+        start = _now()
+        jog.speed(jog_speeds[(i + 1) % 2])
+        await asyncio.sleep_ms(200)
+        _disarm()
+        edges, n = _edges(pin)
+        for a, b in zip(edges, edges[1:]):
+            if abs(b - a - old) > old / 50:     # The step starting at a is the first one at another speed
+                times.append(a - start)
+                break
+    jog.stop()
+    await task
+    if not times:
+        return {"name": "jog speed()", "runs": 0}
+    return {"name": "jog speed()", "runs": len(times), "latency_us": _us(sum(times) / len(times)),
+            "latency_min_us": _us(min(times)), "latency_max_us": _us(max(times))}
+
+def latency(ex=None):
+    if ex is None:
+        deg = latency_steps * ctrl.step_angle
+        results = [_latency("ctrl steps()", 17, lambda: ctrl.steps(latency_steps, 0, 0, 0)),
+                   _latency("ctrl angle()", 17, lambda: ctrl.angle(deg, 0, 0, 0))]
+        ctrl.steps(-2 * latency_runs * latency_steps, 0, 0, 0)
+        x = ctrl.x_last
+        results.append(asyncio.run(_jog_latency()))
+        ctrl.steps(x - ctrl.x_last, 0, 0, 0)     # Back to where jog started
+        return results
+    deg = latency_steps * ex.step_angle
+    n = latency_steps
+    return [_latency("experimental steps()", ex_pins[0], lambda: ex.steps(n, n, n, n)),
+            _latency("experimental angle()", ex_pins[0], lambda: ex.angle(deg, deg, deg, deg))]
+
+def ramp(): # acceleration.steps() on motor 1: steps counted, peak rate against top_rate, stepper_controller afterwards
+    _arm((17,))
+    acceleration.steps(ramp_steps, 0, 0, 0, acc=ramp_acc)
+    _disarm()
+    edges, n = _edges(17)
+    fastest = _periods(edges, n)[1]
+    _arm((17,))
+    ctrl.steps(-latency_steps, 0, 0, 0)          # Only moves if stop() gave the state machines back
+    _disarm()
+    back = _edges(17)[1]
+    acceleration.steps(-ramp_steps, 0, 0, 0, acc=ramp_acc)
+    ctrl.steps(latency_steps, 0, 0, 0)
+    return [{"name": "acceleration", "steps": ramp_steps, "edges": n, "top_rate_hz": acceleration.top_rate,
+             "peak_rate_hz": round(1_000_000 / fastest, 1) if fastest else 0, "ctrl_after_edges": back}]
+
+def interpolate(): # interpolator_move and back with ctrl.steps() between: edges per motor and the spread of the last steps
+    results = []
+    pins = (17, 4, 6)
+    for sign in (1, -1):
+        move = tuple(sign * steps for steps in interpolator_move)
+        _arm(pins)
+        interpolator.steps(*move)
+        _disarm()
+        edges = [_edges(pin) for pin in pins]
+        ends = [stamps[-1] for stamps, n in edges if n]
+        results.append({"name": "move {}".format(move), "steps": sum(abs(steps) for steps in move[:3]),
+                        "edges": sum(n for stamps, n in edges),
+                        "end_spread_us": _us(max(ends) - min(ends)) if ends else 0,
+                        "deviation_steps": _us(interpolator.deviation(*move))})
+        _arm((17,))
+        ctrl.steps(sign * latency_steps, 0, 0, 0) # Only moves if steps() gave the state machines back
+        _disarm()
+        results[-1]["ctrl_after_edges"] = _edges(17)[1]
+    return results
+
+def segment_sync(): # First step of y after the last step of x, and of the way back after y, in l_segments
+    pins = (17, 4)
+    _arm(pins)
+    asyncio.run(mq.run(l_segments))
+    mq.stop()
+    _disarm()
+    (x, nx), (y, ny) = [_edges(pin) for pin in pins]
+    leg = l_segments[0][0]
+    if nx < 2 * leg or ny < 2 * leg:
+        return [{"name": "motion_queue L", "x_edges": nx, "y_edges": ny}]
+    x_to_y = y[0] - x[leg - 1]
+    y_to_back = x[leg] - y[leg - 1]
+    return [{"name": "motion_queue L", "x_to_y_us": _us(x_to_y), "y_to_back_us": _us(y_to_back),
+             "sequential": x_to_y > 0 and y_to_back > 0}]
+
+def start_skew(): # sync_start's measured skew and the first step edges of a move in both blocks
+    ctrl.release_state_machines()
+    skew = sync_start.measure()
+    ctrl.setup_state_machines()
+    pins = (17, 4)                               # Step pins of motor 1 and 2
+    _arm(pins)
+    ctrl.steps(latency_steps, latency_steps, 0, 0)
+    _disarm()
+    firsts = [_edges(pin)[0][0] for pin in pins]
+    ctrl.steps(-latency_steps, -latency_steps, 0, 0)
+    return [{"name": "sync_start", "skew_cycles": skew, "step_skew_us": _us(firsts[1] - firsts[0]),
+             "step_skew_cycles": round((firsts[1] - firsts[0]) * machine.freq() / 1_000_000)}]
+
+def _dead_time(name, pin, run, segments): # Gaps at the segment boundaries of run(segments)
+    _arm((pin,))
+    run(segments)
+    _disarm()
+    edges, n = _edges(pin)
+    result = {"name": name, "segments": len(segments), "edges": n}
+    counts = [abs(int(segment[0])) for segment in segments]
+    if n != sum(counts) or n > capture_size:
+        return result                            # Missed edges, the boundaries can't be found
+    gaps = []
+    i = 0
+    for count in counts[:-1]:
+        i += count
+        gaps.append(edges[i] - edges[i - 1])
+    period, _, _ = _periods(edges[:counts[0]], counts[0])
+    result["period_us"] = _us(period)
+    result["gap_us"] = _us(sum(gaps) / len(gaps))
+    result["gap_max_us"] = _us(max(gaps))
+    result["dead_time_us"] = _us(sum(gaps) / len(gaps) - period) # What the boundary costs over a normal step
+    return result
+
+def dead_time(ex=None):
+    if ex is None:
+        results = [_dead_time("ctrl instructor()", 17, ctrl.instructor, segments),
+                   _dead_time("motion_queue run()", 17, lambda s: asyncio.run(mq.run(s)), segments)]
+        mq.stop()
+        return results
+    every = tuple((s[0], s[0], s[0], s[0]) for s in segments)
+    return [_dead_time("experimental step_instructor()", ex_pins[0], ex.step_instructor, every)]
+
+def end_skew(ex): # Start and end spread of the motors in experimental's motor_sync() moves
+    results = []
+    for move in skew_moves:
+        pins = [ex_pins[i] for i in range(4) if move[i]]
+        _arm(pins)
+        ex.steps(*move)
+        _disarm()
+        firsts = []
+        lasts = []
+        for pin in pins:
+            edges, n = _edges(pin)
+            if n:
+                firsts.append(edges[0])
+                lasts.append(edges[-1])
+        if not lasts:
+            continue
+        results.append({"name": "motor_sync {}".format(move), "move": list(move),
+                        "delays": list(ex.motor_sync(*move)),
+                        "start_skew_us": _us(max(firsts) - min(firsts)),
+                        "end_skew_us": _us(max(lasts) - min(lasts)),
+                        "duration_us": _us(max(lasts) - min(firsts))})
+    return results
+
+def _wall_us(): # Time the CPU really spent, the emulator's clocks only count hardware time
+    if pio_emulator:
+        return time.perf_counter() * 1_000_000
+    return time.ticks_us()
+
+def _wall_since(start):
+    if pio_emulator:
+        return _wall_us() - start
+    return time.ticks_diff(time.ticks_us(), start)
+
+def ik(): # Points per second through kinematics.targets() and through solve_float()
+    reach = kinematics.link_1 + kinematics.link_2
+    points = [(reach * (0.3 + 0.4 * i / ik_points), reach * (0.5 - i / ik_points) * 0.6, i / 100, i)
+              for i in range(ik_points)]
+    start = _wall_us()
+    solved = list(kinematics.targets(points))
+    tables = _wall_since(start)
+    start = _wall_us()
+    floats = [kinematics.solve_float(point[0], point[1]) for point in points]
+    reference = _wall_since(start)
+    error = 0
+    for i in range(ik_points):
+        error = max(error, abs(solved[i][0] - floats[i][0]), abs(solved[i][1] - floats[i][1]))
+    return [{"name": "targets()", "points": ik_points, "points_per_s": round(ik_points * 1_000_000 / tables),
+             "max_error_steps": error},
+            {"name": "solve_float()", "points": ik_points, "points_per_s": round(ik_points * 1_000_000 / reference)}]
+
+def plan(): # planner.run() on kinematics waypoints, then back to where it started
+    reach = kinematics.link_1 + kinematics.link_2
+    points = [(reach * (0.3 + 0.4 * i / plan_points), reach * (0.5 - i / plan_points) * 0.6, i / 100, i)
+              for i in range(plan_points)]
+    start = (ctrl.x_last, ctrl.y_last, ctrl.z_last, ctrl.r_last)
+    begin = _wall_us()
+    planner.run(kinematics.moves(points, start))
+    wall = _wall_since(begin)
+    planned, rate, wait, wait_max = planner.stats()
+    ctrl.steps(start[0] - ctrl.x_last, start[1] - ctrl.y_last, start[2] - ctrl.z_last, start[3] - ctrl.r_last)
+    return [{"name": "planner run()", "segments": planned, "planned_per_s": rate, "ring_wait_us": wait,
+             "ring_wait_max_us": wait_max, "wall_us": round(wall)}]
+
+def cache(): # program_cache.get() of a new and of a known task, then the known task played
+    task = tuple(((i % 5 - 2) * 10, (i % 3 - 1) * 7, i % 2 * 4 - 2, 0) for i in range(cache_segments))
+    degrees = tuple((x * ctrl.step_angle, y * ctrl.step_angle, z * ctrl.step_angle, r * ctrl.step_angle)
+                    for x, y, z, r in task)
+    program_cache.clear()
+    results = []
+    for name, source, angles in (("degrees", degrees, True), ("steps", task, False)): # task stays cached for run()
+        start = _wall_us()
+        program_cache.get(source, angles=angles)
+        cold = _wall_since(start)
+        start = _wall_us()
+        program_cache.get(source, angles=angles)
+        warm = _wall_since(start)
+        results.append({"name": "get() " + name, "segments": cache_segments, "pack_us": round(cold),
+                        "cached_us": round(warm), "speedup": round(cold / warm, 1) if warm else 0})
+    _arm((17,))
+    program_cache.run(task)
+    _disarm()
+    edges, n = _edges(17)
+    kept, size, hits, misses = program_cache.stats()
+    results.append({"name": "run() cached", "steps": sum(abs(segment[0]) for segment in task), "edges": n,
+                    "programs": kept, "bytes": size, "hits": hits, "misses": misses})
+    return results
+
+def profile(ex=None): # profiler's phases of steps() moves, with every motor moving for experimental
+    profiler.reset_stats()
+    profiler.enabled = True
+    try:
+        for i in range(profile_moves):
+            n = latency_steps if i % 2 == 0 else -latency_steps
+            if ex is None:
+                ctrl.steps(n, 0, 0, 0)
+            else:
+                ex.steps(n, n, n, n)
+    finally:
+        profiler.enabled = False
+    stats = profiler.stats()
+    results = []
+    for phase in profiler.NAMES:
+        if phase in stats:
+            n, low, avg, high, histogram = stats[phase]
+            results.append({"name": "{} {}".format("experimental" if ex else "ctrl", phase), "count": n,
+                            "min_us": low, "avg_us": avg, "max_us": high})
+    if ex is None:
+        laps = 1000
+        start = _wall_us()
+        for _ in range(laps):
+            profiler.lap(profiler.PUT)
+        results.append({"name": "lap()", "laps": laps, "cpu_us": round(_wall_since(start) / laps, 2)})
+        profiler.reset_stats()
+    return results
+
+def _chord_error(moves, ca, cb, radius): # Largest distance of the segment ends and middles from a circle
+    x = y = 0
+    error = 0
+    for segment in moves:
+        mx = x + segment[0] / 2
+        my = y + segment[1] / 2
+        x += segment[0]
+        y += segment[1]
+        for px, py in ((mx, my), (x, y)):
+            error = max(error, abs(radius - ((px - ca) ** 2 + (py - cb) ** 2) ** 0.5))
+    return error
+
+def curves(): # path.arc() and path.spline(): segment rate, accuracy, and a circle through planner
+    circle = lambda: path.arc((0, 0, 0, 0), (curve_radius, 0))
+    results = []
+    for name, make, end in (("arc", circle, (0, 0)),
+                            ("spline", lambda: path.spline(curve_points), curve_points[-1])):
+        start = _wall_us()
+        n = 0
+        for _ in make():
+            n += 1
+        wall = _wall_since(start)
+        x = sum(segment[0] for segment in make())
+        y = sum(segment[1] for segment in make())
+        row = {"name": name, "segments": n, "segments_per_s": round(n * 1_000_000 / wall),
+               "end_error_steps": abs(x - end[0]) + abs(y - end[1])}
+        if make is circle:
+            row["max_error_steps"] = round(_chord_error(make(), curve_radius, 0, curve_radius), 3)
+            row["tolerance"] = path.tolerance
+        results.append(row)
+    underruns = mq.underruns
+    _arm((17,))
+    planner.run(circle())
+    _disarm()
+    edges, n = _edges(17)
+    results.append({"name": "arc planner run()", "steps": sum(abs(segment[0]) for segment in circle()), "edges": n,
+                    "underruns": mq.underruns - underruns})
+    return results
+
+def _heap(): # Bytes on the heap, on a computer only what the motion modules allocated
+    if pio_emulator is None:
+        return gc.mem_alloc()
+    motion = [tracemalloc.Filter(True, "*/" + name + ".py")
+              for name in ("stepper_controller", "realtime", "sync_start", "telemetry")]
+    return sum(stat.size for stat in tracemalloc.take_snapshot().filter_traces(motion).statistics("filename"))
+
+def _alloc_mark(): # Starts counting allocations for _allocated(), gc has to be off on a Pico
+    if pio_emulator is None:
+        return gc.mem_alloc()
+    tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+def _allocated(mark): # Bytes allocated since _alloc_mark(), freed temporaries included
+    if pio_emulator is None:
+        return gc.mem_alloc() - mark             # Nothing is freed while gc is off
+    return tracemalloc.get_traced_memory()[1] - mark # Peak, CPython frees temporaries right away
+
+def realtime_heap(): # realtime_moves one step moves back and forth in jobs of 100, heap and allocations during them
+    job = realtime.pack(((1, 0, 0, 0), (-1, 0, 0, 0)) * 50)
+    level = telemetry.level
+    if pio_emulator:
+        telemetry.level = 0                      # CPython makes an object of every int above 256, dropped would count as growth
+        trace = pio_emulator.emulator.trace_pins
+        pio_emulator.emulator.trace_pins = ()    # The pin trace grows with every step
+        tracemalloc.start()
+    realtime.start()
+    try:
+        realtime.play(job)                       # x_last etc. hold traced objects before the first count
+        before = _heap()
+        mark = _alloc_mark()
+        start = _wall_us()
+        for _ in range(realtime_moves // 100):
+            realtime.play(job)
+        wall = _wall_since(start)
+        allocated = _allocated(mark)
+        after = _heap()
+    finally:
+        realtime.stop()
+        telemetry.level = level
+        if pio_emulator:
+            tracemalloc.stop()
+            pio_emulator.emulator.trace_pins = trace
+    return [{"name": "play()", "moves": realtime_moves, "heap_before": before, "heap_after": after,
+             "growth_bytes": after - before, "allocated_bytes": allocated,
+             "wall_us_per_move": round(wall / realtime_moves, 1)}]
+
+def boot(): # Fresh import, init() and first move of stepper_controller, then the original module is set up again
+    results = []
+    ctrl.release_state_machines()
+    fresh = None
+    try:
+        for n in boot_motors:
+            del sys.modules["stepper_controller"]
+            gc.collect()
+            _arm((17,))
+            start = _wall_us()
+            fresh = __import__("stepper_controller")
+            imported = _wall_since(start)
+            fresh.init({"motors": n})
+            ready = _wall_since(start)
+            fresh.steps(1, 0, 0, 0)
+            moved = _wall_since(start)
+            _disarm()
+            edges, count = _edges(17)
+            results.append({"name": "motors={}".format(n), "import_us": _us(imported),
+                            "init_us": _us(ready - imported), "first_move_us": _us(moved - ready),
+                            "first_edge_us": _us(edges[0]) if count else None})
+            fresh.steps(-1, 0, 0, 0)
+            fresh.release_state_machines()
+            fresh = None
+    finally:
+        if fresh:
+            fresh.release_state_machines()
+        sys.modules["stepper_controller"] = ctrl
+        ctrl.setup_state_machines()
+    return results
+
+def _analyzer_rows(source, result): # stats() of analyzer as benchmark rows
+    rows = [dict(row, name="{} axis {}".format(source, row["axis"])) for row in result["axes"] if row["steps"]]
+    rows.append({"name": source + " skew", "start_skew_us": result["start_skew_us"],
+                 "end_skew_us": result["end_skew_us"], "resolution_us": result["resolution_us"]})
+    return rows
+
+def capture(): # analyzer_move captured with analyzer, and on the emulator decoded from the pin trace as well
+    motors, trigger = ctrl.motors, analyzer.trigger
+    ctrl.init({"motors": 3})                     # Frees state machine 7
+    analyzer.trigger = None                      # From before the direction pins change
+    try:
+        analyzer.start()
+        ctrl.steps(*analyzer_move)
+        analyzer.stop()
+        results = _analyzer_rows("capture", analyzer.stats())
+        if pio_emulator:
+            results += _analyzer_rows("trace", analyzer.stats(analyzer.from_trace(), 0))
+        ctrl.steps(*[-steps for steps in analyzer_move])
+    finally:
+        analyzer.stop()
+        analyzer.trigger = trigger
+        ctrl.init({"motors": motors})
+    return results
+
+class _Switch: # Simulated endstop on axis 0, pressed at position 0 and below
+    def __init__(self, position):
+        self.position = position
+        self.triggers = []                       # ticks_us() of every press
+        self.overshoot = []                      # Steps past the switch after every press
+        e = pio_emulator.emulator
+        self.step_pin, self.dir_pin = step_driver.axes[0]
+        self.pin = homing.switches[0][0]
+        e.drive(self.pin, 1 if position <= 0 else 0)
+        e.watch(self.step_pin, self.step)
+
+    def step(self, pin, level):
+        if not level:
+            return
+        e = pio_emulator.emulator
+        self.position += -1 if e.level[self.dir_pin] else 1
+        if self.triggers:
+            self.overshoot[-1] = max(self.overshoot[-1], -self.position)
+        if self.position <= 0 and not e.level[self.pin]:
+            self.triggers.append(e.ticks_us())
+            self.overshoot.append(0)
+            e.drive(self.pin, 1)
+        elif self.position >= home_hysteresis and e.level[self.pin]:
+            e.drive(self.pin, 0)
+
+    def close(self):
+        pio_emulator.emulator.unwatch(self.step_pin, self.step)
+
+def home(): # Reaction to the switch and repeatability of homing.home(), needs the emulator's simulated switch
+    if not pio_emulator:
+        return []
+    switches = homing.switches
+    homing.switches = [switches[0]] + [None] * (len(switches) - 1)
+    results = []
+    try:
+        for start in home_starts:
+            switch = _Switch(start)
+            try:
+                homing.home()
+            finally:
+                switch.close()
+            results.append({"name": "home from {}".format(start), "start": start, "end": switch.position,
+                            "fast_overshoot_steps": switch.overshoot[0], "slow_overshoot_steps": switch.overshoot[-1],
+                            "slow_steps": homing.found[0],
+                            "reaction_us": time.ticks_diff(homing.stopped[0], switch.triggers[-1])})
+    finally:
+        homing.switches = switches
+    ends = [result["end"] for result in results]
+    results.append({"name": "repeatability", "runs": len(ends), "spread_steps": max(ends) - min(ends),
+                    "reaction_max_us": max(result["reaction_us"] for result in results)})
+    return results
+
+class _Encoder: # Simulated quadrature encoder on axis 0, follows the step pin unless steps are lost
+    GRAY = ((0, 0), (1, 0), (1, 1), (0, 1))      # (B, A) of count 0, 1, 2, 3 (mod 4)
+
+    def __init__(self):
+        e = pio_emulator.emulator
+        self.step_pin, self.dir_pin = step_driver.axes[0]
+        self.pin_a, self.cpr = encoder.encoders[0]
+        self.position = 0                        # Steps the motor really made
+        self.count = 0
+        self.pulses = 0                          # Step pulses seen
+        self.lose = ()                           # Pulses the motor misses
+        self.stall = None                        # Pulse after which it misses every one
+        e.drive(self.pin_a, 0)
+        e.drive(self.pin_a + 1, 0)
+        e.watch(self.step_pin, self.step)
+
+    def step(self, pin, level):
+        if not level:
+            return
+        e = pio_emulator.emulator
+        self.pulses += 1
+        if self.pulses in self.lose or (self.stall is not None and self.pulses > self.stall):
+            return
+        self.position += -1 if e.level[self.dir_pin] else 1
+        target = self.position * abs(self.cpr) // ctrl.steps_per_rev
+        k = 0
+        while self.count != target:              # One quadrature edge every 10 us
+            self.count += 1 if target > self.count else -1
+            b, a = self.GRAY[self.count % 4]
+            k += 1
+            e.drive(self.pin_a, a, at_us=10 * k)
+            e.drive(self.pin_a + 1, b, at_us=10 * k)
+
+    def close(self):
+        pio_emulator.emulator.unwatch(self.step_pin, self.step)
+
+def closed_loop(): # encoder.steps() on axis 0 with a clean move, lost steps and a stall, needs the emulator's simulated encoder
+    if not pio_emulator:
+        return []
+    encoders, freq = encoder.encoders, encoder.freq
+    encoder.encoders = [encoder_pins] + [None] * 3  # Axis 0 only, the default has no encoders
+    encoder.freq = encoder_freq
+    sim = _Encoder()
+    results = []
+    try:
+        encoder.start()
+        for name, lose, stall in (("clean", None, None), ("lost {}".format(encoder_lost), 10, None),
+                                  ("stall", None, encoder_steps // 4)): # Pulses into the move
+            sim.lose = () if lose is None else range(sim.pulses + lose, sim.pulses + lose + encoder_lost)
+            sim.stall = None if stall is None else sim.pulses + stall
+            before = encoder.corrections
+            detected = False
+            try:
+                encoder.steps(encoder_steps)
+            except RuntimeError:
+                detected = True
+            results.append({"name": name, "steps": encoder_steps, "corrections": encoder.corrections - before,
+                            "stall_detected": detected, "stalled": encoder.stalled[0],
+                            "error_steps": step_driver.position[0] - sim.position})
+        sim.stall = None
+        encoder.steps(-step_driver.position[0])
+    finally:
+        sim.close()
+        encoder.stop()
+        encoder.encoders, encoder.freq = encoders, freq
+    return results
+
+def _load_experimental(): # experimental sets up its state machines when imported
+    ctrl.release_state_machines()
+    sys.path.append("experimental")
+    import experimental
+    return experimental
+
+def _unload_experimental(ex): # Gives the state machines back to stepper_controller
+    for sm in (ex.sm_0, ex.sm_1, ex.sm_2, ex.sm_3, ex.sm_4, ex.sm_5, ex.sm_6, ex.sm_7):
+        sm.active(0)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(ex.step_counter)
+        rp2.PIO(block).remove_program(ex.step_speed)
+    del sys.modules["experimental"]      # So the next run() imports it, and its state machines, again
+    ctrl.dir_pin_1.init(Pin.OUT, value=0) # Pin 16 was a step pin in experimental
+    ctrl.setup_state_machines()
+
+def run(path="benchmark_results.json", experimental=True): # Runs everything and writes the results to path
+    results = {"platform": _platform, "sys_freq": machine.freq(),
+               "step_rate": step_rate(), "feed_rate": feed_rate(), "latency": latency(), "dead_time": dead_time(),
+               "ramp": ramp(), "interpolator": interpolate(), "segment_sync": segment_sync(),
+               "start_skew": start_skew(), "kinematics": ik(),
+               "planner": plan(), "program_cache": cache(), "profile": profile(), "path": curves(), "realtime": realtime_heap(),
+               "boot": boot(), "analyzer": capture(), "homing": home(),
+               "encoder": closed_loop()}
+    if experimental:
+        ex = _load_experimental()
+        try:
+            results["step_rate"] += step_rate(ex)
+            results["latency"] += latency(ex)
+            results["dead_time"] += dead_time(ex)
+            results["end_skew"] = end_skew(ex)
+            results["profile"] += profile(ex)
+        finally:
+            _unload_experimental(ex)
+    with open(path, "w") as f:
+        json.dump(results, f)
+    return results
+
+         ### Comparing runs ###
+def _flatten(results): # {"step_rate/ctrl sc=.. ss=../rate_hz": value, ...}
+    values = {}
+    for section, rows in results.items():
+        if isinstance(rows, list):
+            for row in rows:
+                for key, value in row.items():
+                    if key != "name" and isinstance(value, (int, float)):
+                        values[section + "/" + row["name"] + "/" + key] = value
+    return values
+
+def compare(old_path, new_path): # Prints every number that changed between two result files
+    with open(old_path) as f:
+        old = _flatten(json.load(f))
+    with open(new_path) as f:
+        new = _flatten(json.load(f))
+    for key in sorted(new):
+        if key not in old:
+            print("{:70} {:>14} {:>14}".format(key, "-", new[key]))
+        elif old[key] != new[key]:
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+            print("{:70} {:>14} {:>14} {:+8.1f}%".format(key, old[key], new[key], change))
+    for key in sorted(set(old) - set(new)):
+        print("{:70} {:>14} {:>14}".format(key, old[key], "-"))
+
+if __name__ == "__main__":
+    if "--compare" in sys.argv:
+        i = sys.argv.index("--compare")
+        compare(sys.argv[i + 1], sys.argv[i + 2])
+    else:
+        results = run(sys.argv[1] if len(sys.argv) > 1 else "benchmark_results.json")
+        for section in ("step_rate", "feed_rate", "latency", "dead_time", "ramp", "interpolator", "segment_sync", "start_skew", "end_skew", "kinematics", "planner", "program_cache", "profile", "path", "realtime", "boot", "analyzer", "homing", "encoder"):
+            for row in results.get(section, ()):
+                print(section, row)
@@ -0,0 +1,414 @@
+         ### Libraries ###
+import sys
+import time                                 # Timestamps of the sync edge and the first step
+import struct                               # Frames on the UART
+from array import array                     # State of every board on the master
+from machine import Pin
+import stepper_controller as ctrl           # ThreadSafeFlag
+import step_driver                          # Runs the axes of every board
+asyncio = ctrl.asyncio
+
+# chain links several Picos into one machine with more axes. Every board runs
+# step_driver with its own axes (4 by default, up to 8), 4 boards give 16 axes.
+# The UARTs form a ring and one sync wire goes from the master to every board:
+#
+#   master TX -> RX board 1 TX -> RX board 2 TX -> ... -> RX last board TX -> RX master
+#   master sync_pin --+-- sync_pin board 1 --+-- sync_pin board 2 ...   (and a common GND)
+#
+# The master sends every board its part of a move ahead of time. A board loads
+# it into its state machines and answers "ready". The state machines of every
+# board, the master included, wait for the sync pin instead of the activation pin
+# (step_driver.start_pin), so when every board is ready and the master pulses the
+# sync wire, they all start on the same edge: no UART message and no interrupt
+# latency in between, only the input synchronizer and the PIO clock. Each board
+# timestamps the sync edge and its first step in hard IRQs and reports "done"
+# with the time in between, the spread of those over the boards is the start skew.
+#
+# On the master:   chain.setup(UART(0, 921600, tx=Pin(0), rx=Pin(1), timeout=0, rxbuf=1024))
+#                  await chain.start()                      (numbers the boards, chain.boards = axes per board)
+#                  await chain.put(100, 0, -50, 0, 200, 200, 0, 0, ...)   (one step count per axis, all boards)
+#                  await chain.drain(); chain.stats()
+# On a board:      chain.run(UART(0, 921600, tx=Pin(0), rx=Pin(1), timeout=0, rxbuf=1024))
+# On a computer:   python emulator/run.py chain.py --local 4   (4 boards, socketpairs instead of UARTs)
+
+         ### Settings ###
+sync_pin = 22        # Sync wire, an output on the master and an input on the boards
+pulse_us = 20        # Length of the sync pulse, the state machines must see it (several step_driver cycles)
+queue_size = 8       # Moves the master sends ahead of the slowest board
+timeout_ms = 1000    # How long start() waits for the numbering to come back around the ring
+
+         ### Global Variables ###
+_SOF = 0xA5                                       # Frame: _SOF, to, kind, length, payload, sum of to..payload & 0xFF
+_ALL = 0xFF                                       # "to" of a frame for every board
+_ENUM = 1                                         # payload: axes of every board so far, each board adds its own
+_SEG = 2                                          # payload: move number, (steps, delay) per axis
+_READY = 3                                        # payload: board, move number
+_DONE = 4                                         # payload: board, move number, sync to first step [us]
+_STOP = 5                                         # step_driver gives the state machines back, serve() returns
+address = 0                                       # 0 = master, boards are numbered 1.. around the ring by start()
+boards = []                                       # Axes of every board, boards[0] is the master
+errors = 0                                        # Frames dropped because their checksum was wrong
+_queue = []                                       # (move, steps, delays) this board has not run yet
+_queued = ctrl.ThreadSafeFlag()                   # Set when a move is queued or the board stops
+_running = False
+_probes = []                                      # Step pin of every axis, the first stepping one is timed
+_t_sync = None                                    # ticks_us() of the sync edge
+_t_step = None                                    # ticks_us() of the first step after it
+_link = None                                      # UART to the next board
+_ready = array("i")                               # Last move every board is ready for
+_done = array("i")                                # Last move every board has finished
+latency = array("i")                              # Sync edge to first step of every board in the last move [us], -1 = no steps
+_moves = 0                                        # Moves sent by put()
+_started = 0                                      # Moves started with the sync wire
+_measured = 0                                     # Moves with a start skew
+skew = -1                                         # Start skew of the last move [us]
+max_skew = -1                                     # Largest start skew since start() [us]
+_news = asyncio.Event()                           # Set whenever a board reports
+_tasks = []                                       # Runner, reader and sequencer of the master
+_sync = None                                      # Sync pin
+_start_pin = None                                 # step_driver.start_pin before chain took over
+
+         ### UART frames ###
+class _Link: # One UART, or anything with readinto() and write(): collects bytes into frames
+    def __init__(self, rx, tx=None):
+        self.rx = rx
+        self.tx = tx or rx
+        self.buf = bytearray(2 * 260)             # Two of the longest frames
+        self.n = 0                                # Bytes in buf
+        self.length = 0                           # Bytes of the frame returned by frame(), drop() removes them
+
+    def send(self, to, kind, payload=b""):
+        frame = bytearray(5 + len(payload))
+        frame[0] = _SOF
+        frame[1] = to
+        frame[2] = kind
+        frame[3] = len(payload)
+        frame[4:4 + len(payload)] = payload
+        frame[-1] = sum(frame[1:-1]) & 0xFF
+        self.tx.write(frame)
+
+    def frame(self): # Returns (to, kind, payload) of the next complete frame or None, call drop() after it
+        global errors
+        if self.n < len(self.buf):
+            got = self.rx.readinto(memoryview(self.buf)[self.n:])
+            if got:
+                self.n += got
+        buf = self.buf
+        while self.n:
+            start = 0
+            while start < self.n and buf[start] != _SOF:   # Resynchronizes after noise
+                start += 1
+            if start:
+                self.length = start
+                self.drop()
+            if self.n < 4 or self.n < 5 + buf[3]:
+                return None
+            self.length = 5 + buf[3]
+            if sum(buf[1:self.length - 1]) & 0xFF == buf[self.length - 1]:
+                return buf[1], buf[2], bytes(buf[4:self.length - 1])
+            errors += 1
+            self.length = 1                       # Not a frame after all, look for the next _SOF
+            self.drop()
+        return None
+
+    def forward(self): # Sends the frame returned by frame() on to the next board
+        self.tx.write(bytes(self.buf[:self.length]))
+
+    def drop(self):
+        self.buf[0:self.n - self.length] = self.buf[self.length:self.n]
+        self.n -= self.length
+        self.length = 0
+
+         ### Board ###
+# Every board, the master included, runs its moves the same way: load the next
+# move into step_driver, report "ready", let the sync pulse start it, report "done".
+def _sync_handler(pin): # Hard IRQ on the sync edge, the state machines have started on it already
+    global _t_sync
+    _t_sync = time.ticks_us()
+
+def _step_handler(pin): # Hard IRQ on the step pin that is timed
+    global _t_step
+    if _t_step is None:
+        _t_step = time.ticks_us()
+
+def _board_start(master):
+    global _running, _probes, _sync, _start_pin
+    _start_pin = step_driver.start_pin
+    step_driver.start_pin = sync_pin
+    step_driver.start()
+    _probes = [Pin(step_pin) for step_pin, dir_pin in step_driver.axes]
+    if master:
+        _sync = Pin(sync_pin, Pin.OUT, value=0)
+    else:
+        _sync = Pin(sync_pin, Pin.IN, Pin.PULL_DOWN)
+    _sync.irq(_sync_handler, Pin.IRQ_RISING, hard=True)
+    _running = True
+
+def _board_stop():
+    global _running
+    _running = False
+    _sync.irq(None)
+    _queued.set()
+
+async def _runner(report): # Runs the queued moves one at a time, report(kind, move, latency) tells the master
+    global _t_sync, _t_step
+    while True:
+        while not _queue:
+            if not _running:
+                step_driver.stop()
+                step_driver.start_pin = _start_pin
+                return
+            await _queued.wait()
+        move, steps, delays = _queue.pop(0)
+        while _sync.value():                 # The last sync pulse must be over or this move starts right away
+            await asyncio.sleep_ms(0)
+        probe = None
+        for axis in range(len(steps)):
+            if steps[axis]:
+                probe = _probes[axis]
+                break
+        _t_sync = _t_step = None
+        if probe:
+            probe.irq(_step_handler, Pin.IRQ_RISING, hard=True)
+        step_driver.load(steps, delays)
+        report(_READY, move, 0)
+        await step_driver.wait()
+        if probe:
+            probe.irq(None)
+        if _t_sync is None or _t_step is None:
+            report(_DONE, move, -1)
+        else:
+            report(_DONE, move, time.ticks_diff(_t_step, _t_sync))
+
+def _segment(payload): # _SEG payload to (move, steps, delays)
+    move = struct.unpack_from("<I", payload, 0)[0]
+    n = (len(payload) - 4) // 8
+    steps = [0] * n
+    delays = [0] * n
+    for axis in range(n):
+        steps[axis], delays[axis] = struct.unpack_from("<iI", payload, 4 + 8 * axis)
+    return move, steps, delays
+
+async def serve(rx, tx=None): # A board: runs what the master sends until it sends _STOP
+    global address, _link
+    _link = _Link(rx, tx)
+    _board_start(False)
+
+    def report(kind, move, value):
+        if kind == _READY:
+            _link.send(0, kind, struct.pack("<BI", address, move))
+        else:
+            _link.send(0, kind, struct.pack("<BIi", address, move, value))
+
+    runner = asyncio.create_task(_runner(report))
+    while _running:
+        frame = _link.frame()
+        if frame is None:
+            await asyncio.sleep_ms(1)
+            continue
+        to, kind, payload = frame
+        if kind == _ENUM and to == _ALL:     # Takes the next number and adds its axes
+            address = len(payload)
+            _link.drop()
+            _link.send(_ALL, _ENUM, payload + bytes([len(step_driver.axes)]))
+            continue
+        if to == address and kind == _SEG:
+            _queue.append(_segment(payload))
+            _queued.set()
+        elif kind == _STOP:
+            _board_stop()
+        if to != address:
+            _link.forward()
+        _link.drop()
+    await runner
+
+def run(uart): # Blocking serve() for a board
+    asyncio.run(serve(uart))
+
+         ### Master ###
+def setup(rx, tx=None): # The UART of the ring, tx if the ring ends on another one
+    global _link
+    _link = _Link(rx, tx)
+
+def _answer(board, kind, move, value): # A board is ready or done
+    global skew, max_skew, _measured
+    if kind == _READY:
+        _ready[board] = move
+    elif kind == _DONE:
+        _done[board] = move
+        latency[board] = value
+        if min(_done) >= _measured:          # Every board has done this move, the latencies belong together
+            _measured += 1
+            low = high = -1
+            for t in latency:
+                if t >= 0:
+                    low = t if low < 0 or t < low else low
+                    high = t if t > high else high
+            skew = high - low if low >= 0 else -1
+            max_skew = skew if skew > max_skew else max_skew
+    _news.set()
+    _news.clear()
+
+async def _until(condition): # Waits until a board report makes condition() true
+    while not condition():
+        await _news.wait()
+
+async def _reader(): # Frames coming back around the ring
+    while _running:
+        frame = _link.frame()
+        if frame is None:
+            await asyncio.sleep_ms(1)
+            continue
+        to, kind, payload = frame
+        _link.drop()
+        if kind == _READY:
+            board, move = struct.unpack("<BI", payload)
+            _answer(board, kind, move, 0)
+        elif kind == _DONE:
+            board, move, value = struct.unpack("<BIi", payload)
+            _answer(board, kind, move, value)
+
+async def _sequencer(): # Starts every move once all boards are ready for it
+    global _started
+    while True:
+        await _until(lambda: min(_ready) >= _started or not _running)
+        if not _running:
+            return
+        _sync.value(1)
+        time.sleep_us(pulse_us)
+        _sync.value(0)
+        _started += 1
+
+async def start(): # Numbers the boards around the ring and gets everything running
+    global boards, _ready, _done, latency, _moves, _started, _measured, skew, max_skew, _tasks
+    _link.send(_ALL, _ENUM, bytes([len(step_driver.axes)]))
+    t = time.ticks_ms()
+    while True:
+        frame = _link.frame()
+        if frame is not None:
+            to, kind, payload = frame
+            _link.drop()
+            if kind == _ENUM:
+                break
+        elif time.ticks_diff(time.ticks_ms(), t) > timeout_ms:
+            raise OSError("chain: the numbering did not come back, check the ring")
+        await asyncio.sleep_ms(1)
+    boards = list(payload)
+    n = len(boards)
+    _ready = array("i", [-1] * n)
+    _done = array("i", [-1] * n)
+    latency = array("i", [-1] * n)
+    _moves = _started = _measured = 0
+    skew = max_skew = -1
+    _board_start(True)
+    _tasks = [asyncio.create_task(_runner(lambda kind, move, value: _answer(0, kind, move, value))),
+              asyncio.create_task(_reader()),
+              asyncio.create_task(_sequencer())]
+
+async def put(*steps, delays=None): # One step count per axis of every board in board order, delays for all axes or None
+    global _moves
+    if len(steps) > sum(boards):
+        raise ValueError("more steps than axes")
+    await _until(lambda: _moves - min(_done) <= queue_size)
+    first = 0
+    for board in range(len(boards)):
+        n = boards[board]
+        if board == 0:
+            part = [steps[first + axis] if first + axis < len(steps) else 0 for axis in range(n)]
+            _queue.append((_moves, part, None if delays is None else delays[first:first + n]))
+            _queued.set()
+        else:
+            payload = bytearray(4 + 8 * n)
+            struct.pack_into("<I", payload, 0, _moves)
+            for axis in range(n):
+                i = first + axis
+                struct.pack_into("<iI", payload, 4 + 8 * axis, round(steps[i]) if i < len(steps) else 0,
+                                 step_driver.delay if delays is None or i >= len(delays) else delays[i])
+            _link.send(board, _SEG, payload)
+        first += n
+    _moves += 1
+
+async def drain(): # Waits until every board has finished every move
+    await _until(lambda: min(_done) >= _moves - 1)
+
+async def stop(): # Stops every board and the master, step_driver hands the state machines back
+    await drain()
+    _link.send(_ALL, _STOP)
+    _board_stop()
+    _news.set()
+    _news.clear()
+    for task in _tasks:
+        await task
+
+def stats(): # Returns (moves done by every board, start skew of the last move, largest start skew) in us
+    return min(_done) + 1, skew, max_skew
+
+         ### On a computer ###
+# --local n runs the master here and n - 1 boards as processes, each on its own
+# emulator. Socketpairs stand in for the UARTs and the sync wire carries the level
+# of the master's sync pin to the boards as a byte.
+def _stream(fd):
+    import socket
+    sock = socket.socket(fileno=fd)
+    sock.setblocking(False)
+    return sock.makefile("rwb", buffering=0)
+
+async def _wire(stream): # A board: drives its sync pin from the level bytes of the wire
+    import pio_emulator
+    level = bytearray(1)
+    while True:
+        if stream.readinto(level):           # Every level lasts at least 1 ms, long enough for the state machines
+            pio_emulator.emulator.drive(sync_pin, level[0])
+        await asyncio.sleep_ms(1)
+
+async def _local_board(rx, tx, wire):
+    wire = _stream(wire)
+    wire.write(b"\x01")                     # Up and running, start() on the master only waits in emulated time
+    task = asyncio.create_task(_wire(wire))
+    await serve(_stream(rx), _stream(tx))
+    task.cancel()
+    _pulses("board {}".format(address))
+
+def _pulses(name): # Steps where step_driver thinks the axes are and the step pulses the emulator saw
+    import pio_emulator
+    print(name, "position", list(step_driver.position[:len(step_driver.axes)]), "pulses",
+          [len(pio_emulator.emulator.rising(step_pin)) for step_pin, dir_pin in step_driver.axes], file=sys.stderr)
+
+def _local(n, moves):
+    import os, socket, subprocess
+    import pio_emulator
+    here = os.path.dirname(os.path.abspath(__file__))
+    links = [socket.socketpair() for _ in range(n)]        # links[i] carries board i's TX to board i + 1
+    wires = [socket.socketpair() for _ in range(n - 1)]
+    boards_ = []
+    for board in range(1, n):
+        fds = (links[board - 1][1].fileno(), links[board % n][0].fileno(), wires[board - 1][1].fileno())
+        boards_.append(subprocess.Popen([sys.executable, os.path.join(here, "emulator", "run.py"), os.path.abspath(__file__),
+                                         "--board"] + [str(fd) for fd in fds], pass_fds=fds, stdout=subprocess.DEVNULL))
+    ends = [wire[0] for wire in wires]
+    for end in ends:
+        end.recv(1)
+    pio_emulator.emulator.watch(sync_pin, lambda pin, level: [end.send(bytes([level])) for end in ends])
+    setup(_stream(links[n - 1][1].fileno()), _stream(links[0][0].fileno()))
+
+    async def master():
+        await start()
+        print("boards", boards, "axes", sum(boards))
+        for move in moves:
+            await put(*move)
+        await drain()
+        print("moves", stats()[0], "start skew last", skew, "us, max", max_skew, "us, latency", list(latency), "us")
+        await stop()
+
+    asyncio.run(master())
+    _pulses("board 0")
+    for board in boards_:
+        board.wait()
+
+if __name__ == "__main__":
+    if "--board" in sys.argv:
+        i = sys.argv.index("--board")
+        asyncio.run(_local_board(*[int(fd) for fd in sys.argv[i + 1:i + 4]]))
+    elif "--local" in sys.argv:
+        n = int(sys.argv[sys.argv.index("--local") + 1])
+        _local(n, [[(100 + 25 * axis) * (-1 if move & 1 else 2) for axis in range(4 * n)] for move in range(6)])
@@ -0,0 +1,120 @@
+         ### Libraries ###
+import pio_emulator as emu       # The emulated hardware
+
+# Stand-in for the parts of MicroPython's machine module this repository uses.
+# Pins live in pio_emulator so PIO and Python see the same levels.
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, *, value=None, drive=0, alt=-1):
+        if id == "LED":
+            id = 25
+        if not isinstance(id, int) or not 0 <= id < emu.NUM_PINS:
+            raise ValueError("invalid pin")
+        self._id = id
+        self._irq = None
+        self.init(mode, pull, value=value)
+
+    def __repr__(self):
+        e = emu.emulator
+        if e.func[self._id]:
+            return "Pin(GPIO{}, mode=ALT, alt=PIO{})".format(self._id, e.func[self._id] - 1)
+        return "Pin(GPIO{}, mode={})".format(self._id, "OUT" if e.sio_oe[self._id] else "IN")
+
+    def init(self, mode=-1, pull=-1, *, value=None, drive=0, alt=-1):
+        e = emu.emulator
+        if pull == Pin.PULL_UP:
+            e.pull[self._id] = 1
+        elif pull == Pin.PULL_DOWN:
+            e.pull[self._id] = 0
+        if mode in (Pin.OUT, Pin.OPEN_DRAIN):
+            e.sio_init(self._id, True, value)
+        elif mode == Pin.IN:
+            e.sio_init(self._id, False, value)
+        elif value is not None:
+            e.sio_write(self._id, value)
+
+    def value(self, value=None):
+        e = emu.emulator
+        e.cpu()
+        if value is None:
+            return e.level[self._id]
+        e.sio_write(self._id, value)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def toggle(self):
+        e = emu.emulator
+        e.sio_write(self._id, e.sio_out[self._id] ^ 1)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        e = emu.emulator
+        if self._irq is not None:
+            e.unwatch(self._id, self._irq)
+            self._irq = None
+        if handler is None:
+            return
+        pin = self
+
+        def edge(id, level):
+            if trigger & (Pin.IRQ_RISING if level else Pin.IRQ_FALLING):
+                e.interrupt(handler, pin)
+
+        self._irq = edge
+        e.watch(self._id, edge)
+
+class _Mem:
+    def __init__(self, width):
+        self._mask = (1 << width) - 1
+
+    def __getitem__(self, address):
+        return emu.emulator.mem_read(address & ~3) & self._mask
+
+    def __setitem__(self, address, value):
+        emu.emulator.mem_write(address & ~3, value & self._mask)
+
+mem8 = _Mem(8)
+mem16 = _Mem(16)
+mem32 = _Mem(32)
+
+def freq(hz=None):
+    e = emu.emulator
+    if hz is None:
+        return e.sys_freq
+    e.set_freq(hz)
+
+def idle():
+    emu.emulator.idle()
+
+def disable_irq():
+    return emu.emulator.disable_irq()
+
+def enable_irq(state=0):
+    emu.emulator.enable_irq(state)
+
+def unique_id():
+    return b"\xe6\x60\x00\x00\x00\x00\x00\x00"
+
+def reset():
+    raise SystemExit("machine.reset()")
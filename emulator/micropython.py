@@ -0,0 +1,44 @@
+         ### Libraries ###
+import builtins                  # viper's types and pointers are builtins inside viper functions
+import pio_emulator as emu       # IRQ handlers are scheduled by the emulator
+
+# Stand-in for MicroPython's micropython module. The code emitters are plain Python here.
+
+def const(value):
+    return value
+
+def native(f):
+    return f
+
+def viper(f):
+    return f
+
+class _Ptr: # ptr32(address) etc. in a viper function, reads and writes go to the emulated registers
+    def __init__(self, address, size):
+        self._address = address
+        self._size = size
+        self._mask = (1 << (8 * size)) - 1
+
+    def __getitem__(self, i):
+        address = self._address + i * self._size
+        emu.emulator.cpu(emu.NATIVE_CYCLES)
+        return emu.emulator.mem_read(address & ~3) >> (8 * (address & 3)) & self._mask
+
+    def __setitem__(self, i, value):
+        emu.emulator.cpu(emu.NATIVE_CYCLES)
+        emu.emulator.mem_write(self._address + i * self._size, value & self._mask)
+
+# Types and pointers that only exist inside viper functions
+builtins.uint = int
+builtins.ptr8 = lambda address: _Ptr(address, 1)
+builtins.ptr16 = lambda address: _Ptr(address, 2)
+builtins.ptr32 = lambda address: _Ptr(address, 4)
+
+def schedule(fn, arg):
+    emu.emulator.interrupt(fn, arg)
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def mem_info(verbose=None):
+    pass
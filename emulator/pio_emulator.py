@@ -0,0 +1,1194 @@
+         ### Libraries ###
+import heapq                     # Picks the state machine or event that is due next
+from array import array          # Compact pin trace
+from collections import deque    # FIFOs
+
+# pio_emulator runs the PIO programs of this repository on a computer, so moves
+# can be checked and timed without a Pico (CI, benchmarks, development).
+# rp2.py and machine.py in this folder are stand-ins for the MicroPython modules
+# of the same name and drive the emulator below, so stepper_controller.py and the
+# other modules import and run unmodified. emulator/run.py sets that up.
+#
+# The emulator keeps its own clock. Time only moves when MicroPython code would
+# spend it: time.sleep(), asyncio.sleep(), machine.idle() (the ThreadSafeFlag
+# wait), a put() into a full FIFO and a small cost per hardware call. While time
+# moves, every enabled state machine executes its program instruction by
+# instruction on its own clock divider, with FIFOs, IRQ flags, side-set, wait,
+# DMA and the 2 cycle GPIO input synchronizer. Every pin edge is recorded with
+# the system clock cycle it happened on.
+#
+# To stay fast enough for long moves, state machines that are stalled (waiting
+# for an IRQ flag, a pin or a FIFO) are not stepped at all until something they
+# wait for changes, and pure delay loops (jmp(x_dec) back to itself, optionally
+# with nops in between) are skipped in one go. Both give exactly the same timing
+# as stepping every cycle.
+
+         ### Emulator settings ###
+SUB = 256                # Time is kept in 1/256 system clock cycles, the resolution of the clock dividers
+SYNC_CYCLES = 2          # GPIO input synchronizer, a pin change is seen by PIO 2 cycles later
+IRQ_LATENCY = 125        # [cycles] from a PIO irq 0-3 until MicroPython's hard IRQ has acknowledged it (~1 us)
+CALL_CYCLES = 1250       # [cycles] spent by each rp2/machine call (~10 us of MicroPython at 125 MHz)
+NATIVE_CYCLES = 2        # [cycles] per register load or store through ptr32() etc. in a viper function
+IDLE_US = 1000           # machine.idle() returns after at most this long if no interrupt comes
+DEADLOCK_S = 60          # Raise when nothing has been scheduled for this long while idling
+NUM_PINS = 30
+
+# Decoded instruction kinds
+_JMP, _WAIT, _IN, _OUT, _PUSH, _PULL, _MOV, _IRQ, _SET = range(9)
+_INF = 1 << 62
+_MASK = 0xFFFFFFFF
+
+# Why a state machine is stalled, so only the right events wake it
+_IRQ_FLAG = 1
+_TX = 2
+_RX = 3
+_GPIO = 4
+
+         ### Instruction decoding ###
+def decode(instr, sideset_count=0, sideset_opt=False): # 16 bit PIO instruction to (kind, a, b, c, cycles, side)
+    delay_bits = 5 - sideset_count
+    field = (instr >> 8) & 0x1F
+    delay = (field & ((1 << delay_bits) - 1)) + 1      # Cycles the instruction takes, delay included
+    side = -1
+    if sideset_count:
+        value = field >> delay_bits
+        if not sideset_opt:
+            side = value
+        elif value >> (sideset_count - 1):
+            side = value & ((1 << (sideset_count - 1)) - 1)
+    kind = instr >> 13
+    arg = instr & 0xFF
+    if kind == 0:
+        return (_JMP, (arg >> 5) & 7, arg & 0x1F, 0, delay, side)
+    if kind == 1:
+        return (_WAIT, arg >> 7, (arg >> 5) & 3, arg & 0x1F, delay, side)
+    if kind == 2:
+        return (_IN, (arg >> 5) & 7, (arg & 0x1F) or 32, 0, delay, side)
+    if kind == 3:
+        return (_OUT, (arg >> 5) & 7, (arg & 0x1F) or 32, 0, delay, side)
+    if kind == 4:
+        return (_PULL if arg & 0x80 else _PUSH, (arg >> 6) & 1, (arg >> 5) & 1, 0, delay, side)
+    if kind == 5:
+        return (_MOV, (arg >> 5) & 7, (arg >> 3) & 3, arg & 7, delay, side)
+    if kind == 6:
+        return (_IRQ, (arg >> 6) & 1, (arg >> 5) & 1, arg & 0x1F, delay, side)
+    return (_SET, (arg >> 5) & 7, arg & 0x1F, 0, delay, side)
+
+def _is_nop(ins): # mov(y, y) / mov(x, x) without side-set
+    return ins[0] == _MOV and ins[1] == ins[3] and ins[1] in (1, 2) and ins[2] == 0 and ins[5] < 0
+
+def _reverse(value):
+    return int("{:032b}".format(value)[::-1], 2)
+
+         ### Hardware model ###
+class _SM:
+    def __init__(self, emu, block, index):
+        self.emu = emu
+        self.block = block
+        self.index = index                 # 0-3 within the block
+        self.id = block.index * 4 + index  # 0-7, as rp2.StateMachine numbers them
+        self.obj = None                    # rp2.StateMachine object, passed to IRQ handlers
+        self.enabled = False
+        self.version = 0
+        self.configure([], 0, False, 0, 0, 0, 0)
+
+    def configure(self, program, sideset_count, sideset_opt, execctrl, shiftctrl, wrap_bottom, wrap_top):
+        self.words = list(program)
+        self.sideset_count = sideset_count
+        self.sideset_opt = sideset_opt
+        self.wrap_bottom = wrap_bottom
+        self.wrap_top = wrap_top
+        self.code = [self.decode(w) for w in self.words]
+        self.after = [wrap_bottom if pc == wrap_top else pc + 1 for pc in range(len(self.code))]
+        self.set_execctrl(execctrl)
+        self.autopush = (shiftctrl >> 16) & 1
+        self.autopull = (shiftctrl >> 17) & 1
+        self.in_right = (shiftctrl >> 18) & 1
+        self.out_right = (shiftctrl >> 19) & 1
+        self.push_thresh = ((shiftctrl >> 20) & 0x1F) or 32
+        self.pull_thresh = ((shiftctrl >> 25) & 0x1F) or 32
+        join = (shiftctrl >> 30) & 3
+        self.tx_depth = 8 if join == 1 else 0 if join == 2 else 4
+        self.rx_depth = 8 if join == 2 else 0 if join == 1 else 4
+        self.loops = [self._loop_cycles(pc) for pc in range(len(self.code))]
+        self.div = SUB
+        self.origin = self.emu.now
+        self.in_base = self.out_base = self.set_base = self.side_base = 0
+        self.out_count = self.set_count = self.side_count = 0
+        self.jmp_pin = 0
+        self.reset()
+
+    def set_execctrl(self, execctrl): # The fields of SMx_EXECCTRL the emulator uses, the rest is kept for reading back
+        self.execctrl = execctrl
+        self.side_pindir = (execctrl >> 29) & 1
+        self.status_sel = (execctrl >> 4) & 1
+        self.status_n = execctrl & 0xF
+
+    def decode(self, instr): # Decodes with this state machine's side-set and resolves rel() IRQ flags
+        ins = decode(instr, self.sideset_count, self.sideset_opt)
+        if ins[0] in (_WAIT, _IRQ) and (ins[0] == _IRQ or ins[2] == 2):
+            index = ins[3]
+            if index & 0x10:
+                index = (index & 4) | ((index + self.index) & 3)
+            ins = ins[:3] + (index & 7,) + ins[4:]
+        return ins
+
+    def _loop_cycles(self, pc): # Cycles per pass of a delay loop ending in a jmp(x_dec/y_dec) at pc, 0 if it isn't one
+        ins = self.code[pc]
+        if ins[0] != _JMP or ins[1] not in (2, 4) or ins[2] > pc:
+            return 0
+        body = self.code[ins[2]:pc]
+        if any(not _is_nop(b) for b in body):
+            return 0
+        if ins[2] <= self.wrap_top < pc:
+            return 0
+        return sum(b[4] for b in body) + ins[4]
+
+    def reset(self): # pio_sm_init(): registers, FIFOs and shift counters cleared, pc at the program start
+        self.pc = 0
+        self.x = self.y = 0
+        self.isr = self.osr = 0
+        self.isr_n = 0
+        self.osr_n = 32                    # Empty, so autopull fills it on the first out()
+        self.tx = deque()
+        self.rx = deque()
+        self.restart()
+
+    def restart(self): # SM_RESTART: stall, delay and irq wait state are dropped, pc/x/y/osr are kept
+        self.stall = 0
+        self.pending = None                # Instruction from exec() waiting to run
+        self.irq_wait = -1
+        self.ff = None                     # Delay loop being skipped: (start, value, cycles, reg, pc)
+        self.next_t = self.emu.now
+
+    def next_edge(self, t): # First clock edge of this state machine after t
+        k = (t - self.origin) // self.div + 1
+        return self.origin + k * self.div
+
+class _Block:
+    def __init__(self, emu, index):
+        self.emu = emu
+        self.index = index
+        self.base = 0x50200000 + 0x100000 * index
+        self.sms = [_SM(emu, self, i) for i in range(4)]
+        self.flags = 0                     # IRQ flags 0-7
+        self.flag_t = [-1] * 8             # When each flag last changed
+        self.out = 0                       # Pin values driven by this block
+        self.oe = 0                        # Pin directions driven by this block
+        self.irq_enabled = 0               # Flags 0-3 routed to the CPU (IRQ_SM0..3)
+        self.sm_handlers = [None] * 4      # sm.irq() handlers
+        self.stalled = []                  # State machines waiting for an IRQ flag
+        self.pio_handler = None            # PIO.irq() handler
+        self.pio_trigger = 0
+        self.pio_obj = None
+        self.memory = [None] * 32          # Program loaded in each instruction slot
+
+class _Channel:
+    def __init__(self, emu, index):
+        self.emu = emu
+        self.index = index
+        self.obj = None                    # rp2.DMA object
+        self.handler = None
+        self.claimed = False
+        self.busy = False
+        self.read = self.write = None      # (kind, target, offset)
+        self.count = 0
+        self.ctrl = 0
+
+    # CTRL fields
+    def size(self):
+        return 1 << ((self.ctrl >> 2) & 3)
+
+    def treq(self):
+        return (self.ctrl >> 15) & 0x3F
+
+class Emulator:
+    def __init__(self, sys_freq=125_000_000):
+        self.sys_freq = sys_freq
+        self.now = 0                       # Time in 1/SUB system clock cycles
+        self._us_base = 0                  # ticks_us() at _t_base, so machine.freq() keeps time monotonic
+        self._t_base = 0
+        self.blocks = [_Block(self, 0), _Block(self, 1)]
+        self.dma = [_Channel(self, i) for i in range(12)]
+        self.level = [0] * NUM_PINS        # What the pins are at
+        self.prev = [0] * NUM_PINS         # Level before the last change, for the input synchronizer
+        self.changed = [-_INF] * NUM_PINS  # When each pin last changed
+        self.func = [0] * NUM_PINS         # 0 = SIO (Python), 1 = PIO block 0, 2 = PIO block 1
+        self.sio_out = [0] * NUM_PINS
+        self.sio_oe = [0] * NUM_PINS
+        self.ext = [None] * NUM_PINS       # Level driven from outside (drive()), None = floating
+        self.pull = [0] * NUM_PINS
+        self.watchers = [[] for _ in range(NUM_PINS)]
+        self.trace_pins = None             # Pins to record, None = all of them
+        self.clear_trace()
+        self.memory = {}                   # mem32 locations nothing emulates
+        self.call_cycles = CALL_CYCLES
+        self.instructions = 0              # Executed, skipped delay loop passes included
+        self._heap = []                    # (time, seq, version, sm) of running state machines
+        self._events = []                  # (time, seq, fn, args) scheduled with at()
+        self._seq = 0                      # Orders events due at the same time
+        self._limit = _INF
+        self._gpio_stalled = []            # State machines waiting for a pin
+        self._pending = deque()            # IRQ handlers waiting to run
+        self._irq_off = 0
+        self._in_handler = False
+        self._running = False
+        self._quiet = 0                    # Idle time without anything scheduled
+        self.sleepers = []                 # asyncio.sleep() deadlines, see install()
+
+         ### Time ###
+    def cycles(self): # System clock cycles since start
+        return self.now // SUB
+
+    def cycles_to_us(self, cycles):
+        return cycles * 1_000_000 / self.sys_freq
+
+    def ticks_us(self):
+        return self._us_base + (self.now - self._t_base) * 1_000_000 // (SUB * self.sys_freq)
+
+    def set_freq(self, hz):
+        self._us_base = self.ticks_us()
+        self._t_base = self.now
+        self.sys_freq = hz
+
+    def us_to_t(self, us):
+        return round(us * self.sys_freq * SUB / 1_000_000)
+
+    def at(self, t, fn, *args): # Runs fn(*args) at emulator time t
+        self._seq += 1
+        heapq.heappush(self._events, (t, self._seq, fn, args))
+        if t < self._limit:
+            self._limit = t
+
+    def after_us(self, us, fn, *args):
+        self.at(self.now + self.us_to_t(us), fn, *args)
+
+    def cpu(self, cycles=None): # Time spent by Python between two hardware calls
+        if cycles is None:
+            cycles = self.call_cycles
+        if cycles and not self._running and not self._in_handler:
+            self.run_until(self.now + cycles * SUB)
+
+    def sleep_us(self, us):
+        self.run_until(self.now + self.us_to_t(us))
+
+    def idle(self): # machine.idle(): runs until an interrupt handler has run, a sleeper is due or IDLE_US
+        limit = self.now + self.us_to_t(IDLE_US)
+        if self.sleepers and self.sleepers[0] < limit:
+            limit = self.sleepers[0]
+        if not self._heap and not self._events and not self._pending and not self.sleepers:
+            self._quiet += limit - self.now
+            if self._quiet > self.us_to_t(DEADLOCK_S * 1_000_000):
+                raise RuntimeError("emulator: nothing is running and nothing can wake the CPU")
+        else:
+            self._quiet = 0
+        self.run_until(limit, stop_on_irq=True)
+
+    def wait_for(self, condition, what): # Blocking call: runs the PIO until condition() is true
+        while not condition():
+            t = self._next_time()
+            if t >= _INF:
+                raise RuntimeError("emulator: " + what + " would block forever")
+            self.run_until(t)
+
+         ### Scheduler ###
+# Every running state machine has one valid entry (time, id, version, sm) in
+# _heap. Stalling, disabling or rescheduling a state machine bumps its version,
+# which turns its old entries into garbage that is dropped when it surfaces.
+    def _next_time(self):
+        heap = self._heap
+        while heap and heap[0][2] != heap[0][3].version:
+            heapq.heappop(heap)
+        t = heap[0][0] if heap else _INF
+        if self._events and self._events[0][0] < t:
+            t = self._events[0][0]
+        return t
+
+    def _schedule(self, sm, t):
+        sm.next_t = t
+        sm.version += 1
+        heapq.heappush(self._heap, (t, sm.id, sm.version, sm))
+        if t < self._limit:
+            self._limit = t
+
+    def _stall(self, sm, reason):
+        sm.stall = reason
+        sm.version += 1
+        if reason == _IRQ_FLAG:
+            sm.block.stalled.append(sm)
+        elif reason == _GPIO:
+            self._gpio_stalled.append(sm)
+
+    def _wake(self, sm, reason): # Something a stalled state machine waits for changed, try again on its next edge
+        if sm.stall == reason:
+            sm.stall = 0
+            if sm.enabled:
+                self._schedule(sm, sm.next_edge(self.now))
+
+    def _wake_all(self, stalled, reason):
+        for sm in stalled:
+            self._wake(sm, reason)
+
+    def run_until(self, t_end, stop_on_irq=False): # Runs everything due up to t_end
+        nested = self._running
+        self._running = True
+        try:
+            if self._dispatch() and stop_on_irq:
+                return
+            heap = self._heap
+            events = self._events
+            pending = self._pending
+            step = self._step
+            pop = heapq.heappop
+            while True:
+                while heap and heap[0][2] != heap[0][3].version:
+                    pop(heap)
+                t = heap[0][0] if heap else _INF
+                if events and events[0][0] <= t:
+                    t = events[0][0]
+                    if t > t_end:
+                        break
+                    _, _, fn, args = pop(events)
+                    self.now = t
+                    fn(*args)
+                else:
+                    if t > t_end:
+                        break
+                    sm = pop(heap)[3]
+                    limit = heap[0][0] if heap else _INF
+                    if events and events[0][0] < limit:
+                        limit = events[0][0]
+                    self._limit = limit if limit < t_end else t_end
+                    while True:                                   # Runs sm until it stalls or another one is due
+                        self.now = sm.next_t
+                        if not step(sm, sm.next_t):
+                            break
+                        if sm.next_t > self._limit or pending or not sm.enabled:
+                            if sm.enabled:
+                                self._schedule(sm, sm.next_t)
+                            break
+                if pending and self._dispatch() and stop_on_irq:
+                    return
+            if t_end > self.now and t_end < _INF:
+                self.now = t_end
+        finally:
+            self._running = nested
+
+    def _dispatch(self): # Runs IRQ handlers that are due, the way MicroPython schedules them
+        if not self._pending or self._irq_off or self._in_handler:
+            return False
+        self._in_handler = True
+        try:
+            while self._pending and not self._irq_off:
+                handler, arg = self._pending.popleft()
+                handler(arg)
+        finally:
+            self._in_handler = False
+        return True
+
+    def interrupt(self, handler, arg): # Queues a Python IRQ handler
+        if handler is not None:
+            self._pending.append((handler, arg))
+
+    def disable_irq(self):
+        state = self._irq_off
+        self._irq_off = 1
+        return state
+
+    def enable_irq(self, state=0):
+        self._irq_off = state
+
+         ### GPIO ###
+    def _update(self, pin): # Works out a pin's level after something that drives it changed
+        f = self.func[pin]
+        if f:
+            blk = self.blocks[f - 1]
+            if blk.oe >> pin & 1:
+                new = blk.out >> pin & 1
+            else:
+                new = self.ext[pin] if self.ext[pin] is not None else self.pull[pin]
+        elif self.sio_oe[pin]:
+            new = self.sio_out[pin]
+        else:
+            new = self.ext[pin] if self.ext[pin] is not None else self.pull[pin]
+        old = self.level[pin]
+        if new == old:
+            return
+        self.prev[pin] = old
+        self.level[pin] = new
+        self.changed[pin] = self.now
+        if self.trace_pins is None or pin in self.trace_pins:
+            self.trace_t.append(self.now // SUB)
+            self.trace_pin.append(pin)
+            self.trace_level.append(new)
+        for fn in self.watchers[pin]:
+            fn(pin, new)
+        if self._gpio_stalled:
+            stalled = self._gpio_stalled
+            self._gpio_stalled = []
+            self._wake_all(stalled, _GPIO)
+
+    def _seen(self, pin, t): # Pin level as the PIO sees it through the input synchronizer
+        if t - self.changed[pin] < SYNC_CYCLES * SUB:
+            return self.prev[pin]
+        return self.level[pin]
+
+    def drive(self, pin, level, at_us=None): # Drives a pin from outside (an endstop, an encoder...), None releases it
+        if at_us is not None:
+            self.after_us(at_us, self.drive, pin, level)
+            return
+        self.ext[pin] = level
+        self._update(pin)
+
+    def watch(self, pin, fn): # fn(pin, level) is called on every edge of pin
+        self.watchers[pin].append(fn)
+
+    def unwatch(self, pin, fn):
+        if fn in self.watchers[pin]:
+            self.watchers[pin].remove(fn)
+
+    def sio_init(self, pin, output, value=None, pull=None): # machine.Pin(pin, mode)
+        self.func[pin] = 0
+        self.sio_oe[pin] = 1 if output else 0
+        if value is not None:
+            self.sio_out[pin] = 1 if value else 0
+        if pull is not None:
+            self.pull[pin] = pull
+        self._update(pin)
+
+    def sio_write(self, pin, value):
+        self.sio_out[pin] = 1 if value else 0
+        self._update(pin)
+
+    def pio_init(self, blk, pin, output, value): # Hands a pin to a PIO block with a direction and level
+        self.func[pin] = blk.index + 1
+        bit = 1 << pin
+        blk.oe = blk.oe | bit if output else blk.oe & ~bit
+        blk.out = blk.out | bit if value else blk.out & ~bit
+        self._update(pin)
+
+    def _pio_pins(self, sm, base, count, value, dirs=False): # out/set/side-set/mov to pins or pindirs
+        blk = sm.block
+        for i in range(count):
+            pin = (base + i) & 31
+            bit = 1 << pin
+            if dirs:
+                blk.oe = blk.oe | bit if value >> i & 1 else blk.oe & ~bit
+            else:
+                blk.out = blk.out | bit if value >> i & 1 else blk.out & ~bit
+            if pin < NUM_PINS and self.func[pin] == blk.index + 1:
+                self._update(pin)
+
+    def _pio_pin(self, blk, pin, value): # _pio_pins() for the usual single side-set pin
+        bit = 1 << pin
+        if value:
+            if blk.out & bit:
+                return
+            blk.out |= bit
+        else:
+            if not blk.out & bit:
+                return
+            blk.out &= ~bit
+        if pin < NUM_PINS and self.func[pin] == blk.index + 1:
+            self._update(pin)
+
+    def _read_pins(self, base, count, t):
+        value = 0
+        for i in range(count):
+            pin = (base + i) & 31
+            if pin < NUM_PINS and self._seen(pin, t):
+                value |= 1 << i
+        return value
+
+         ### Trace ###
+    def clear_trace(self):
+        self.trace_t = array("q")          # System clock cycle of each edge
+        self.trace_pin = array("B")
+        self.trace_level = array("B")
+
+    def edges(self, pin): # [(cycle, level), ...] of one pin
+        return [(self.trace_t[i], self.trace_level[i]) for i in range(len(self.trace_t)) if self.trace_pin[i] == pin]
+
+    def rising(self, pin): # Cycles of the rising edges of one pin
+        return [t for t, level in self.edges(pin) if level]
+
+    def write_vcd(self, path, names=None): # Writes the trace for GTKWave & co, names = {pin: "step_x", ...}
+        pins = sorted(set(self.trace_pin))
+        names = names or {}
+        ids = {pin: chr(33 + i) for i, pin in enumerate(pins)}
+        with open(path, "w") as f:
+            f.write("$timescale {}ps $end\n".format(round(1e12 / self.sys_freq)))
+            f.write("$scope module pico $end\n")
+            for pin in pins:
+                f.write("$var wire 1 {} {} $end\n".format(ids[pin], names.get(pin, "GP{}".format(pin))))
+            f.write("$upscope $end\n$enddefinitions $end\n")
+            last = None
+            for i in range(len(self.trace_t)):
+                if self.trace_t[i] != last:
+                    last = self.trace_t[i]
+                    f.write("#{}\n".format(last))
+                f.write("{}{}\n".format(self.trace_level[i], ids[self.trace_pin[i]]))
+
+         ### IRQ flags ###
+    def set_flag(self, blk, flag):
+        if blk.flags >> flag & 1:
+            return
+        blk.flags |= 1 << flag
+        blk.flag_t[flag] = self.now
+        if flag < 4 and blk.irq_enabled >> flag & 1:
+            self.at(self.now + IRQ_LATENCY * SUB, self._irq_ack, blk, flag)
+        if blk.stalled:
+            stalled = blk.stalled
+            blk.stalled = []
+            self._wake_all(stalled, _IRQ_FLAG)
+
+    def clear_flag(self, blk, flag):
+        if not blk.flags >> flag & 1:
+            return
+        blk.flags &= ~(1 << flag)
+        blk.flag_t[flag] = self.now
+        if blk.stalled:
+            stalled = blk.stalled
+            blk.stalled = []
+            self._wake_all(stalled, _IRQ_FLAG)
+
+    def _irq_ack(self, blk, flag): # MicroPython's PIO IRQ: acknowledge the flag, schedule the handlers
+        if not blk.flags >> flag & 1:
+            return
+        self.clear_flag(blk, flag)
+        handler = blk.sm_handlers[flag]
+        if handler is not None:
+            self.interrupt(handler, blk.sms[flag].obj)
+        if blk.pio_handler is not None and blk.pio_trigger >> (8 + flag) & 1:
+            self.interrupt(blk.pio_handler, blk.pio_obj)
+
+         ### FIFOs ###
+    def tx_push(self, sm, value): # sm.put() / DMA
+        sm.tx.append(value & _MASK)
+        if sm.stall == _TX:
+            self._wake(sm, _TX)
+
+    def rx_pop(self, sm): # sm.get() / DMA
+        value = sm.rx.popleft()
+        if sm.stall == _RX:
+            self._wake(sm, _RX)
+        self._dma_service(sm.block.index * 8 + 4 + sm.index)
+        return value
+
+    def _tx_pop(self, sm): # The state machine takes a word
+        value = sm.tx.popleft()
+        self._dma_service(sm.block.index * 8 + sm.index)
+        return value
+
+    def _rx_push(self, sm, value):
+        sm.rx.append(value)
+        self._dma_service(sm.block.index * 8 + 4 + sm.index)
+
+         ### State machine control ###
+    def settle(self, sm): # Brings a skipped delay loop back to where it would be now, before Python touches sm
+        ff = sm.ff
+        if ff is None:
+            return
+        sm.ff = None
+        start, value, cycles, reg, pc = ff
+        period = cycles * sm.div
+        if self.now >= sm.next_t or self.now <= start:
+            return
+        k = -(-(self.now - start) // period)      # Passes of the loop made before now
+        if k > value:
+            return                                # In the delay of the last jmp, already done
+        self.instructions -= (value - k) * (pc - sm.code[pc][2] + 1)
+        if reg == 1:
+            sm.x = value - k
+        else:
+            sm.y = value - k
+        sm.pc = pc
+        sm.next_t = start + k * period
+        if sm.enabled and not sm.stall:
+            self._schedule(sm, sm.next_t)
+
+    def set_enabled(self, sm, enabled):
+        self.settle(sm)
+        if enabled and not sm.enabled:
+            sm.enabled = True
+            if not sm.stall:
+                self._schedule(sm, sm.next_edge(self.now))
+        elif not enabled and sm.enabled:
+            sm.enabled = False
+            sm.version += 1
+
+    def restart_sm(self, sm):
+        self.settle(sm)
+        sm.restart()
+        sm.isr = 0
+        sm.isr_n = 0
+        sm.osr_n = 32
+        if sm.enabled:
+            self._schedule(sm, sm.next_edge(self.now))
+
+    def clkdiv_restart(self, sm):
+        sm.origin = self.now
+        if sm.enabled and not sm.stall:
+            self._schedule(sm, sm.next_edge(self.now))
+
+    def exec(self, sm, instr): # sm.exec(): runs one instruction right now
+        self.settle(sm)
+        sm.stall = 0
+        sm.pending = sm.decode(instr)
+        sm.irq_wait = -1
+        self._running, running = True, self._running
+        try:
+            done = self._step(sm, self.now)
+        finally:
+            self._running = running
+        if sm.enabled and done:
+            self._schedule(sm, sm.next_t)
+
+         ### Executing instructions ###
+    def _step(self, sm, t): # Executes the instruction at sm.pc, returns False if the state machine stalled
+        pending = sm.pending
+        if pending is None:
+            pc = sm.pc
+            ins = sm.code[pc]
+            nxt = sm.after[pc]
+        else:
+            ins = pending
+            sm.pending = None
+            nxt = sm.pc                                   # exec() instructions don't move the pc
+        kind, a, b, c, n, side = ins
+        self.instructions += 1
+        if side >= 0 and sm.side_count:
+            if sm.side_count == 1 and not sm.side_pindir:
+                self._pio_pin(sm.block, sm.side_base, side)
+            else:
+                self._pio_pins(sm, sm.side_base, sm.side_count, side, sm.side_pindir)
+
+        if kind == _JMP:
+            if a == 0:
+                taken = True
+            elif a == 2:
+                taken = sm.x != 0
+                if taken and pending is None and sm.loops[pc]:
+                    return self._skip_loop(sm, ins, 1, sm.x, t, nxt)
+                sm.x = (sm.x - 1) & _MASK
+            elif a == 4:
+                taken = sm.y != 0
+                if taken and pending is None and sm.loops[pc]:
+                    return self._skip_loop(sm, ins, 2, sm.y, t, nxt)
+                sm.y = (sm.y - 1) & _MASK
+            elif a == 1:
+                taken = sm.x == 0
+            elif a == 3:
+                taken = sm.y == 0
+            elif a == 5:
+                taken = sm.x != sm.y
+            elif a == 6:
+                taken = self._seen(sm.jmp_pin, t) == 1
+            else:
+                taken = sm.osr_n < sm.pull_thresh
+            sm.pc = b if taken else nxt
+            sm.next_t = t + n * sm.div
+            return True
+
+        if kind == _IRQ:
+            blk = sm.block
+            if a:                                         # clear
+                self.clear_flag(blk, c)
+            else:
+                if sm.irq_wait < 0:
+                    self.set_flag(blk, c)
+                    if b:
+                        sm.irq_wait = c
+                if b:                                     # wait for the flag to be cleared
+                    if blk.flags >> c & 1:
+                        sm.pending = pending
+                        self._stall(sm, _IRQ_FLAG)
+                        return False
+                    if blk.flag_t[c] >= t:                # Cleared this cycle, visible on the next edge
+                        sm.pending = pending
+                        sm.next_t = sm.next_edge(t)
+                        return True
+                    sm.irq_wait = -1
+            sm.pc = nxt
+            sm.next_t = t + n * sm.div
+            return True
+
+        if kind == _WAIT:
+            if b == 2:                                    # irq
+                blk = sm.block
+                value = blk.flags >> c & 1
+                if blk.flag_t[c] < t:
+                    if value == a:
+                        if a:
+                            self.clear_flag(blk, c)
+                        sm.pc = nxt
+                        sm.next_t = t + n * sm.div
+                        return True
+                    sm.pending = pending
+                    self._stall(sm, _IRQ_FLAG)
+                    return False
+                sm.pending = pending                      # Changed this cycle, visible on the next edge
+                sm.next_t = sm.next_edge(t)
+                return True
+            pin = c if b == 0 else (sm.in_base + c) & 31
+            if self._seen(pin, t) == a:
+                sm.pc = nxt
+                sm.next_t = t + n * sm.div
+                return True
+            sm.pending = pending
+            if self.level[pin] == a:                      # Still going through the synchronizer
+                sm.next_t = sm.next_edge(self.changed[pin] + SYNC_CYCLES * SUB - 1)
+                return True
+            self._stall(sm, _GPIO)
+            return False
+
+        if kind == _MOV:
+            if c == 1:
+                value = sm.x
+            elif c == 2:
+                value = sm.y
+            elif c == 7:
+                value = sm.osr
+            elif c == 6:
+                value = sm.isr
+            elif c == 0:
+                value = self._read_pins(sm.in_base, 32, t)
+            elif c == 5:
+                level = len(sm.rx) if sm.status_sel else len(sm.tx)
+                value = _MASK if level < sm.status_n else 0
+            else:
+                value = 0
+            if b == 1:
+                value = ~value & _MASK
+            elif b == 2:
+                value = _reverse(value)
+            return self._write(sm, ins, a, value, 0, t, nxt)
+
+        if kind == _PULL:
+            if (sm.autopull and sm.osr_n == 0) or (a and sm.osr_n < sm.pull_thresh):
+                pass                                      # With autopull a full OSR makes pull a no-op, ifempty
+            elif sm.tx:
+                sm.osr = self._tx_pop(sm)
+                sm.osr_n = 0
+            elif b:
+                sm.pending = pending
+                self._stall(sm, _TX)
+                return False
+            else:
+                sm.osr = sm.x                             # noblock on an empty FIFO copies X
+                sm.osr_n = 0
+            sm.pc = nxt
+            sm.next_t = t + n * sm.div
+            return True
+
+        if kind == _SET:
+            if a == 1:
+                sm.x = b
+            elif a == 2:
+                sm.y = b
+            elif a == 0:
+                self._pio_pins(sm, sm.set_base, sm.set_count, b)
+            elif a == 4:
+                self._pio_pins(sm, sm.set_base, sm.set_count, b, True)
+            sm.pc = nxt
+            sm.next_t = t + n * sm.div
+            return True
+
+        if kind == _OUT:
+            if sm.autopull and sm.osr_n >= sm.pull_thresh:
+                if not sm.tx:
+                    sm.pending = pending
+                    self._stall(sm, _TX)
+                    return False
+                sm.osr = self._tx_pop(sm)
+                sm.osr_n = 0
+            if sm.out_right:
+                value = sm.osr & ((1 << b) - 1)
+                sm.osr >>= b
+            else:
+                value = sm.osr >> (32 - b)
+                sm.osr = (sm.osr << b) & _MASK
+            sm.osr_n = min(32, sm.osr_n + b)
+            if sm.autopull and sm.osr_n >= sm.pull_thresh and sm.tx:
+                sm.osr = self._tx_pop(sm)
+                sm.osr_n = 0
+            return self._write(sm, ins, a | 8, value, b, t, nxt)
+
+        if kind == _PUSH:
+            if a and sm.isr_n < sm.push_thresh:           # iffull
+                pass
+            elif len(sm.rx) >= sm.rx_depth:
+                if b:
+                    sm.pending = pending
+                    self._stall(sm, _RX)
+                    return False
+                sm.isr = 0                                # noblock on a full FIFO drops the word
+                sm.isr_n = 0
+            else:
+                self._rx_push(sm, sm.isr)
+                sm.isr = 0
+                sm.isr_n = 0
+            sm.pc = nxt
+            sm.next_t = t + n * sm.div
+            return True
+
+        # in
+        if sm.autopush and sm.isr_n + b >= sm.push_thresh and len(sm.rx) >= sm.rx_depth:
+            sm.pending = pending
+            self._stall(sm, _RX)
+            return False
+        if a == 0:
+            value = self._read_pins(sm.in_base, b, t)
+        elif a == 1:
+            value = sm.x
+        elif a == 2:
+            value = sm.y
+        elif a == 6:
+            value = sm.isr
+        elif a == 7:
+            value = sm.osr
+        else:
+            value = 0
+        value &= (1 << b) - 1
+        if sm.in_right:
+            sm.isr = (sm.isr >> b | value << (32 - b)) & _MASK if b < 32 else value
+        else:
+            sm.isr = (sm.isr << b | value) & _MASK
+        sm.isr_n = min(32, sm.isr_n + b)
+        if sm.autopush and sm.isr_n >= sm.push_thresh:
+            self._rx_push(sm, sm.isr)
+            sm.isr = 0
+            sm.isr_n = 0
+        sm.pc = nxt
+        sm.next_t = t + n * sm.div
+        return True
+
+    def _write(self, sm, ins, dest, value, bits, t, nxt): # Destination of mov(), or of out() with dest | 8
+        n = ins[4]
+        if dest == 1 or dest == 9:
+            sm.x = value
+        elif dest == 2 or dest == 10:
+            sm.y = value
+        elif dest == 7:                                   # mov osr
+            sm.osr = value
+            sm.osr_n = 0
+        elif dest == 0 or dest == 8:
+            self._pio_pins(sm, sm.out_base, sm.out_count, value)
+        elif dest == 12:                                  # out pindirs
+            self._pio_pins(sm, sm.out_base, sm.out_count, value, True)
+        elif dest == 6 or dest == 14:
+            sm.isr = value
+            sm.isr_n = bits
+        elif dest == 5 or dest == 13:                     # pc
+            sm.pc = value % max(1, len(sm.code))
+            sm.next_t = t + n * sm.div
+            return True
+        elif dest == 4 or dest == 15:                     # exec, runs on the next cycle
+            sm.pc = nxt
+            sm.pending = sm.decode(value & 0xFFFF)
+            sm.next_t = t + n * sm.div
+            return True
+        sm.pc = nxt
+        sm.next_t = t + n * sm.div
+        return True
+
+    def _skip_loop(self, sm, ins, reg, value, t, nxt): # Runs a whole delay loop at once
+        cycles = sm.loops[sm.pc]
+        sm.ff = (t, value, cycles, reg, sm.pc)
+        if reg == 1:
+            sm.x = _MASK
+        else:
+            sm.y = _MASK
+        self.instructions += value * (sm.pc - ins[2] + 1)
+        sm.pc = nxt
+        sm.next_t = t + (value * cycles + ins[4]) * sm.div
+        return True
+
+         ### DMA ###
+    def _dreq_ready(self, ch): # Is the data request of the channel asserted
+        treq = ch.treq()
+        if treq == 0x3F:
+            return True
+        if treq < 16:
+            blk = self.blocks[treq // 8]
+            sm = blk.sms[treq % 4]
+            if treq % 8 < 4:
+                return len(sm.tx) < sm.tx_depth
+            return len(sm.rx) > 0
+        return True                       # Other peripherals are not emulated, treat them as always ready
+
+    def _dma_service(self, dreq=None): # Moves words for every busy channel that has its data request
+        for ch in self.dma:
+            if ch.busy and (dreq is None or ch.treq() == dreq):
+                self._dma_run(ch)
+
+    def _dma_run(self, ch):
+        if getattr(ch, "_active", False):
+            return
+        ch._active = True
+        try:
+            size = ch.size()
+            while ch.busy and ch.count and self._dreq_ready(ch):
+                value = self._dma_read(ch, size)
+                self._dma_write(ch, size, value)
+                ch.count -= 1
+            if ch.busy and not ch.count:
+                ch.busy = False
+                if not (ch.ctrl >> 21) & 1:               # irq_quiet
+                    self.interrupt(ch.handler, ch.obj)
+                chain = (ch.ctrl >> 11) & 0xF
+                if chain != ch.index:
+                    self.dma_trigger(self.dma[chain])
+        finally:
+            ch._active = False
+
+    def _ring(self, ch, offset, size, write): # Address after a transfer, with the ring wrap
+        ring = (ch.ctrl >> 6) & 0xF
+        if ring and bool((ch.ctrl >> 10) & 1) == write:
+            mask = (1 << ring) - 1
+            return (offset & ~mask) | ((offset + size) & mask)
+        return offset + size
+
+    def _dma_read(self, ch, size):
+        kind, target, offset = ch.read
+        if kind == "rx":
+            return self.rx_pop(target) if target.rx else 0
+        if kind == "buf":
+            value = int.from_bytes(target[offset:offset + size], "little")
+        else:
+            value = self.mem_read(offset)
+        if (ch.ctrl >> 4) & 1:
+            ch.read = (kind, target, self._ring(ch, offset, size, False))
+        return value
+
+    def _dma_write(self, ch, size, value):
+        kind, target, offset = ch.write
+        if (ch.ctrl >> 22) & 1:
+            value = int.from_bytes(value.to_bytes(size, "little"), "big")
+        if kind == "tx":
+            if len(target.tx) < target.tx_depth:
+                self.tx_push(target, value)
+            return
+        if kind == "buf":
+            target[offset:offset + size] = value.to_bytes(size, "little")
+        else:
+            self.mem_write(offset, value)
+        if (ch.ctrl >> 5) & 1:
+            ch.write = (kind, target, self._ring(ch, offset, size, True))
+
+    def dma_address(self, value, write): # Turns a DMA read/write argument into (kind, target, offset)
+        if hasattr(value, "_sm"):                         # rp2.StateMachine
+            sm = value._sm
+            return ("tx", sm, 0) if write else ("rx", sm, 0)
+        if isinstance(value, int):
+            for blk in self.blocks:
+                offset = value - blk.base
+                if 0x10 <= offset < 0x20 and write:
+                    return ("tx", blk.sms[(offset - 0x10) // 4], 0)
+                if 0x20 <= offset < 0x30 and not write:
+                    return ("rx", blk.sms[(offset - 0x20) // 4], 0)
+            return ("mem", None, value)
+        return ("buf", memoryview(value).cast("B"), 0)
+
+    def dma_trigger(self, ch):
+        if not (ch.ctrl & 1):                             # EN
+            return
+        ch.busy = True
+        self._dma_run(ch)
+
+         ### Memory mapped registers ###
+    def mem_read(self, address):
+        for blk in self.blocks:
+            offset = address - blk.base
+            if 0 <= offset < 0x100000:
+                return self._pio_read(blk, offset)
+        if address == 0xD0000004:                         # SIO GPIO_IN
+            return sum(level << pin for pin, level in enumerate(self.level))
+        if address == 0xD0000010:                         # SIO GPIO_OUT
+            return sum(v << pin for pin, v in enumerate(self.sio_out))
+        return self.memory.get(address, 0)
+
+    def mem_write(self, address, value):
+        value &= _MASK
+        for blk in self.blocks:
+            offset = address - blk.base
+            if 0 <= offset < 0x100000:
+                self._pio_write(blk, offset, value)
+                return
+        sio = {0xD0000014: 1, 0xD0000018: 0, 0xD000001C: -1}      # GPIO_OUT_SET / CLR / XOR
+        if address in sio:
+            for pin in range(NUM_PINS):
+                if value >> pin & 1:
+                    mode = sio[address]
+                    self.sio_write(pin, self.sio_out[pin] ^ 1 if mode < 0 else mode)
+            return
+        self.memory[address] = value
+
+    def _pio_read(self, blk, offset):
+        if offset == 0x000:                               # CTRL
+            return sum(1 << sm.index for sm in blk.sms if sm.enabled)
+        if offset == 0x004:                               # FSTAT
+            value = 0
+            for sm in blk.sms:
+                i = sm.index
+                value |= (len(sm.rx) >= sm.rx_depth) << i | (not sm.rx) << (8 + i)
+                value |= (len(sm.tx) >= sm.tx_depth) << (16 + i) | (not sm.tx) << (24 + i)
+            return value
+        if offset == 0x00C:                               # FLEVEL
+            return sum((len(sm.tx) & 0xF) << (8 * sm.index) | (len(sm.rx) & 0xF) << (8 * sm.index + 4)
+                       for sm in blk.sms)
+        if 0x020 <= offset < 0x030:                       # RXF0-3
+            sm = blk.sms[(offset - 0x020) // 4]
+            return self.rx_pop(sm) if sm.rx else 0
+        if offset == 0x030:                               # IRQ
+            return blk.flags
+        if 0x0C8 <= offset < 0x0C8 + 4 * 0x18 and (offset - 0x0C8) % 0x18 == 0x00:   # SMx_CLKDIV
+            return blk.sms[(offset - 0x0C8) // 0x18].div * 256 // SUB << 8 & 0xFFFFFF00
+        if 0x0C8 <= offset < 0x0C8 + 4 * 0x18 and (offset - 0x0C8) % 0x18 == 0x04:   # SMx_EXECCTRL
+            return blk.sms[(offset - 0x0C8) // 0x18].execctrl
+        if 0x0C8 <= offset < 0x0C8 + 4 * 0x18 and (offset - 0x0C8) % 0x18 == 0x0C:   # SMx_ADDR
+            sm = blk.sms[(offset - 0x0C8) // 0x18]
+            self.settle(sm)
+            return sm.pc
+        return self.memory.get(blk.base + offset, 0)
+
+    def _pio_write(self, blk, offset, value):
+        if offset in (0x1000, 0x2000, 0x3000):            # CTRL through the atomic XOR / SET / CLR aliases
+            enabled = self._pio_read(blk, 0x000)
+            strobes = value & 0xFF0                       # SM_RESTART and CLKDIV_RESTART act like a normal write
+            if offset == 0x1000:
+                enabled ^= value & 0xF
+            elif offset == 0x2000:
+                enabled |= value & 0xF
+            else:
+                enabled &= ~value & 0xF
+                strobes = 0
+            offset = 0x000
+            value = strobes | enabled
+        if offset == 0x000:                               # CTRL
+            for sm in blk.sms:
+                bit = 1 << sm.index
+                if value & (bit << 4):                    # SM_RESTART
+                    self.restart_sm(sm)
+                if value & (bit << 8):                    # CLKDIV_RESTART
+                    sm.origin = self.now
+            for sm in blk.sms:
+                self.set_enabled(sm, value & (1 << sm.index))
+            return
+        if 0x010 <= offset < 0x020:                       # TXF0-3
+            sm = blk.sms[(offset - 0x010) // 4]
+            if len(sm.tx) < sm.tx_depth:
+                self.tx_push(sm, value)
+            return
+        if offset == 0x030:                               # IRQ, write 1 to clear
+            for flag in range(8):
+                if value >> flag & 1:
+                    self.clear_flag(blk, flag)
+            return
+        if offset == 0x034:                               # IRQ_FORCE
+            for flag in range(8):
+                if value >> flag & 1:
+                    self.set_flag(blk, flag)
+            return
+        if 0x0C8 <= offset < 0x0C8 + 4 * 0x18 and (offset - 0x0C8) % 0x18 == 0x00:   # SMx_CLKDIV, 16.8 bits
+            sm = blk.sms[(offset - 0x0C8) // 0x18]
+            self.settle(sm)
+            sm.div = ((value >> 8 & 0xFFFFFF) or 0x1000000) * SUB // 256   # INT 0 = 65536
+            self.clkdiv_restart(sm)
+            return
+        if 0x0C8 <= offset < 0x0C8 + 4 * 0x18 and (offset - 0x0C8) % 0x18 == 0x04:   # SMx_EXECCTRL, status only
+            sm = blk.sms[(offset - 0x0C8) // 0x18]
+            self.settle(sm)
+            sm.set_execctrl(sm.execctrl & ~0x1F | value & 0x1F)
+            return
+        if 0x0C8 <= offset < 0x0C8 + 4 * 0x18 and (offset - 0x0C8) % 0x18 == 0x10:   # SMx_INSTR
+            self.exec(blk.sms[(offset - 0x0C8) // 0x18], value & 0xFFFF)
+            return
+        self.memory[blk.base + offset] = value
+
+emulator = Emulator()
+
+def reset(sys_freq=125_000_000): # Power cycles the emulated Pico, modules using rp2 have to be imported again
+    global emulator
+    emulator = Emulator(sys_freq)
+    return emulator
+
+         ### Host integration ###
+# install() points time and asyncio at the emulator clock: time.sleep() and
+# friends run the PIO for that long, asyncio.sleep() lets the task with the
+# earliest deadline run the PIO up to it and asyncio.ThreadSafeFlag waits with
+# machine.idle() like the fallback in stepper_controller.py does.
+def install():
+    import time
+    import asyncio
+    real_sleep = asyncio.sleep
+
+    def sleep(seconds):
+        emulator.sleep_us(seconds * 1_000_000)
+
+    def sleep_ms(ms):
+        emulator.sleep_us(ms * 1000)
+
+    def sleep_us(us):
+        emulator.sleep_us(us)
+
+    def ticks_us():
+        return emulator.ticks_us()
+
+    def ticks_ms():
+        return emulator.ticks_us() // 1000
+
+    def ticks_cpu():
+        return emulator.cycles()
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def ticks_add(a, b):
+        return a + b
+
+    async def async_sleep(seconds, result=None):
+        emu = emulator
+        deadline = emu.now + emu.us_to_t(seconds * 1_000_000)
+        heapq.heappush(emu.sleepers, deadline)
+        try:
+            await real_sleep(0)
+            while emu.now < deadline:
+                if emu.sleepers[0] >= deadline:           # Earliest sleeper moves the clock
+                    emu.run_until(deadline, stop_on_irq=True)
+                await real_sleep(0)
+        finally:
+            emu.sleepers.remove(deadline)
+            heapq.heapify(emu.sleepers)
+        return result
+
+    async def async_sleep_ms(ms):
+        await async_sleep(ms / 1000)
+
+    class ThreadSafeFlag:
+        def __init__(self):
+            self._flag = False
+
+        def set(self):
+            self._flag = True
+
+        def clear(self):
+            self._flag = False
+
+        async def wait(self):
+            while not self._flag:
+                emulator.idle()
+                await real_sleep(0)
+            self._flag = False
+
+    time.sleep = sleep
+    time.sleep_ms = sleep_ms
+    time.sleep_us = sleep_us
+    time.ticks_us = ticks_us
+    time.ticks_ms = ticks_ms
+    time.ticks_cpu = ticks_cpu
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    asyncio.sleep = async_sleep
+    asyncio.sleep_ms = async_sleep_ms
+    asyncio.ThreadSafeFlag = ThreadSafeFlag
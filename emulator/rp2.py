@@ -0,0 +1,569 @@
+         ### Libraries ###
+from array import array          # Assembled programs, like MicroPython's rp2.py
+import types                     # Runs the decorated program function with the PIO names as globals
+import pio_emulator as emu       # The emulated hardware
+
+# Stand-in for MicroPython's rp2 module. The assembler follows MicroPython's own
+# rp2.py, so programs assemble to the same 16 bit words and program lists as on
+# the Pico. PIO, StateMachine and DMA drive pio_emulator instead of registers.
+
+class PIOASMError(Exception):
+    pass
+
+         ### Assembler ###
+_PROG_DATA = 0
+_PROG_OFFSET_PIO0 = 1
+_PROG_OFFSET_PIO1 = 2
+_PROG_EXECCTRL = 3
+_PROG_SHIFTCTRL = 4
+_PROG_OUT_PINS = 5
+_PROG_SET_PINS = 6
+_PROG_SIDESET_PINS = 7
+_PROG_MAX_FIELDS = 8
+
+class PIOASMEmit:
+    def __init__(self, *, out_init=None, set_init=None, sideset_init=None, in_shiftdir=0, out_shiftdir=0,
+                 autopush=False, autopull=False, push_thresh=32, pull_thresh=32, fifo_join=0):
+        self.labels = {}
+        execctrl = 0
+        shiftctrl = (fifo_join << 30 | (pull_thresh & 0x1F) << 25 | (push_thresh & 0x1F) << 20
+                     | out_shiftdir << 19 | in_shiftdir << 18 | autopull << 17 | autopush << 16)
+        self.prog = [array("H"), -1, -1, execctrl, shiftctrl, out_init, set_init, sideset_init]
+        self.wrap_used = False
+        if sideset_init is None:
+            self.sideset_count = 0
+        elif isinstance(sideset_init, int):
+            self.sideset_count = 1
+        else:
+            self.sideset_count = len(sideset_init)
+
+    def start_pass(self, pass_):
+        if pass_ == 1:
+            if not self.wrap_used and self.num_instr:
+                self.wrap()
+            self.delay_max = 31
+            if self.sideset_count:
+                self.sideset_opt = self.num_sideset != self.num_instr
+                if self.sideset_opt:
+                    self.prog[_PROG_EXECCTRL] |= 1 << 30
+                    self.sideset_count += 1
+                self.delay_max >>= self.sideset_count
+        self.pass_ = pass_
+        self.num_instr = 0
+        self.num_sideset = 0
+
+    def __getitem__(self, key):
+        return self.delay(key)
+
+    def delay(self, delay):
+        if self.pass_ > 0:
+            if delay > self.delay_max:
+                raise PIOASMError("delay too large")
+            self.prog[_PROG_DATA][-1] |= delay << 8
+        return self
+
+    def side(self, value):
+        self.num_sideset += 1
+        if self.pass_ > 0:
+            if self.sideset_count == 0:
+                raise PIOASMError("no sideset")
+            elif value >= (1 << self.sideset_count):
+                raise PIOASMError("sideset too large")
+            set_bit = 13 - self.sideset_count
+            self.prog[_PROG_DATA][-1] |= self.sideset_opt << 12 | value << set_bit
+        return self
+
+    def wrap_target(self):
+        self.prog[_PROG_EXECCTRL] |= self.num_instr << 7
+
+    def wrap(self):
+        assert self.num_instr
+        self.prog[_PROG_EXECCTRL] |= (self.num_instr - 1) << 12
+        self.wrap_used = True
+
+    def label(self, label):
+        if self.pass_ == 0:
+            if label in self.labels:
+                raise PIOASMError("duplicate label {}".format(label))
+            self.labels[label] = self.num_instr
+
+    def word(self, instr, label=None):
+        self.num_instr += 1
+        if self.pass_ > 0:
+            if label is None:
+                label = 0
+            elif isinstance(label, str):
+                if label not in self.labels:
+                    raise PIOASMError("unknown label {}".format(label))
+                label = self.labels[label]
+            self.prog[_PROG_DATA].append(instr | label)
+        return self
+
+    def nop(self):
+        return self.word(0xA042)
+
+    def jmp(self, cond, label=None):
+        if label is None:
+            label = cond
+            cond = 0                     # always
+        return self.word(0x0000 | cond << 5, label)
+
+    def wait(self, polarity, src, index):
+        if src == 6:
+            src = 1                      # "pin"
+        elif src != 0:
+            src = 2                      # "irq"
+        return self.word(0x2000 | polarity << 7 | src << 5 | index)
+
+    def in_(self, src, data):
+        if not 0 < data <= 32:
+            raise PIOASMError("invalid bit count {}".format(data))
+        return self.word(0x4000 | src << 5 | data & 0x1F)
+
+    def out(self, dest, data):
+        if dest == 8:
+            dest = 7                     # exec
+        if not 0 < data <= 32:
+            raise PIOASMError("invalid bit count {}".format(data))
+        return self.word(0x6000 | dest << 5 | data & 0x1F)
+
+    def push(self, value=0, value2=0):
+        value |= value2
+        if not value & 1:
+            value |= 0x20                # block by default
+        return self.word(0x8000 | (value & 0x60))
+
+    def pull(self, value=0, value2=0):
+        value |= value2
+        if not value & 1:
+            value |= 0x20                # block by default
+        return self.word(0x8080 | (value & 0x60))
+
+    def mov(self, dest, src):
+        if dest == 8:
+            dest = 4                     # exec
+        return self.word(0xA000 | dest << 5 | src)
+
+    def irq(self, mod, index=None):
+        if index is None:
+            index = mod
+            mod = 0                      # no modifiers
+        return self.word(0xC000 | (mod & 0x60) | index)
+
+    def set(self, dest, data):
+        return self.word(0xE000 | dest << 5 | data)
+
+_pio_funcs = {
+    # source constants for wait
+    "gpio": 0,
+    # "pin": see below, translated to 1
+    # "irq": see below function, translated to 2
+    # source/dest constants for in_, out, mov, set
+    "pins": 0,
+    "x": 1,
+    "y": 2,
+    "null": 3,
+    "pindirs": 4,
+    "pc": 5,
+    "status": 5,
+    "isr": 6,
+    "osr": 7,
+    "exec": 8,                           # translated to 4 for mov, 7 for out
+    # operation functions for mov's src
+    "invert": lambda x: x | 0x08,
+    "reverse": lambda x: x | 0x10,
+    # jmp condition constants
+    "not_x": 1,
+    "x_dec": 2,
+    "not_y": 3,
+    "y_dec": 4,
+    "x_not_y": 5,
+    "pin": 6,
+    "not_osre": 7,
+    # constants for push, pull
+    "noblock": 0x01,
+    "block": 0x21,
+    "iffull": 0x40,
+    "ifempty": 0x40,
+    # constants and modifiers for irq
+    # "noblock": see above
+    # "block": see above
+    "clear": 0x40,
+    "rel": lambda x: x | 0x10,
+}
+
+def _program_globals(emit):
+    gl = dict(_pio_funcs)
+    gl["wrap_target"] = emit.wrap_target
+    gl["wrap"] = emit.wrap
+    gl["label"] = emit.label
+    gl["word"] = emit.word
+    gl["nop"] = emit.nop
+    gl["jmp"] = emit.jmp
+    gl["wait"] = emit.wait
+    gl["in_"] = emit.in_
+    gl["out"] = emit.out
+    gl["push"] = emit.push
+    gl["pull"] = emit.pull
+    gl["mov"] = emit.mov
+    gl["irq"] = emit.irq
+    gl["set"] = emit.set
+    return gl
+
+def asm_pio(**kw):
+    emit = PIOASMEmit(**kw)
+
+    def dec(f):
+        # MicroPython swaps the function's globals in place, here it gets a copy with the PIO names.
+        # Its defaults and closure stay, a program made inside a function can use that function's variables
+        program = types.FunctionType(f.__code__, _program_globals(emit), f.__name__, f.__defaults__, f.__closure__)
+        emit.start_pass(0)
+        program()
+        emit.start_pass(1)
+        program()
+        return emit.prog
+
+    return dec
+
+def asm_pio_encode(instr, sideset_count, sideset_opt=False): # sideset_count is inclusive of enable bit
+    emit = PIOASMEmit()
+    emit.sideset_count = sideset_count
+    emit.sideset_opt = sideset_opt != 0
+    emit.delay_max = 31 >> (sideset_count + emit.sideset_opt)
+    emit.pass_ = 1
+    emit.num_instr = 0
+    emit.num_sideset = 0
+    exec(instr, _program_globals(emit))
+    if len(emit.prog[_PROG_DATA]) != 1:
+        raise PIOASMError("expecting exactly 1 instruction")
+    return emit.prog[_PROG_DATA][0]
+
+         ### Helpers ###
+def _pin_id(pin):
+    if pin is None or isinstance(pin, int):
+        return pin
+    return pin._id
+
+def _pin_inits(init): # sideset_init etc. to a tuple of PIO.IN_LOW / OUT_LOW ... values
+    if init is None:
+        return ()
+    if isinstance(init, int):
+        return (init,)
+    return tuple(init)
+
+def _sideset_pins(prog):
+    return len(_pin_inits(prog[_PROG_SIDESET_PINS]))
+
+         ### PIO ###
+class PIO:
+    IN_LOW = 0
+    IN_HIGH = 1
+    OUT_LOW = 2
+    OUT_HIGH = 3
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+    IRQ_SM0 = 0x100
+    IRQ_SM1 = 0x200
+    IRQ_SM2 = 0x400
+    IRQ_SM3 = 0x800
+
+    _instances = {}
+
+    def __new__(cls, id):
+        if id not in (0, 1):
+            raise ValueError("invalid PIO")
+        block = emu.emulator.blocks[id]
+        obj = cls._instances.get(id)
+        if obj is None or obj._block is not block:     # A new one after pio_emulator.reset()
+            obj = object.__new__(cls)
+            obj._id = id
+            obj._block = block
+            block.pio_obj = obj
+            cls._instances[id] = obj
+        return obj
+
+    def __repr__(self):
+        return "PIO({})".format(self._id)
+
+    def add_program(self, program):
+        memory = self._block.memory
+        if program[_PROG_OFFSET_PIO0 + self._id] >= 0:
+            return
+        length = len(program[_PROG_DATA])
+        for offset in range(32 - length, -1, -1):        # Same search as the Pico SDK, from the top
+            if all(slot is None for slot in memory[offset:offset + length]):
+                for i in range(offset, offset + length):
+                    memory[i] = program
+                program[_PROG_OFFSET_PIO0 + self._id] = offset
+                return
+        raise OSError(12, "ENOMEM")
+
+    def remove_program(self, program=None):
+        memory = self._block.memory
+        for i in range(32):
+            if memory[i] is not None and (program is None or memory[i] is program):
+                memory[i][_PROG_OFFSET_PIO0 + self._id] = -1
+                memory[i] = None
+
+    def state_machine(self, id, program=None, *args, **kw):
+        if not 0 <= id < 4:
+            raise ValueError("invalid StateMachine")
+        if program is None:
+            return StateMachine(self._id * 4 + id)
+        return StateMachine(self._id * 4 + id, program, *args, **kw)
+
+    def irq(self, handler=None, trigger=IRQ_SM0 | IRQ_SM1 | IRQ_SM2 | IRQ_SM3, hard=False):
+        block = self._block
+        block.pio_handler = handler
+        block.pio_trigger = trigger
+        block.irq_enabled = (trigger >> 8) & 0xF if handler else 0
+        for i in range(4):
+            if block.sm_handlers[i] is not None:
+                block.irq_enabled |= 1 << i
+        return _IRQ(block, trigger)
+
+class _IRQ:
+    def __init__(self, block, trigger):
+        self._block = block
+        self._trigger = trigger
+
+    def flags(self):
+        return self._block.flags
+
+    def trigger(self):
+        return self._trigger
+
+         ### StateMachine ###
+class StateMachine:
+    _instances = {}
+
+    def __new__(cls, id, program=None, *args, **kw):
+        if not 0 <= id < 8:
+            raise ValueError("invalid StateMachine")
+        sm = emu.emulator.blocks[id // 4].sms[id % 4]
+        obj = cls._instances.get(id)
+        if obj is None or obj._sm is not sm:
+            obj = object.__new__(cls)
+            obj._id = id
+            obj._sm = sm
+            obj._pio = PIO(id // 4)
+            sm.obj = obj
+            cls._instances[id] = obj
+        if program is not None:
+            obj.init(program, *args, **kw)
+        return obj
+
+    def __init__(self, id, program=None, *args, **kw):
+        pass
+
+    def __repr__(self):
+        return "StateMachine({})".format(self._id)
+
+    def init(self, program, freq=-1, *, in_base=None, out_base=None, set_base=None, jmp_pin=None,
+             sideset_base=None, in_shiftdir=None, out_shiftdir=None, push_thresh=None, pull_thresh=None):
+        e = emu.emulator
+        sm = self._sm
+        block = sm.block
+        e.cpu()
+        e.set_enabled(sm, False)
+        self._pio.add_program(program)
+        words = program[_PROG_DATA]
+        execctrl = program[_PROG_EXECCTRL]
+        shiftctrl = program[_PROG_SHIFTCTRL]
+        if in_shiftdir is not None:
+            shiftctrl = shiftctrl & ~(1 << 18) | in_shiftdir << 18
+        if out_shiftdir is not None:
+            shiftctrl = shiftctrl & ~(1 << 19) | out_shiftdir << 19
+        if push_thresh is not None:
+            shiftctrl = shiftctrl & ~(0x1F << 20) | (push_thresh & 0x1F) << 20
+        if pull_thresh is not None:
+            shiftctrl = shiftctrl & ~(0x1F << 25) | (pull_thresh & 0x1F) << 25
+        sideset_opt = bool(execctrl >> 30 & 1)
+        sideset_count = _sideset_pins(program) + sideset_opt
+        sm.configure(words, sideset_count, sideset_opt, execctrl, shiftctrl,
+                     (execctrl >> 7) & 0x1F, (execctrl >> 12) & 0x1F)
+        if freq != -1:
+            div = e.sys_freq * emu.SUB // freq
+            if div < emu.SUB or div >= 0x10000 * emu.SUB:
+                raise ValueError("freq out of range")
+            sm.div = div
+        sm.in_base = _pin_id(in_base) or 0
+        sm.jmp_pin = _pin_id(jmp_pin) or 0
+        groups = ((out_base, program[_PROG_OUT_PINS], "out"), (set_base, program[_PROG_SET_PINS], "set"),
+                  (sideset_base, program[_PROG_SIDESET_PINS], "side"))
+        for base, init, name in groups:
+            base = _pin_id(base)
+            inits = _pin_inits(init)
+            setattr(sm, name + "_base", base or 0)
+            setattr(sm, name + "_count", len(inits) if base is not None else 0)
+            if base is None:
+                continue
+            for i, value in enumerate(inits):
+                pin = base + i
+                if pin < emu.NUM_PINS:
+                    e.pio_init(block, pin, value >> 1, value & 1)
+
+    def active(self, value=None):
+        e = emu.emulator
+        if value is None:
+            return self._sm.enabled
+        e.cpu()
+        e.set_enabled(self._sm, bool(value))
+
+    def restart(self):
+        emu.emulator.restart_sm(self._sm)
+
+    def exec(self, instr):
+        e = emu.emulator
+        e.cpu()
+        if isinstance(instr, str):
+            instr = asm_pio_encode(instr, self._sm.sideset_count, self._sm.sideset_opt)
+        e.exec(self._sm, instr)
+
+    def put(self, value, shift=0):
+        e = emu.emulator
+        sm = self._sm
+        e.cpu()
+        values = (value,) if isinstance(value, int) else value
+        for word in values:
+            e.wait_for(lambda: len(sm.tx) < sm.tx_depth, "put() on a full FIFO")
+            e.tx_push(sm, word << shift)
+
+    def get(self, buf=None, shift=0):
+        e = emu.emulator
+        sm = self._sm
+        e.cpu()
+        if buf is None:
+            e.wait_for(lambda: sm.rx, "get() on an empty FIFO")
+            return e.rx_pop(sm) >> shift
+        for i in range(len(buf)):
+            e.wait_for(lambda: sm.rx, "get() on an empty FIFO")
+            buf[i] = e.rx_pop(sm) >> shift
+
+    def rx_fifo(self):
+        return len(self._sm.rx)
+
+    def tx_fifo(self):
+        return len(self._sm.tx)
+
+    def irq(self, handler=None, trigger=0 | 1, hard=False):
+        sm = self._sm
+        block = sm.block
+        block.sm_handlers[sm.index] = handler
+        if handler is None:
+            block.irq_enabled &= ~(1 << sm.index)
+        else:
+            block.irq_enabled |= 1 << sm.index
+        return _IRQ(block, trigger)
+
+         ### DMA ###
+class DMA:
+    def __init__(self):
+        e = emu.emulator
+        for ch in e.dma:
+            if not ch.claimed:
+                break
+        else:
+            raise OSError(16, "EBUSY")
+        ch.claimed = True
+        ch.obj = self
+        ch.ctrl = self.pack_ctrl()
+        self._ch = ch
+        self.channel = ch.index
+
+    def __repr__(self):
+        return "DMA({})".format(self.channel)
+
+    def pack_ctrl(self, default=None, **kw):
+        fields = self.unpack_ctrl(default) if default is not None else {
+            "enable": 1, "high_pri": 0, "size": 2, "inc_read": 1, "inc_write": 1, "ring_size": 0,
+            "ring_sel": 0, "chain_to": self.channel if hasattr(self, "channel") else 0, "treq_sel": 0x3F,
+            "irq_quiet": 1, "bswap": 0, "sniff_en": 0}
+        for key, value in kw.items():
+            if key not in fields:
+                raise KeyError(key)
+            fields[key] = int(value)
+        return (fields["enable"] | fields["high_pri"] << 1 | fields["size"] << 2 | fields["inc_read"] << 4
+                | fields["inc_write"] << 5 | fields["ring_size"] << 6 | fields["ring_sel"] << 10
+                | fields["chain_to"] << 11 | fields["treq_sel"] << 15 | fields["irq_quiet"] << 21
+                | fields["bswap"] << 22 | fields["sniff_en"] << 23)
+
+    @staticmethod
+    def unpack_ctrl(value):
+        return {"enable": value & 1, "high_pri": value >> 1 & 1, "size": value >> 2 & 3,
+                "inc_read": value >> 4 & 1, "inc_write": value >> 5 & 1, "ring_size": value >> 6 & 0xF,
+                "ring_sel": value >> 10 & 1, "chain_to": value >> 11 & 0xF, "treq_sel": value >> 15 & 0x3F,
+                "irq_quiet": value >> 21 & 1, "bswap": value >> 22 & 1, "sniff_en": value >> 23 & 1,
+                "busy": value >> 24 & 1}
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        e = emu.emulator
+        ch = self._ch
+        e.cpu()
+        if read is not None:
+            ch.read = e.dma_address(read, False)
+        if write is not None:
+            ch.write = e.dma_address(write, True)
+        if count is not None:
+            ch.count = count
+        if ctrl is not None:
+            ch.ctrl = ctrl
+        if trigger:
+            e.dma_trigger(ch)
+
+    def active(self, value=None):
+        e = emu.emulator
+        if value is None:
+            return self._ch.busy
+        if value:
+            e.dma_trigger(self._ch)
+        else:
+            self._ch.busy = False
+
+    def irq(self, handler=None, hard=False):
+        self._ch.handler = handler
+
+    def close(self):
+        ch = self._ch
+        ch.busy = False
+        ch.handler = None
+        ch.claimed = False
+        ch.obj = None
+
+    @property
+    def read(self):
+        return self._ch.read
+
+    @read.setter
+    def read(self, value):
+        self._ch.read = emu.emulator.dma_address(value, False)
+
+    @property
+    def write(self):
+        return self._ch.write
+
+    @write.setter
+    def write(self, value):
+        self._ch.write = emu.emulator.dma_address(value, True)
+
+    @property
+    def count(self):
+        return self._ch.count
+
+    @count.setter
+    def count(self, value):
+        self._ch.count = value
+
+    @property
+    def ctrl(self):
+        return self._ch.ctrl | (self._ch.busy << 24)
+
+    @ctrl.setter
+    def ctrl(self, value):
+        self._ch.ctrl = value
+
+def bootsel_button():
+    return 0
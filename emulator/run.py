@@ -0,0 +1,42 @@
+         ### Libraries ###
+import os
+import runpy
+import sys
+
+# Runs a MicroPython script from this repository on the computer, with the PIO
+# programs on the emulator instead of a Pico:
+#     python emulator/run.py main.py
+#     python emulator/run.py my_test.py --vcd moves.vcd
+# The script can import pio_emulator to look at the pin trace afterwards,
+# --vcd writes it for a waveform viewer such as GTKWave.
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path[0:0] = [here, root, os.path.join(root, "experimental")]
+
+import pio_emulator
+pio_emulator.install()
+
+def main(argv):
+    vcd = None
+    if "--vcd" in argv:
+        i = argv.index("--vcd")
+        vcd = argv[i + 1]
+        del argv[i:i + 2]
+    if not argv:
+        print("usage: python emulator/run.py script.py [--vcd trace.vcd] [args...]")
+        return 2
+    sys.argv = argv
+    sys.path.insert(0, os.path.dirname(os.path.abspath(argv[0])))
+    try:
+        runpy.run_path(argv[0], run_name="__main__")
+    finally:
+        e = pio_emulator.emulator
+        print("emulated {:.6f} s, {} PIO instructions, {} pin edges".format(
+            e.cycles() / e.sys_freq, e.instructions, len(e.trace_t)))
+        if vcd:
+            e.write_vcd(vcd)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,222 @@
+         ### Libraries ###
+import time                                 # When each encoder last moved, for the stall check
+from machine import Pin
+import machine                              # System clock, the decoders run at it
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # steps_per_rev and ThreadSafeFlag
+import step_driver                          # The axes the encoders check, and their positions
+import telemetry                            # Stalls and corrections
+asyncio = ctrl.asyncio
+
+# encoder closes the loop of step_driver with quadrature encoders. Every step
+# driver axis on state machine 0-3 can have an encoder, decoded by state machine
+# 4-7 in PIO block 1, which step_driver leaves free with 4 axes or less. The
+# decoders count every edge of A and B (x4) in PIO, so no CPU time goes to edges.
+#
+#     encoder.encoders[0] = (10, 4000)                   (pin A and counts per revolution, pin B is pin A + 1)
+#     encoder.start()                                    (takes over step_driver and block 1)
+#     encoder.steps(3200, -800)                          (a step_driver move, checked and corrected)
+#     encoder.position()                                 (steps every axis really is at)
+#     encoder.stop()
+#
+# While a move runs, an axis whose encoder doesn't move for stall_ms before it
+# should be done has stalled. At the end of the move the encoder is compared with
+# step_driver.position: a difference of more than tolerance steps is made good
+# with a correction move at correct_delay, up to retries times. A stalled axis, or
+# one that is more than max_error steps off, is not corrected: step_driver.position
+# is set to where its encoder says it is and RuntimeError is raised, so position()
+# and zero() are never wrong about an axis with an encoder.
+#
+# Call encoder.stop() instead of step_driver.stop(): stepper_controller needs
+# block 1 back, so the decoders have to go first.
+
+         ### Settings ###
+encoders = [None] * 4 # (pin A, counts per revolution) per step_driver axis, None = no encoder, set the axes that have one
+                     # Negative counts per revolution when the encoder counts the other way than the motor turns
+pull = Pin.PULL_UP   # Pull on the encoder pins, None for encoders that drive the pins both ways
+freq = None          # Decoder frequency, None = system clock. A sample takes 7-8 cycles
+check_ms = 5         # How often a move looks at the encoders
+stall_ms = 50        # An axis that should be stepping but whose encoder doesn't move this long has stalled
+tolerance = 1        # [steps] following error left alone at the end of a move
+max_error = 32       # [steps] more than this at the end of a move is a stall, not something to correct
+retries = 2          # Correction moves per move at most
+correct_delay = 1000 # step_driver delay of the correction moves
+
+         ### Global Variables ###
+stalled = [False] * 4                             # Axes that stalled in the last move
+corrections = 0                                   # Correction moves made so far
+_sms = [None] * 4                                 # Decoder state machine per axis, None = no encoder
+_offset = [0.0] * 4                               # step_driver.position of count 0 per axis
+_moved = [0, 0, 0, 0]                             # ticks_ms() when each encoder last moved
+_last = [0, 0, 0, 0]                              # Count at _moved
+_until = [0, 0, 0, 0]                             # ticks_ms() when each axis should be done stepping
+_moving = False
+
+         ### PIO functions ###
+# quadrature keeps the count in y. The last pin state (2 bits) is put back into
+# ISR with out(isr, 2), the new one is shifted in after it and mov(pc, isr) jumps
+# into the table of the 16 old/new pairs: a valid change jumps to increment or
+# decrement, no change or an invalid one (both pins at once) to update. update
+# pushes y on every pass, Python reads the newest value from the RX FIFO. The jump
+# table has to be at offset 0, so the program is padded to fill the block.
+@asm_pio(in_shiftdir=PIO.SHIFT_LEFT, out_shiftdir=PIO.SHIFT_RIGHT)
+def quadrature():
+    jmp("update")                  # 00 -> 00 (old state -> new state, B A)
+    jmp("decrement")               # 00 -> 01
+    jmp("increment")               # 00 -> 10
+    jmp("update")                  # 00 -> 11
+    jmp("increment")               # 01 -> 00
+    jmp("update")                  # 01 -> 01
+    jmp("update")                  # 01 -> 10
+    jmp("decrement")               # 01 -> 11
+    jmp("decrement")               # 10 -> 00
+    jmp("update")                  # 10 -> 01
+    jmp("update")                  # 10 -> 10
+    jmp("increment")               # 10 -> 11
+    jmp("update")                  # 11 -> 00
+    jmp("increment")               # 11 -> 01
+    label("decrement")
+    jmp(y_dec, "update")           # 11 -> 10, and y - 1 for the other decrements
+    wrap_target()
+    label("update")                # 11 -> 11
+    mov(isr, y)                    # the count to Python
+    push(noblock)                  # a full FIFO drops it, Python drains the old ones first
+    out(isr, 2)                    # the last pin state becomes the old state
+    in_(pins, 2)                   # pin B and pin A after it
+    mov(osr, isr)                  # kept for the next pass
+    mov(pc, isr)                   # into the table
+    label("increment")
+    mov(y, invert(y))              # y + 1 is ~(~y - 1)
+    jmp(y_dec, "increment_end")
+    label("increment_end")
+    mov(y, invert(y))
+    wrap()
+    nop()                          # Padding to 32 instructions, so the program sits at offset 0
+    nop()
+    nop()
+    nop()
+    nop()
+    nop()
+    nop()
+    nop()
+
+     ### Encoder mode ###
+def _ratio(axis): # step_driver steps per encoder count
+    return ctrl.steps_per_rev / encoders[axis][1]
+
+def counts(axis): # Count of one encoder right now
+    sm = _sms[axis]
+    for _ in range(sm.rx_fifo()):    # Old counts
+        sm.get()
+    count = sm.get()                 # The next pass pushes a fresh one within a few cycles
+    return count - 0x100000000 if count & 0x80000000 else count
+
+def _measured(axis): # Steps the axis is at according to its encoder
+    return round(counts(axis) * _ratio(axis) + _offset[axis])
+
+def position(): # Steps from origin of every axis, measured where there is an encoder
+    return [_measured(axis) if axis < 4 and _sms[axis] else step_driver.position[axis] for axis in range(len(step_driver.axes))]
+
+def error(): # step_driver.position minus the measured position of every axis, 0 without an encoder
+    return [step_driver.position[axis] - _measured(axis) if axis < 4 and _sms[axis] else 0 for axis in range(len(step_driver.axes))]
+
+def start(): # Takes over step_driver and PIO block 1, the encoders start at step_driver.position
+    if len(step_driver.axes) > 4:
+        raise ValueError("the encoders need PIO block 1, step_driver can have 4 axes at most")
+    step_driver.start()
+    for axis in range(len(step_driver.axes)):
+        if axis >= len(encoders) or not encoders[axis] or _sms[axis]:
+            continue
+        pin_a = encoders[axis][0]
+        Pin(pin_a, Pin.IN, pull)
+        Pin(pin_a + 1, Pin.IN, pull)
+        sm = StateMachine(4 + axis, quadrature, freq=freq or machine.freq(), in_base=Pin(pin_a))
+        sm.active(1)
+        _sms[axis] = sm
+        _offset[axis] = step_driver.position[axis] - counts(axis) * _ratio(axis)
+
+def stop(): # Stops the decoders, then hands the state machines back to stepper_controller through step_driver
+    for axis in range(4):
+        if _sms[axis]:
+            _sms[axis].active(0)
+            _sms[axis] = None
+    rp2.PIO(1).remove_program(quadrature)
+    step_driver.stop()
+
+def _watch(steps, delays): # Sets when each axis should be done, the stall check gives up on it then
+    now = time.ticks_ms()
+    for axis in range(4):
+        if _sms[axis]:
+            count = abs(round(steps[axis])) if axis < len(steps) else 0
+            delay = step_driver.delay if delays is None else delays[axis]
+            _until[axis] = time.ticks_add(now, count * (delay + step_driver.OVERHEAD) * 1000 // step_driver.freq)
+            _last[axis] = counts(axis)
+            _moved[axis] = now
+
+def _check(): # Marks every axis whose encoder stood still for stall_ms while it should have been stepping
+    now = time.ticks_ms()
+    for axis in range(4):
+        if not _sms[axis] or stalled[axis] or time.ticks_diff(_until[axis], now) <= 0:
+            continue
+        count = counts(axis)
+        if count != _last[axis]:
+            _last[axis] = count
+            _moved[axis] = now
+        elif time.ticks_diff(now, _moved[axis]) >= stall_ms:
+            stalled[axis] = True
+            telemetry.log(1, telemetry.STALL, axis, step_driver.position[axis], _measured(axis))
+
+async def _wait(): # step_driver.wait() that clears _moving
+    global _moving
+    await step_driver.wait()
+    _moving = False
+
+async def _move(steps, delays): # One step_driver move with the stall check running
+    global _moving
+    step_driver.load(steps, delays)
+    _watch(steps, delays)
+    _moving = True
+    ctrl.activation_pin.value(1)
+    asyncio.create_task(_wait())
+    while _moving:
+        await asyncio.sleep_ms(check_ms)
+        _check()
+    ctrl.activation_pin.value(0)
+
+async def move_steps(*steps, delays=None): # step_driver.move_steps() checked against the encoders and corrected at the end
+    global corrections
+    start()
+    for axis in range(4):
+        stalled[axis] = False
+    await _move(steps, delays)
+    for attempt in range(retries + 1):
+        off = error()
+        lost = [axis for axis in range(len(off)) if stalled[axis] or abs(off[axis]) > max_error]
+        if lost:
+            for axis in lost:
+                step_driver.position[axis] -= off[axis]   # Where the encoder says the axis is
+            raise RuntimeError("axes {} stalled or lost more than max_error, {} steps off".format(lost, [off[axis] for axis in lost]))
+        fix = [value if abs(value) > tolerance else 0 for value in off]
+        if not any(fix):
+            return
+        if attempt == retries:
+            for axis in range(len(off)):
+                step_driver.position[axis] -= fix[axis]
+            raise RuntimeError("still {} steps off after {} corrections".format(fix, retries))
+        for axis in range(len(fix)):
+            if fix[axis]:
+                telemetry.log(1, telemetry.CORRECT, axis, fix[axis], attempt + 1)
+        await _move(fix, [correct_delay] * len(step_driver.axes))
+        for axis in range(len(fix)):
+            step_driver.position[axis] -= fix[axis]       # The correction only makes good the target of the move
+        corrections += 1
+
+def steps(*steps, delays=None): # Blocking version of move_steps()
+    asyncio.run(move_steps(*steps, delays=delays))
+
+async def move_angle(*degrees, delays=None):
+    await move_steps(*[round(deg / ctrl.step_angle) for deg in degrees], delays=delays)
+
+def angle(*degrees, delays=None):
+    asyncio.run(move_angle(*degrees, delays=delays))
@@ -1,13 +1,16 @@
          ### Libraries ###
-from time import sleep                      # To be able to add delays (sleep)
+import machine                              # Gives us idle() while waiting for the motors
 from machine import Pin                     # To allow software to manipulate board pins
 from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import telemetry                            # Records moves without printing from the motion path
+import profiler                             # Times the phases of a move when profiler.enabled
+from stepper_controller import ThreadSafeFlag # The same completion flag, importing it sets up no hardware
+try:
+    import asyncio                          # Lets motion, comms and UI run together on one core
+except ImportError:
+    import uasyncio as asyncio              # Older MicroPython firmware ships it as uasyncio
 
          ### Global Variables ###
-motor_1 = False                   # To be able to check if a motor is completed
-motor_2 = False                   # - " -
-motor_3 = False                   # - " -
-motor_4 = False                   # - " -
 x_last = 0                        # To store relative position in steps
 y_last = 0                        # - " -
 z_last = 0                        # - " -
@@ -41,6 +44,12 @@ print ("[mm] per revolution:", lead_screw_pitch,
 # One step is 0.1125 degrees
 
 
+         ### Motor completion flags ###
+# The PIO interrupt handlers set one flag per motor when its last step is made.
+# ThreadSafeFlag comes from stepper_controller, with its stand-in for a Linux host.
+motor_done = [ThreadSafeFlag() for _ in range(4)] # One flag for each motor x, y, z and r
+
+
          ### Synchronization Pin ###
 activation_pin = Pin(25, Pin.OUT) # Pin 25 is used to trigger our PIO programs/functions
                                   # and is mandatory to have synchronous activation of motors
@@ -90,27 +99,23 @@ def step_speed():
      ### PIO interupt handlers ###
 # These are triggered by step_counter in each PIO block and thus
 # there are two similar functions that does the same thing.
-# When they are triggered, motor_n turns True and
-# they print x or y steps to REPL and which statemachine is done.
+# When they are triggered, they set the motor's flag in motor_done and
+# log the motor's steps from origin to telemetry (printing here would hold up the IRQ).
 def pio_0_handler(sm): # Motor 1
-    global motor_1
-    motor_1 = True
-    print(sm, "x:", x_last)
+    motor_done[0].set()
+    telemetry.log(2, telemetry.AXIS, 0, round(x_last))
 
 def pio_1_handler(sm): # Motor 2
-    global motor_2
-    motor_2 = True
-    print(sm, "y:", y_last)
+    motor_done[1].set()
+    telemetry.log(2, telemetry.AXIS, 1, round(y_last))
 
 def pio_2_handler(sm): # Motor 3
-    global motor_3
-    motor_3 = True
-    print(sm, "z:", z_last)
+    motor_done[2].set()
+    telemetry.log(2, telemetry.AXIS, 2, round(z_last))
 
 def pio_3_handler(sm): # Motor 4
-    global motor_4
-    motor_4 = True
-    print(sm, "r:", r_last)
+    motor_done[3].set()
+    telemetry.log(2, telemetry.AXIS, 3, round(r_last))
 
      ### Setting up state machines ###
 sc_freq = 1_000_000 # step_counter frequency
@@ -160,10 +165,12 @@ sm_6.active(1), sm_7.active(1) # Motor 4 State machine 6 and 7 in PIO block 1
 
 
 
-def runner(x, y, z, r): # Feeds the PIO programs and activates them.
-    global motor_1, motor_2, motor_3, motor_4
+async def move_steps(x, y, z, r): # Feeds the PIO programs, activates them and awaits all motors.
     global x_last, y_last, z_last, r_last
     global base_delay
+    profiling = profiler.enabled         # Read once, so a move is timed all the way or not at all
+    if profiling:
+        profiler.lap(profiler.CALL)
     x_last = x + x_last
     y_last = y + y_last
     z_last = z + z_last
@@ -184,57 +191,81 @@ def runner(x, y, z, r): # Feeds the PIO programs and activates them.
     if int(r) < 0:
         dir_pin_4.value(1)
         r_steps = r_steps * (-1)
+    for flag in motor_done:
+        flag.clear()
+    if profiling:
+        profiler.lap(profiler.ARGS)
     delay_adjustment = motor_sync(x, y, z, r)
 #     print(delay_adjustment)
+    if profiling:
+        profiler.lap(profiler.SYNC)
 
     # Clear sm_1 so that only new values exists as delays
     sm_1.exec("mov(osr, null)"), sm_1.exec("mov(x, null)"), sm_1.exec("mov(y, null)") # Clear statemachine sm_1
     sm_5.exec("mov(osr, null)"), sm_5.exec("mov(x, null)"), sm_5.exec("mov(y, null)") # Clear statemachine sm_5
     sm_3.exec("mov(osr, null)"), sm_3.exec("mov(x, null)"), sm_3.exec("mov(y, null)") # Clear statemachine sm_3
     sm_7.exec("mov(osr, null)"), sm_7.exec("mov(x, null)"), sm_7.exec("mov(y, null)") # Clear statemachine sm_7
+    if profiling:
+        profiler.lap(profiler.CLEAR)
     
     sm_1.put(delay_adjustment[0])                              # Add new delay value
     sm_5.put(delay_adjustment[1])                              # Add new delay value
     sm_3.put(delay_adjustment[2])                              # Add new delay value
     sm_7.put(delay_adjustment[3])                              # Add new delay value
+    if profiling:
+        profiler.lap(profiler.PUT)
     
-    sleep(0.5)
+    await asyncio.sleep(0.5)
+    if profiling:
+        profiler.lap(profiler.SLEEP)
     
     sm_0.put(x_steps)                                                                 # Add new n steps to sm_0
     sm_4.put(y_steps)                                                                 # Add new n steps to sm_4
     sm_2.put(z_steps)                                                                 # Add new n steps to sm_2
     sm_6.put(r_steps)                                                                 # Add new n steps to sm_6
+    if profiling:
+        profiler.lap(profiler.PUT)
     
-    sleep(0.5)                                                                        # Short delay to make sure all state machines
+    await asyncio.sleep(0.5)                                                          # Short delay to make sure all state machines
                                                                                       # have recieved their values
+    if profiling:
+        profiler.lap(profiler.SLEEP)
     activation_pin.value(1)                                                           # Start running motors.
-    print("\n### Stepping the steps... ###")
-    print("\nSteps from origin: " + "\nx:" +  str(x_last) + "\ny:" + str(y_last), "\nz:" +  str(z_last) + "\nr:" + str(r_last), "\n")
-    while True:
-        if motor_1 and motor_2 and motor_3 and motor_4:
-            dir_pin_1.value(0)
-            dir_pin_2.value(0)
-            dir_pin_3.value(0)
-            dir_pin_4.value(0)
-            motor_1 = False
-            motor_2 = False
-            motor_3 = False
-            motor_4 = False
-            activation_pin.value(0) # This is active until both processes have signaled that they are done.
-            position()
-            return
-        sleep(0.2)
+    telemetry.log(1, telemetry.MOVE, round(x), round(y), round(z), round(r))
+    if profiling:
+        profiler.lap(profiler.START)
+    for flag in motor_done:      # Other tasks keep running while the motors step.
+        await flag.wait()        # Order does not matter, we continue once every flag has been set.
+    if profiling:
+        profiler.lap(profiler.WAIT)
+    dir_pin_1.value(0)
+    dir_pin_2.value(0)
+    dir_pin_3.value(0)
+    dir_pin_4.value(0)
+    activation_pin.value(0) # This is active until all processes have signaled that they are done.
+    telemetry.log(1, telemetry.DONE, round(x_last), round(y_last), round(z_last), round(r_last)) # position() prints it when asked
+    if profiling:
+        profiler.end(profiler.FINISH)
+
+def runner(x, y, z, r): # Blocking version of move_steps() for the REPL and simple scripts.
+    if profiler.enabled:
+        profiler.begin()
+    asyncio.run(move_steps(x, y, z, r))
 
 def steps(x_steps, y_steps, z_steps, r_steps):
     runner(x_steps, y_steps, z_steps, r_steps)
 
-def angle(x_deg, y_deg, z_deg, r_deg):
-    #global step_angle # Redundant? Because only read state
+async def move_angle(x_deg, y_deg, z_deg, r_deg):
     x_steps = round(x_deg / step_angle) # No need to round?! Because angle is a product from steps and step_angle already.
     y_steps = round(y_deg / step_angle)
     z_steps = round(z_deg / step_angle)
     r_steps = round(r_deg / step_angle)
-    runner(x_steps, y_steps, z_steps, r_steps)
+    await move_steps(x_steps, y_steps, z_steps, r_steps)
+
+def angle(x_deg, y_deg, z_deg, r_deg):
+    if profiler.enabled:
+        profiler.begin()
+    asyncio.run(move_angle(x_deg, y_deg, z_deg, r_deg))
 
 def angle_instructor(aquired_tuple):
     instruction_tuple = aquired_tuple
@@ -308,8 +339,6 @@ def motor_sync(x, y, z, r):
     else:
         r_delay = 1
     
-    print(x_delay, y_delay, z_delay, r_delay)
-    
     if x_delay != 1.0:
         x_delay = -(-base_delay // x_delay)#*2
     else:
@@ -330,9 +359,9 @@ def motor_sync(x, y, z, r):
     else:
         r_delay = base_delay
     
-    print(x_delay, y_delay, z_delay, r_delay)
-    
-    return (round(x_delay), round(y_delay), round(z_delay), round(r_delay))
+    delays = (round(x_delay), round(y_delay), round(z_delay), round(r_delay))
+    telemetry.log(2, telemetry.DELAYS, delays[0], delays[1], delays[2], delays[3])
+    return delays
 
 if __name__ == "__main__":
     machine.freq(250_000_000)
@@ -0,0 +1,366 @@
+         ### Libraries ###
+import sys
+from array import array                     # Parsed words, positions and moves, preallocated
+import stepper_controller as ctrl           # Steps per revolution
+import motion_queue as mq                   # Moves are streamed with the queue as lookahead
+import path                                 # Segments of G2 / G3 arcs
+asyncio = ctrl.asyncio
+
+# gcode runs G-code sent over USB serial (stdin) or a UART. Bytes go into a ring
+# buffer, every complete line is parsed straight from the ring into fixed-point
+# integers (1/1000 of a unit) and moves are pushed into motion_queue. "ok" is
+# sent as soon as a move is queued, so a sender keeps the queue full and the
+# motors, not the parser, set the pace. Nothing else is printed while moving.
+# Parsing a line and queueing a G0 / G1 move fill preallocated arrays, and the
+# feed rate delays are integer math. That math can still make long ints for
+# very long or very slow moves, and G2 / G3 run path.arc(), which allocates.
+#
+#     G0 / G1 X Y Z R F   move (rapid / at feed rate F in units per minute), modal: axis words
+#                         without a G word move in the last G0 / G1 / G2 / G3 mode
+#     G2 / G3 X Y I J F   clockwise / counterclockwise arc in X Y around the center I J from the start,
+#                         Z and R move along linearly (a helix), no X Y is a full circle
+#     G4 P<ms> / S<s>     dwell after the queued moves
+#     G28 [X Y Z R]       back to 0 (there are no endstops, this is not a real home)
+#     G90 / G91           absolute / relative coordinates
+#     G92 X Y Z R         set the current position
+#     M114                report the position
+#     M400                wait until the queued moves are done
+#     M2 / M30            end of program, serve() returns
+#
+# A line that can't be run gets "error" and changes nothing: an unknown word, a
+# value beyond +-2147483.647, or an axis without a number anywhere but in G28.
+#
+# On a Pico:      import gcode; gcode.run()              (USB serial), gcode.run(UART(0, 115200, timeout=0))
+# On a computer:  python emulator/run.py gcode.py < job.gcode
+#                 python emulator/run.py gcode.py --pty  (prints a pty to send G-code to, like a serial port)
+
+         ### Settings ###
+scale = ((None, 360),) * 4  # (steps, units) per axis X Y Z R, 3200 steps per 360 units makes a unit one degree
+                            # None steps is ctrl.steps_per_rev when the line runs, so it follows init({"drv_ms": ...})
+                            # A 2 mm lead screw would be (None, 2), units in mm
+rapid_delay = 50     # motion_queue delay for G0, and G1 before any F
+arc_tolerance = 1    # [steps] chord error of the G2 / G3 segments
+rx_size = 256        # Ring buffer, a power of two
+line_max = 96        # Longer lines are dropped with an error
+_OVERHEAD = 9        # segment_speed cycles per step on top of the delay
+
+         ### Global Variables ###
+_AXES = b"XYZR"
+_AXIS_BITS = 1 << 23 | 1 << 24 | 1 << 25 | 1 << 17  # X, Y, Z and R in the letters found by _parse()
+_rx = bytearray(rx_size)
+_chunk = bytearray(64)                            # What one readinto() fetches before it goes into _rx
+_head = 0                                         # Next byte to parse
+_count = 0                                        # Bytes waiting in _rx
+_word = array("i", [0] * 26)                      # Value of every letter on the line, times 1000
+_bare = 0                                         # Bit per axis letter on the line without a number, only G28 takes them
+_target = array("i", [0, 0, 0, 0])                # Position in units times 1000
+_steps = array("i", [0, 0, 0, 0])                 # The same position in steps
+_start = array("i", [0, 0, 0, 0])                 # Steps at the start of an arc
+_moves = array("i", [0, 0, 0, 0])                 # Steps of the move being queued
+_delay = array("i", [0, 0, 0, 0])                 # Its motion_queue delays, push() copies them
+_MOTION_BITS = _AXIS_BITS | 1 << 8 | 1 << 9       # Axes, I and J: a line with only these is a modal move
+_motion = 0                                       # Last G0 / G1 / G2 / G3 times 1000, what modal moves use
+_absolute = True
+_feed = 0                                         # [units/min times 1000], 0 = rapid
+lines = 0                                         # Lines run since start
+errors = 0                                        # Lines that were rejected
+
+         ### Ring buffer ###
+def _read(stream): # Moves whatever the stream has into _rx, returns the bytes read or -1 at the end of the stream
+    global _count
+    room = rx_size - _count
+    if room == 0:
+        return 0
+    n = stream.readinto(_chunk)
+    if n is None:                            # Nothing available right now
+        return 0
+    if n == 0:
+        return -1
+    if n > room:                             # Can't happen with a sender waiting for "ok", but don't overwrite
+        n = room
+    tail = (_head + _count) & (rx_size - 1)
+    for i in range(n):
+        _rx[tail] = _chunk[i]
+        tail = (tail + 1) & (rx_size - 1)
+    _count += n
+    return n
+
+def _line_length(): # Bytes up to and including the next newline, 0 if there is no complete line yet
+    i = _head
+    for n in range(1, _count + 1):
+        if _rx[i] == 10:                     # \n
+            return n
+        i = (i + 1) & (rx_size - 1)
+    return 0
+
+         ### Parser ###
+def _parse(n): # Parses n bytes from _head into _word, returns a bit per letter found, -1 if the line is bad
+    global _bare
+    _bare = 0
+    seen = 0
+    i = _head
+    end = n
+    while end:
+        c = _rx[i]
+        i = (i + 1) & (rx_size - 1)
+        end -= 1
+        if c == 59:                          # ; comment to the end of the line
+            break
+        if c == 40:                          # ( comment )
+            while end:
+                end -= 1
+                c = _rx[i]
+                i = (i + 1) & (rx_size - 1)
+                if c == 41:
+                    break
+            continue
+        if c == 42:                          # *checksum, ignored
+            break
+        if c <= 32:                          # Spaces, \r and \n
+            continue
+        c &= 0xDF                            # Upper case
+        if not 65 <= c <= 90:
+            return -1
+        letter = c - 65
+        value = 0
+        sign = 1
+        decimals = -1                        # -1 = no decimal point yet
+        digits = 0
+        while end:
+            d = _rx[i]
+            if d == 45 and digits == 0 and sign == 1:   # -
+                sign = -1
+            elif d == 43 and digits == 0:    # +
+                pass
+            elif d == 46 and decimals < 0:   # .
+                decimals = 0
+            elif 48 <= d <= 57:
+                digits += 1
+                if decimals < 3:
+                    value = value * 10 + d - 48
+                    if decimals >= 0:
+                        decimals += 1
+            else:
+                break
+            i = (i + 1) & (rx_size - 1)
+            end -= 1
+        if digits == 0 and (sign < 0 or decimals == 0 or not _AXIS_BITS >> letter & 1):
+            return -1                        # Only an axis may come without a number, as in "G28 X"
+        if digits == 0:
+            _bare |= 1 << letter
+        if decimals < 0:
+            decimals = 0
+        while decimals < 3:
+            value *= 10
+            decimals += 1
+        if value > 0x7FFFFFFF:
+            return -1                        # Doesn't fit _word, a bad line and not an OverflowError
+        _word[letter] = sign * value
+        seen |= 1 << letter
+    return seen
+
+def _has(seen, letter):
+    return seen >> (letter - 65) & 1
+
+def _value(letter):
+    return _word[letter - 65]
+
+         ### Commands ###
+def _axis_steps(axis): # Steps of the axis per scale units, ctrl.steps_per_rev unless scale gives them
+    steps = scale[axis][0]
+    return ctrl.steps_per_rev if steps is None else steps
+
+def _to_steps(axis, milli): # Units times 1000 to steps
+    steps = _axis_steps(axis)
+    units = scale[axis][1]
+    return (milli * steps + (units * 1000 >> 1)) // (units * 1000)
+
+def _delays(moves, rapid): # One motion_queue delay per axis so every axis ends together at the feed rate
+    if rapid or _feed == 0:
+        return None
+    longest = 0                              # Longest distance in units times 1000
+    for axis in range(4):
+        milli = abs(moves[axis]) * scale[axis][1] * 1000 // _axis_steps(axis)
+        if milli > longest:
+            longest = milli
+    cycles = longest * 60 * mq.ss_freq // _feed                       # Time the move takes
+    for axis in range(4):
+        if moves[axis]:
+            delay = cycles // abs(moves[axis]) - _OVERHEAD
+            _delay[axis] = 0 if delay < 0 else 0x7FFFFFFF if delay > 0x7FFFFFFF else delay
+        else:
+            _delay[axis] = rapid_delay
+    return _delay
+
+async def _move(seen, rapid, home=False): # G0, G1 and G28
+    moves = _moves
+    every = not seen & _AXIS_BITS            # G28 without axes homes every axis
+    for axis in range(4):
+        moves[axis] = 0
+        letter = _AXES[axis]
+        if home:
+            if not (every or _has(seen, letter)):
+                continue
+            _target[axis] = 0
+        elif _has(seen, letter):
+            if _absolute:
+                _target[axis] = _value(letter)
+            else:
+                _target[axis] += _value(letter)
+        else:
+            continue
+        steps = _to_steps(axis, _target[axis])
+        moves[axis] = steps - _steps[axis]
+        _steps[axis] = steps
+    if moves[0] or moves[1] or moves[2] or moves[3]:
+        await mq.put(moves[0], moves[1], moves[2], moves[3], _delays(moves, rapid))
+
+async def _arc(seen, clockwise): # G2 and G3, one motion_queue segment per path.arc() segment
+    start = _start
+    for axis in range(4):
+        start[axis] = _steps[axis]
+        letter = _AXES[axis]
+        if _has(seen, letter):
+            if _absolute:
+                _target[axis] = _value(letter)
+            else:
+                _target[axis] += _value(letter)
+        _steps[axis] = _to_steps(axis, _target[axis])
+    center = (_to_steps(0, _value(73)) if _has(seen, 73) else 0, # I
+              _to_steps(1, _value(74)) if _has(seen, 74) else 0) # J
+    for moves in path.arc(_steps, center, clockwise, start, tol=arc_tolerance):
+        if moves[0] or moves[1] or moves[2] or moves[3]:
+            await mq.put(moves[0], moves[1], moves[2], moves[3], _delays(moves, False))
+
+def _report(out): # M114
+    for axis in range(4):
+        milli = _target[axis]
+        sign = "-" if milli < 0 else ""
+        milli = abs(milli)
+        out.write("{}:{}{}.{:03d} ".format(chr(_AXES[axis]), sign, milli // 1000, milli % 1000).encode())
+    out.write(b"\n")
+
+async def _run(seen, out): # Executes one parsed line, returns False at the end of the program
+    global _absolute, _feed, _motion
+    if _has(seen, 70):                       # F
+        _feed = _value(70)
+    g = -1
+    if _has(seen, 71):                       # G
+        g = _value(71)
+    elif seen & _MOTION_BITS and not _has(seen, 77):
+        g = _motion                          # Modal move, "X10" after "G1 X0" is a G1
+    if _bare and g != 28000:
+        return None                          # "G1 X" would move X to 0
+    if g >= 0:
+        if g == 0 or g == 1000 or g == 2000 or g == 3000:
+            _motion = g
+        if g == 0 or g == 1000:
+            await _move(seen, g == 0)
+        elif g == 2000 or g == 3000:
+            if not (_has(seen, 73) or _has(seen, 74)):
+                return None                  # An arc needs its center, R words are the R axis here
+            await _arc(seen, g == 2000)
+        elif g == 4000:
+            await mq.drain()
+            ms = _value(80) if _has(seen, 80) else _value(83) * 1000 if _has(seen, 83) else 0
+            await asyncio.sleep_ms(ms // 1000)
+        elif g == 28000:
+            await _move(seen, True, True)
+        elif g == 90000:
+            _absolute = True
+        elif g == 91000:
+            _absolute = False
+        elif g == 92000:
+            for axis in range(4):
+                if _has(seen, _AXES[axis]):
+                    _target[axis] = _value(_AXES[axis])
+                    _steps[axis] = _to_steps(axis, _target[axis])
+        else:
+            return None
+    elif _has(seen, 77):                     # M
+        m = _value(77)
+        if m == 114000:
+            _report(out)
+        elif m == 400000:
+            await mq.drain()
+        elif m == 2000 or m == 30000:
+            await mq.drain()
+            return False
+        else:
+            return None
+    return True
+
+async def serve(stream, out=None): # Runs G-code from stream until M2/M30 or the end of the stream, replies go to out
+    global _head, _count, lines, errors
+    out = out or stream
+    mq.start()
+    try:
+        while True:
+            n = _read(stream)
+            length = _line_length()
+            if length == 0 and (_count == rx_size or n < 0):    # No newline in a full buffer, or the last line
+                length = _count
+            if length == 0:
+                if n < 0:
+                    break
+                await asyncio.sleep_ms(1 if n == 0 else 0)
+                continue
+            seen = _parse(length) if length <= line_max else -1
+            _head = (_head + length) & (rx_size - 1)
+            _count -= length
+            if seen == 0:                    # Empty line or only a comment
+                continue
+            lines += 1
+            result = await _run(seen, out) if seen > 0 else None
+            if result is None:
+                errors += 1
+                out.write(b"error\n")
+                continue
+            out.write(b"ok\n")
+            if not result:
+                break
+    finally:
+        await mq.drain()
+        mq.stop()
+
+def position(): # Where the G-code has sent the motors, in units
+    return [_target[axis] / 1000 for axis in range(4)]
+
+class _Stdin: # USB serial on a Pico: stdin only gets polled so serve() never blocks
+    def __init__(self):
+        import select
+        self._poll = select.poll()
+        self._poll.register(sys.stdin, select.POLLIN)
+        self._one = bytearray(1)
+
+    def readinto(self, buf):
+        n = 0
+        while n < len(buf) and self._poll.poll(0):
+            sys.stdin.buffer.readinto(self._one, 1)
+            buf[n] = self._one[0]
+            n += 1
+        return n or None
+
+def run(uart=None): # Blocking serve() on a UART, or on USB serial when no UART is given
+    if uart is None:
+        asyncio.run(serve(_Stdin(), sys.stdout.buffer))
+    else:
+        asyncio.run(serve(uart))
+
+if __name__ == "__main__":
+    if "--pty" in sys.argv:                  # Linux: a pty that a G-code sender can open like a serial port
+        import os
+        master, slave = os.openpty()
+        print("send G-code to", os.ttyname(slave), file=sys.stderr)
+        os.set_blocking(master, False)
+        port = open(master, "r+b", buffering=0)
+        asyncio.run(serve(port))
+    elif len(sys.argv) > 1:                  # Linux: a serial port or fifo
+        port = open(sys.argv[1], "r+b", buffering=0)
+        asyncio.run(serve(port))
+    else:
+        stdin = getattr(sys.stdin.buffer, "raw", None)   # A computer reads stdin as it comes, a Pico polls it
+        if stdin is None:
+            run()
+        else:
+            asyncio.run(serve(stdin, getattr(sys.stdout.buffer, "raw", sys.stdout.buffer)))
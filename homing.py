@@ -0,0 +1,154 @@
+         ### Libraries ###
+import time                                 # When each axis stopped, to measure the reaction to the switch
+from array import array                     # Steps made per axis
+from machine import Pin
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # Positions and ThreadSafeFlag
+import step_driver                          # Step and direction pins of every axis, and their positions
+asyncio = ctrl.asyncio
+
+# homing finds the origin of each axis with an endstop switch, where zero() only
+# turns back the steps counted since power-up. The switch is read by the PIO
+# program itself with jmp(pin) before every step, so a motor stops at the first
+# step after its switch triggers no matter what Python is doing at the time.
+#
+#     homing.switches = [(18, -1), (19, -1), None, None]     (axes 0 and 1 have a switch, both towards CCW)
+#     homing.home()                                          (every axis with a switch, or home(0) for one)
+#
+# Every axis does a fast approach until its switch triggers, backs off back_off
+# steps and approaches again at slow_delay, so the origin is where the switch
+# triggers at low speed. Then the positions of the axes (step_driver.position and
+# stepper_controller's x_last etc.) are set to 0. The axes use the pins of
+# step_driver.axes and run on one state machine each, axis 0 on state machine 0.
+#
+# The switch is triggered when its pin is high. A normally closed switch from the
+# pin to GND, with the pull-up on, is high when it is pressed and also when a wire
+# breaks, so a broken switch stops the axis instead of letting it crash.
+
+         ### Settings ###
+switches = [(18, -1), (19, -1), (20, -1), (21, -1)] # (endstop pin, direction towards it) per step_driver axis, None = not homed
+fast_delay = 100     # step_driver delay of the fast approach, step period = (delay + OVERHEAD) / freq
+slow_delay = 1000    # step_driver delay of the back-off and the slow approach
+back_off = 200       # Steps away from the switch between the two approaches
+travel = None        # Most steps the fast approach goes looking for the switch, None = 16 turns of ctrl.steps_per_rev
+pull = Pin.PULL_UP   # Pull on the endstop pins, None for switches that drive the pin both ways
+OVERHEAD = 5         # PIO cycles per step on top of the delay when the switch is checked
+
+         ### Global Variables ###
+found = array("i", [0] * 8)                       # Steps of the slow approach until the switch, per axis
+stopped = array("I", [0] * 8)                     # ticks_us() when each axis stopped in the last approach
+_made = array("i", [0] * 8)                       # Steps made per axis in the last move
+_done = [ctrl.ThreadSafeFlag() for _ in range(8)] # Set by the completion IRQ of each axis
+_sms = [None] * 8                                 # home_driver state machine per axis, None when not homed
+_POSITIONS = ("x_last", "y_last", "z_last", "r_last")
+
+         ### PIO functions ###
+# home_driver is step_driver with the endstop check. It pulls the delay, kept in
+# ISR, and steps << 2 | check << 1 | direction. When check is set, jmp(pin) reads
+# the switch before every step and ends the move as soon as it is high. The back-off
+# has to leave a pressed switch, so it runs in the loop without the check. At the
+# end x is pushed back, so Python knows how many steps were made before the switch.
+@asm_pio(sideset_init=PIO.OUT_LOW, out_init=PIO.OUT_LOW, out_shiftdir=PIO.SHIFT_RIGHT)
+def home_driver():
+    pull(block)                    # delay of the move
+    mov(isr, osr)                  # kept in ISR until the end
+    pull(block)                    # steps << 2 | check << 1 | direction
+    out(pins, 1)                   # direction bit goes straight onto the direction pin
+    out(y, 1)                      # check bit, 1 = stop at the switch
+    out(x, 30)                     # the rest of the word is the number of steps
+    jmp(not_y, "blind")            # no check, the back-off
+    jmp(x_dec, "step")             # x = steps - 1, so the loop makes exactly x steps
+    jmp("end")                     # no steps in this move
+    label("step")
+    jmp(pin, "end")                # the switch is triggered, stop before this step
+    mov(y, isr) .side(1) [1]       # load the delay - Side Step Pin On for 2 cycles
+    label("delay")
+    jmp(y_dec, "delay") .side(0)   # delay loop - Side Step Pin Off
+    jmp(x_dec, "step")             # if x is NOT 0(zero), remove one (-1) from x and make the next step
+    jmp("end")
+    label("blind")
+    jmp(x_dec, "blind_step")       # the same loop without the switch
+    jmp("end")
+    label("blind_step")
+    mov(y, isr) .side(1) [1]
+    label("blind_delay")
+    jmp(y_dec, "blind_delay") .side(0)
+    jmp(x_dec, "blind_step")
+    label("end")
+    mov(isr, x)                    # steps - 1 - made, 0xFFFFFFFF when every step was made
+    push(noblock)
+    irq(block, rel(0))             # Signals the IRQ handler that the move has ended and waits for it
+
+     ### PIO interupt handler ###
+def pio_handler(sm): # Every homed axis, the state machine tells which one stopped
+    axis = _sms.index(sm)
+    stopped[axis] = time.ticks_us()
+    _done[axis].set()
+
+     ### Homing ###
+def _start(axes): # Takes over the state machines of the axes, like step_driver.start()
+    if step_driver.running():
+        step_driver.stop()
+    ctrl.release_state_machines()
+    for axis in axes:
+        step_pin, dir_pin = step_driver.axes[axis]
+        endstop = Pin(switches[axis][0], Pin.IN, pull)
+        sm = StateMachine(axis, home_driver, freq=step_driver.freq, sideset_base=step_pin, out_base=dir_pin, jmp_pin=endstop)
+        sm.irq(pio_handler)
+        _sms[axis] = sm
+        sm.active(1)
+
+def _stop(axes): # Hands the state machines back to stepper_controller
+    for axis in axes:
+        _sms[axis].active(0)
+        _sms[axis] = None
+        dir_pin = step_driver.axes[axis][1]
+        if dir_pin is not None:
+            Pin(dir_pin, Pin.OUT, value=0)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(home_driver)
+    ctrl.setup_state_machines()
+
+async def _move(axes, count, delay, towards, check): # The same move on every axis, fills _made
+    for axis in axes:
+        _done[axis].clear()
+        direction = switches[axis][1] if towards else -switches[axis][1]
+        _sms[axis].put(delay)
+        _sms[axis].put(count << 2 | check << 1 | (1 if direction < 0 else 0))
+    for axis in axes:
+        await _done[axis].wait()
+        left = _sms[axis].get()
+        _made[axis] = count if left == 0xFFFFFFFF else count - 1 - left
+
+def _triggered(axis):
+    return Pin(switches[axis][0]).value()
+
+async def find_home(*axes): # Homes the axes (every axis with a switch when none are given) and sets their positions to 0
+    if not axes:
+        axes = [axis for axis in range(len(step_driver.axes)) if axis < len(switches) and switches[axis]]
+    limit = travel or 16 * ctrl.steps_per_rev  # Read now, init() may have changed the microstepping
+    _start(axes)
+    try:
+        await _move(axes, limit, fast_delay, True, 1)
+        for axis in axes:
+            if _made[axis] == limit and not _triggered(axis):
+                raise RuntimeError("axis {}: no endstop within {} steps".format(axis, limit))
+        await _move(axes, back_off, slow_delay, False, 0)
+        for axis in axes:
+            if _triggered(axis):
+                raise RuntimeError("axis {}: endstop still triggered after backing off".format(axis))
+        await _move(axes, 2 * back_off, slow_delay, True, 1)
+        for axis in axes:
+            if not _triggered(axis):
+                raise RuntimeError("axis {}: endstop lost on the slow approach".format(axis))
+            found[axis] = _made[axis]
+    finally:
+        _stop(axes)
+    for axis in axes:
+        step_driver.position[axis] = 0
+        if axis < len(_POSITIONS):
+            setattr(ctrl, _POSITIONS[axis], 0)
+
+def home(*axes): # Blocking version of find_home()
+    asyncio.run(find_home(*axes))
@@ -0,0 +1,240 @@
+         ### Libraries ###
+from array import array                     # Preallocated DMA buffers
+import machine                              # disable_irq() while the buffers are touched from both sides
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # Pins, activation pin and ThreadSafeFlag
+import sync_start                           # Starts the state machines with their clock dividers in phase
+asyncio = ctrl.asyncio
+
+# interpolator makes true linear moves (MOVL). motor_sync() in experimental
+# gives every motor its own rounded delay, so the motors finish at different
+# times and the tool drifts off the straight line. Here all four motors run on
+# one timebase instead, like a DDA / Bresenham line: a move takes as many ticks
+# as the longest axis has steps and every other axis steps on the ticks where
+# its ideal position passes the next whole step.
+#     step k of an axis with n steps in a move of N ticks is made on tick ceil(k * N / n) - 1
+# So every axis is within one step of the ideal line on every tick and all of
+# them make their last step on the last tick.
+#
+# The step pattern is sent as one bit per tick and motor, 32 ticks to a word,
+# through DMA into dda_stepper. It makes the same side-set step pulse as
+# step_counter. All four state machines run at the same frequency and are
+# released together by the activation pin. sync_start enables them with their
+# clock dividers restarted together, otherwise each divider keeps the phase of
+# its own active(1) call and a motor can see the pin up to a tick later.
+
+         ### Interpolator settings ###
+tick_rate = 10_000   # [ticks/s] the step rate of the longest axis
+chunk = 32           # Words per DMA transfer (1024 ticks), two buffers per motor
+_TICK_CYCLES = 5     # PIO cycles per tick in dda_stepper, step or no step
+
+         ### Global Variables ###
+_sm_ids = (0, 4, 2, 6)                                   # Motor 1-4, same state machines as step_counter
+_buffers = [(array("I", [0] * chunk), array("I", [0] * chunk)) for _ in range(4)]
+_counts = array("I", [0] * 8)                            # Words waiting in each buffer, 0 = free
+_sending = array("b", [-1, -1, -1, -1])                  # Buffer each DMA channel is sending, -1 = none
+_words = [None] * 4                                      # Step word generator of each motor
+_done = [ctrl.ThreadSafeFlag() for _ in range(4)]        # Set by the completion IRQ of each motor
+_refill = ctrl.ThreadSafeFlag()                          # Set when a DMA buffer has been sent
+_sms = []
+_dma = []
+_running = False
+
+         ### PIO functions ###
+# dda_stepper pulls the number of ticks in the move, then shifts out one bit per
+# tick (autopull fetches the next word every 32 ticks). A 1 makes a step pulse
+# on the side-set pin, a 0 waits just as long so every tick is 5 cycles.
+@asm_pio(sideset_init=PIO.OUT_LOW, out_shiftdir=PIO.SHIFT_RIGHT, autopull=True, fifo_join=PIO.JOIN_TX)
+def dda_stepper():
+    pull(block)                    # ticks in the move minus one
+    out(y, 32)                     # out, not mov, so OSR is empty and autopull loads the first step word
+    wait(1, gpio, 25)              # waiting for "activation_pin.value(1)"
+    label("tick")
+    out(x, 1)                      # this motor's bit for the tick
+    jmp(not_x, "idle")
+    jmp("next") .side(1) [1]       # step - Side Step Pin On for 2 cycles
+    label("idle")
+    nop() [1]                      # no step, same number of cycles
+    label("next")
+    jmp(y_dec, "tick") .side(0)    # Side Step Pin Off, next tick
+    irq(block, rel(0))             # signals the IRQ handler that the move is done
+
+     ### Step pattern ###
+def _step_words(n, ticks): # Yields the 32-tick step words of one motor making n steps in a move of ticks
+    if n == ticks:                                       # The longest axis steps on every tick
+        for base in range(0, ticks, 32):
+            left = ticks - base
+            yield 0xFFFFFFFF if left >= 32 else (1 << left) - 1
+        return
+    k = 1
+    t = (ticks + n - 1) // n - 1 if n else ticks         # Tick of step k
+    for base in range(0, ticks, 32):
+        word = 0
+        end = base + 32
+        while t < end and k <= n:
+            word |= 1 << (t - base)
+            k += 1
+            t = (k * ticks + n - 1) // n - 1
+        yield word
+
+def dda(x, y, z, r): # Yields one (x, y, z, r) step mask per tick, for checking the pattern on a computer
+    moves = (abs(x), abs(y), abs(z), abs(r))
+    ticks = max(moves)
+    words = [_step_words(n, ticks) for n in moves]
+    for base in range(0, ticks, 32):
+        current = [next(w) for w in words]
+        for bit in range(min(32, ticks - base)):
+            yield tuple((word >> bit) & 1 for word in current)
+
+def deviation(x, y, z, r): # Largest distance in steps between any axis and the ideal line, over the whole move
+    moves = (abs(x), abs(y), abs(z), abs(r))
+    ticks = max(moves)
+    position = [0, 0, 0, 0]
+    worst = 0
+    tick = 0
+    for mask in dda(x, y, z, r):
+        tick += 1
+        for axis in range(4):
+            position[axis] += mask[axis]
+            worst = max(worst, abs(position[axis] - moves[axis] * tick / ticks))
+    return worst
+
+     ### PIO and DMA interupt handlers ###
+def pio_0_handler(sm): # Motor 1
+    _done[0].set()
+
+def pio_1_handler(sm): # Motor 2
+    _done[1].set()
+
+def pio_2_handler(sm): # Motor 3
+    _done[2].set()
+
+def pio_3_handler(sm): # Motor 4
+    _done[3].set()
+
+_PIO_BASE = (0x50200000, 0x50300000)
+_TXF0 = 0x10
+
+def _send(axis, buffer): # Starts DMA on one of the motor's buffers
+    sm_id = _sm_ids[axis]
+    dma = _dma[axis]
+    dma.config(read=_buffers[axis][buffer], count=_counts[axis * 2 + buffer],
+               write=_PIO_BASE[sm_id // 4] + _TXF0 + 4 * (sm_id % 4),
+               ctrl=dma.pack_ctrl(size=2, inc_write=False, treq_sel=(sm_id // 4) * 8 + sm_id % 4,
+                                  irq_quiet=False),             # irq_quiet=False so dma.irq() fires when sent
+               trigger=True)
+    _sending[axis] = buffer
+
+def _dma_done(axis): # The buffer has been sent, start the other one if it's filled
+    sent = _sending[axis]
+    _counts[axis * 2 + sent] = 0
+    _sending[axis] = -1
+    if _counts[axis * 2 + (sent ^ 1)]:
+        _send(axis, sent ^ 1)
+    _refill.set()
+
+def dma_0_handler(dma):
+    _dma_done(0)
+
+def dma_1_handler(dma):
+    _dma_done(1)
+
+def dma_2_handler(dma):
+    _dma_done(2)
+
+def dma_3_handler(dma):
+    _dma_done(3)
+
+def _fill(axis, buffer): # Fills a free buffer from the motor's generator, returns the number of words
+    words = _buffers[axis][buffer]
+    count = 0
+    for word in _words[axis]:
+        words[count] = word
+        count += 1
+        if count == chunk:
+            break
+    _counts[axis * 2 + buffer] = count
+    return count
+
+     ### Interpolator mode ###
+def start(): # Takes over the state machines, like motion_queue.start()
+    global _sms, _dma, _running
+    if _running:
+        return
+    ctrl.release_state_machines()
+    freq = tick_rate * _TICK_CYCLES
+    steps_pins = (ctrl.step_pin_1, ctrl.step_pin_2, ctrl.step_pin_3, ctrl.step_pin_4)
+    handlers = ((pio_0_handler, dma_0_handler), (pio_1_handler, dma_1_handler),
+                (pio_2_handler, dma_2_handler), (pio_3_handler, dma_3_handler))
+    _sms = []
+    _dma = []
+    for axis in range(4):
+        sm = StateMachine(_sm_ids[axis], dda_stepper, freq=freq, sideset_base=steps_pins[axis])
+        sm.irq(handlers[axis][0])
+        _sms.append(sm)
+        dma = rp2.DMA()
+        dma.irq(handlers[axis][1])
+        _dma.append(dma)
+    sync_start.release(_sm_ids)  # Ticks in phase in each block, sync_start.skew apart between blocks
+    _running = True
+
+def stop(): # Hands the state machines back to stepper_controller
+    global _running
+    for axis in range(4):
+        _sms[axis].active(0)
+        _dma[axis].close()
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(dda_stepper)
+    _running = False
+    ctrl.setup_state_machines()
+
+async def move_steps(x, y, z, r): # Straight line move, every axis ends on the same tick
+    start()
+    moves = (x, y, z, r)
+    ticks = max(abs(x), abs(y), abs(z), abs(r))
+    if ticks == 0:
+        return
+    dir_pins = (ctrl.dir_pin_1, ctrl.dir_pin_2, ctrl.dir_pin_3, ctrl.dir_pin_4)
+    feeding = 0                                 # Bit per motor that still has words to generate
+    for axis in range(4):
+        dir_pins[axis].value(1 if moves[axis] < 0 else 0)
+        _done[axis].clear()
+        _words[axis] = _step_words(abs(moves[axis]), ticks)
+        _sms[axis].put(ticks - 1)
+        if _fill(axis, 0) == chunk and _fill(axis, 1) == chunk:
+            feeding |= 1 << axis
+        _send(axis, 0)
+    ctrl.x_last += x
+    ctrl.y_last += y
+    ctrl.z_last += z
+    ctrl.r_last += r
+    ctrl.activation_pin.value(1)
+    while feeding:
+        await _refill.wait()
+        for axis in range(4):
+            for buffer in (0, 1):
+                if not feeding >> axis & 1:
+                    break
+                state = machine.disable_irq()
+                free = not _counts[axis * 2 + buffer] and _sending[axis] != buffer
+                machine.enable_irq(state)
+                if not free:
+                    continue
+                count = _fill(axis, buffer)
+                if count < chunk:
+                    feeding &= ~(1 << axis)
+                if count:
+                    state = machine.disable_irq()
+                    if _sending[axis] == -1:         # DMA ran dry before we got here
+                        _send(axis, buffer)
+                    machine.enable_irq(state)
+    for flag in _done:
+        await flag.wait()
+    ctrl.activation_pin.value(0)
+    for pin in dir_pins:
+        pin.value(0)
+
+def steps(x, y, z, r): # Blocking version of move_steps(), hands the state machines back when done
+    asyncio.run(move_steps(x, y, z, r))
+    stop()
@@ -0,0 +1,196 @@
+         ### Libraries ###
+from array import array                     # Speeds and step counts of up to 8 axes
+import machine                              # mem32, to point mov(y, status) at the TX FIFO
+from machine import Pin
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # Positions and ThreadSafeFlag
+import step_driver                          # Step and direction pins of every axis, and their positions
+asyncio = ctrl.asyncio
+
+# jog runs the axes continuously at a speed instead of making moves of a number of
+# steps, for a joystick or buttons. steps(), instructor() etc. wait for every motor
+# to finish a move before the next one starts, so jogging with them stutters. Here
+# every axis steps until it is told another speed, and a new speed takes effect at
+# the next step, without stopping.
+#
+#     task = asyncio.create_task(jog.run())   (takes over the state machines)
+#     jog.speed(2000, -500)                    [steps/s] per axis, from a joystick task, a button IRQ...
+#     jog.axis_speed(1, 800)                   (one axis)
+#     jog.stop()                               (ramps every axis down and hands the state machines back)
+#     await task
+#
+# run() ramps every axis towards its speed with accel, one update every 1/rate_hz
+# at most, and sleeps while every axis is at its speed. A reversal ramps down to a
+# stand still first, so the steps are counted in the right direction: position()
+# and step_driver.position follow the axes, stepper_controller's x_last etc. too.
+# The axes use the pins of step_driver.axes, axis 0 runs on state machine 0.
+
+         ### Settings ###
+freq = 1_000_000     # jog_driver frequency
+rate_hz = 500        # Speed updates per second at most
+accel = 20_000       # [steps/s^2] how fast an axis follows speed()
+max_speed = 20_000   # [steps/s]
+min_speed = 200      # [steps/s] slower is standing still. A running step is never cut short, so a new
+                     # speed waits at most 1/min_speed for it on top of 1/rate_hz
+OVERHEAD = 8         # PIO cycles per step on top of the delay
+
+         ### Global Variables ###
+_target = array("i", [0] * 8)                     # Speed asked for per axis [steps/s]
+_speed = array("i", [0] * 8)                      # Speed the axis runs at now [steps/s]
+_counted = array("I", [0] * 8)                    # x of each state machine when its steps were last counted
+_settling = array("b", [0] * 8)                   # Told to stand still, steps may still come
+_sms = []                                         # One jog_driver state machine per axis
+_wake = ctrl.ThreadSafeFlag()                     # Set by speed() and stop() when run() is waiting for a change
+_running = False
+
+         ### PIO functions ###
+# jog_driver keeps the speed word, delay << 1 | direction, in OSR and makes a step
+# with it, again and again. After every step mov(y, status) tells if a new word is
+# waiting in the TX FIFO (status is set to "TX FIFO empty" when the state machine
+# starts), and only then is it pulled. A word of 0 stands still in pull(block).
+# Every step counts x down, so Python can read how many steps were made.
+# The direction bit is also in the delay, so the delay resolution is 2 cycles.
+@asm_pio(sideset_init=PIO.OUT_LOW, out_init=PIO.OUT_LOW)
+def jog_driver():
+    label("load")
+    pull(block)                    # next speed word, waits here while standing still
+    mov(pins, osr)                 # direction bit straight onto the direction pin
+    wrap_target()
+    mov(y, osr)                    # delay of this step, the word stays in OSR
+    jmp(not_y, "load")             # 0 = stand still
+    nop() .side(1) [1]             # Side Step Pin On for 2 cycles
+    label("delay")
+    jmp(y_dec, "delay") .side(0)   # delay loop - Side Step Pin Off
+    jmp(x_dec, "count")            # one more step made, x only counts
+    label("count")
+    mov(y, status)                 # all ones while the TX FIFO is empty
+    jmp(not_y, "load")             # a new speed is waiting
+    wrap()
+
+     ### Jog mode ###
+def _status_tx_empty(sm_id): # mov(y, status) gives all ones while the TX FIFO has less than 1 word
+    address = (0x50200000 if sm_id < 4 else 0x50300000) + 0x0CC + 0x18 * (sm_id & 3)   # SMx_EXECCTRL
+    machine.mem32[address] = machine.mem32[address] & ~0x1F | 1                       # STATUS_SEL = TX, STATUS_N = 1
+
+def start(): # Takes over the state machines, run() does this itself
+    global _sms, _running
+    if _running:
+        return
+    if step_driver.running():
+        step_driver.stop()
+    ctrl.release_state_machines()
+    _sms = []
+    for i in range(len(step_driver.axes)):
+        step_pin, dir_pin = step_driver.axes[i]
+        sm = StateMachine(i, jog_driver, freq=freq, sideset_base=step_pin, out_base=dir_pin)
+        _status_tx_empty(i)
+        _sms.append(sm)
+        _speed[i] = _counted[i] = _settling[i] = 0
+    for sm in _sms:
+        sm.active(1)
+    _running = True
+
+def _release(): # Hands the state machines back to stepper_controller
+    for sm in _sms:
+        sm.active(0)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(jog_driver)
+    for step_pin, dir_pin in step_driver.axes:
+        if dir_pin is not None:
+            Pin(dir_pin, Pin.OUT, value=0)
+    for axis in range(8):
+        _target[axis] = 0
+    ctrl.setup_state_machines()
+
+def speed(*speeds): # [steps/s] per axis, negative = CCW, missing axes stand still
+    for axis in range(len(step_driver.axes)):
+        axis_speed(axis, speeds[axis] if axis < len(speeds) else 0)
+
+def axis_speed(axis, steps_per_s): # Speed of one axis, safe in an IRQ handler
+    steps_per_s = int(steps_per_s)
+    if abs(steps_per_s) < min_speed:
+        steps_per_s = 0
+    _target[axis] = max(-max_speed, min(max_speed, steps_per_s))
+    _wake.set()
+
+def stop(): # Ramps every axis down, then run() hands the state machines back and returns
+    global _running
+    _running = False
+    for axis in range(8):
+        _target[axis] = 0
+    _wake.set()
+
+def _count(axis): # Adds the steps made since the last count to the positions
+    sm = _sms[axis]
+    sm.exec("mov(isr, x)")
+    sm.exec("push(noblock)")
+    x = sm.get()
+    made = (_counted[axis] - x) & 0xFFFFFFFF
+    _counted[axis] = x
+    if _speed[axis] < 0 or _settling[axis] < 0:
+        made = -made
+    step_driver.position[axis] += made
+    if axis == 0:
+        ctrl.x_last += made
+    elif axis == 1:
+        ctrl.y_last += made
+    elif axis == 2:
+        ctrl.z_last += made
+    elif axis == 3:
+        ctrl.r_last += made
+
+def position(): # Steps from origin of every axis, counted from the state machines right now
+    for axis in range(len(_sms)):
+        _count(axis)
+    return step_driver.position[:len(_sms)]
+
+def _update(axis, change): # One ramp update of one axis, returns True while it has not reached its speed
+    sm = _sms[axis]
+    if sm.tx_fifo():
+        return True                  # The last word is not running yet, try again next update
+    if _settling[axis]:              # The stand still word is running, no step can come anymore
+        _count(axis)
+        _settling[axis] = 0
+    now = _speed[axis]
+    target = _target[axis]
+    if now and (now < 0) != (target < 0):
+        target = 0                   # Reversing, stand still first
+    if now == target:
+        return target != _target[axis]
+    if target > now:
+        new = min(target, now + change)
+    else:
+        new = max(target, now - change)
+    if 0 < abs(new) < min_speed:     # Start from min_speed, and below it stand still
+        new = 0 if abs(target) < abs(now) else min_speed if new > 0 else -min_speed
+    if new == 0:
+        _settling[axis] = -1 if now < 0 else 1
+        sm.put(0)
+    else:
+        delay = max(2, freq // abs(new) - OVERHEAD)
+        sm.put(delay & ~1 | (1 if new < 0 else 0))
+    _speed[axis] = new
+    return True
+
+async def run(): # Velocity mode: every axis follows speed() until stop() and standing still
+    global _running
+    start()
+    period = max(1, 1000 // rate_hz)
+    change = max(1, accel // rate_hz)
+    try:
+        while True:
+            busy = False
+            for axis in range(len(_sms)):
+                if _update(axis, change):
+                    busy = True
+            if busy:
+                await asyncio.sleep_ms(period)
+            elif not _running:
+                break
+            else:
+                await _wake.wait()
+    finally:
+        position()
+        _running = False
+        _release()
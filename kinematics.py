@@ -0,0 +1,137 @@
+         ### Libraries ###
+import math                      # Only used to build the tables and in the float reference solve_float()
+from array import array          # Lookup tables
+
+# kinematics turns Cartesian waypoints into step targets for an arm made of
+# a 2-link planar arm (motor x = shoulder, motor y = elbow), a Z axis on a lead screw
+# (motor z) and a rotating tool (motor r):
+#
+#           (x, y) tool
+#            /
+#    link_2 /
+#          o elbow
+#         /
+# link_1 /
+#       o shoulder at (0, 0), both joints at 0 steps = arm stretched out along +x
+#
+# The points are solved with integers only: positions are scaled to 1/8192 of the
+# reach, the elbow angle comes from an integer square root and the angles from a
+# precomputed arctangent table that is already in steps (times 256). A long path
+# is solved without any trigonometry per point, and the result is steps,
+# not degrees that angle() has to divide by step_angle again:
+#     moves = tuple(kinematics.moves([(120, 40, 0, 0), (100, 80, 5, 90), (60, 120, 5, 180)]))
+#     ctrl.instructor(moves)
+# call setup() again after changing the settings below.
+
+         ### Arm settings ###
+link_1 = 100.0                   # [mm] shoulder to elbow
+link_2 = 100.0                   # [mm] elbow to tool
+steps_per_rev = (3200, 3200)     # Steps per revolution of the shoulder and the elbow, gears included
+z_steps_per_mm = 1600            # Lead screw, 3200 steps per revolution and 2 mm pitch
+r_steps_per_rev = 3200           # Tool rotation
+elbow = 1                        # 1 or -1, which of the two solutions (elbow left or right of the line to the tool)
+
+         ### Lookup tables ###
+_N = 256                         # Table entries per octant, linearly interpolated between them
+_FRAC = 8                        # Angles in the tables are steps << _FRAC
+_REACH = 1 << 13                 # Integer units of the full reach (link_1 + link_2), keeps every product below 2**30
+
+def _table(spr): # atan(i / _N) for i = 0.._N in steps << _FRAC, one spare entry for the interpolation
+    scale = spr * (1 << _FRAC) / (2 * math.pi)
+    return array("i", [round(math.atan(i / _N) * scale) for i in range(_N + 1)] + [round(math.pi / 4 * scale)])
+
+def setup(): # Builds the tables and integer constants from the settings
+    global _per_mm, _l1, _l2, _a, _b, _atan_1, _atan_2, _quarter_1, _quarter_2, _z, _r
+    _per_mm = _REACH / (link_1 + link_2)       # Integer units per mm
+    _l1 = round(link_1 * _per_mm)
+    _l2 = round(link_2 * _per_mm)
+    _a = 2 * _l1 * _l2                         # r² - l1² - l2² = _a * cos(elbow angle)
+    _b = 2 * _l1 * _l1
+    _atan_1 = _table(steps_per_rev[0])
+    _atan_2 = _atan_1 if steps_per_rev[1] == steps_per_rev[0] else _table(steps_per_rev[1])
+    _quarter_1 = steps_per_rev[0] << _FRAC >> 2
+    _quarter_2 = steps_per_rev[1] << _FRAC >> 2
+    _z = z_steps_per_mm
+    _r = r_steps_per_rev / 360
+
+         ### Integer math ###
+def _isqrt(n): # Largest integer whose square is <= n, Newton's method on ints only
+    if n <= 0:
+        return 0
+    bits = 0
+    m = n
+    while m:                                   # Bit length, MicroPython's int has no bit_length()
+        m >>= 1
+        bits += 1
+    r = 1 << ((bits + 1) >> 1)                 # 2 ** ceil(bits / 2) is above the root
+    while True:
+        y = (r + n // r) >> 1                  # Falls towards the root from above
+        if y >= r:
+            return r
+        r = y
+
+def _atan2(y, x, table, quarter): # Angle of (x, y) in steps << _FRAC, -2 * quarter..2 * quarter
+    ax = -x if x < 0 else x
+    ay = -y if y < 0 else y
+    while ax > 0x7FFF or ay > 0x7FFF:          # Only the ratio matters, keep ay << 15 a small int
+        ax >>= 2
+        ay >>= 2
+    if ax >= ay:
+        if ax == 0:
+            return 0
+        t = (ay << 15) // ax
+        i = t >> 7
+        a = table[i] + ((table[i + 1] - table[i]) * (t & 0x7F) >> 7)
+    else:
+        t = (ax << 15) // ay
+        i = t >> 7
+        a = quarter - table[i] - ((table[i + 1] - table[i]) * (t & 0x7F) >> 7)
+    if x < 0:
+        a = 2 * quarter - a
+    return -a if y < 0 else a
+
+def _solve(x, y): # Joint angles in steps << _FRAC for a point in integer units
+    k = x * x + y * y - _l1 * _l1 - _l2 * _l2  # _a * cos(elbow angle)
+    if k > _a or k < -_a:
+        slack = (x if x > 0 else -x) + (y if y > 0 else -y) + 1  # What rounding to whole units can add
+        if k > _a + slack or k < -_a - slack:
+            raise ValueError("point out of reach")
+        k = _a if k > 0 else -_a
+    s = elbow * _isqrt((_a - k) << 2) * _isqrt((_a + k) << 2) # _a * sin(elbow angle), times 4
+    j2 = _atan2(s, k << 2, _atan_2, _quarter_2)
+    j1 = _atan2(y, x, _atan_1, _quarter_1) - _atan2(s, (_b + k) << 2, _atan_1, _quarter_1)
+    return j1, j2
+
+         ### Solving ###
+def solve(x, y): # Shoulder and elbow steps for the tool at (x, y) mm
+    j1, j2 = _solve(round(x * _per_mm), round(y * _per_mm))
+    half = 1 << (_FRAC - 1)
+    return (j1 + half) >> _FRAC, (j2 + half) >> _FRAC
+
+def targets(points): # Yields absolute (x, y, z, r) steps for (x, y, z, r) waypoints in mm, mm and degrees
+    half = 1 << (_FRAC - 1)
+    per_mm = _per_mm
+    for point in points:
+        j1, j2 = _solve(round(point[0] * per_mm), round(point[1] * per_mm))
+        yield (j1 + half) >> _FRAC, (j2 + half) >> _FRAC, round(point[2] * _z), round(point[3] * _r)
+
+def moves(points, start=(0, 0, 0, 0)): # Yields relative step tuples for instructor(), start is where the motors are
+    x0, y0, z0, r0 = start
+    for x, y, z, r in targets(points):
+        yield x - x0, y - y0, z - z0, r - r0
+        x0, y0, z0, r0 = x, y, z, r
+
+def solve_float(x, y): # The same with math, to check the tables against
+    c = (x * x + y * y - link_1 * link_1 - link_2 * link_2) / (2 * link_1 * link_2)
+    if c > 1 or c < -1:
+        raise ValueError("point out of reach")
+    t2 = elbow * math.acos(c)
+    t1 = math.atan2(y, x) - math.atan2(link_2 * math.sin(t2), link_1 + link_2 * math.cos(t2))
+    return round(t1 * steps_per_rev[0] / (2 * math.pi)), round(t2 * steps_per_rev[1] / (2 * math.pi))
+
+def forward(j1, j2): # Tool position in mm for shoulder and elbow steps
+    t1 = j1 * 2 * math.pi / steps_per_rev[0]
+    t2 = t1 + j2 * 2 * math.pi / steps_per_rev[1]
+    return link_1 * math.cos(t1) + link_2 * math.cos(t2), link_1 * math.sin(t1) + link_2 * math.sin(t2)
+
+setup()
@@ -1,5 +1,7 @@
 import stepper_controller as ctrl
 
+ctrl.init()          # Sets up the pins and state machines, ctrl.init({"motors": 2}) for two motors
+
 # stepper_controller can take 3 commands
 # angle(x, y)
 # steps(x, y)
@@ -32,6 +34,14 @@ import stepper_controller as ctrl
 # Each integers here are steps.
 #ctrl.instructor(((200, 400), (-400, 800), (800, 1600), (-1600, 3200), (3200, 6400)))
 
+                   ### asyncio ###
+# move_steps() and move_angle() are the awaitable versions of steps() and angle().
+# Other tasks keep running while the motors are stepping.
+# async def job():
+#     await ctrl.move_angle(90, -90, 180, -180)
+#     await ctrl.move_steps(-1600, 1600, 200, 400)
+# asyncio.run(job())
+
                    ### Position ###
 # Calling this function with no arguments tells out program at what angle the motor is currenly at. 720 deg would
 # mean we are at position zero, but have turned 2 full turns.
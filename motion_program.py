@@ -0,0 +1,127 @@
+         ### Libraries ###
+import struct                               # Packs the records
+from array import array                     # Delays handed to motion_queue, reused for every record
+import stepper_controller as ctrl
+import motion_queue as mq                   # The records are streamed into the queue
+asyncio = ctrl.asyncio
+
+# motion_program stores a motion program as a file of fixed-width records instead
+# of nested tuples, so it can live in flash and be run without a computer. A tuple
+# like ((200, 400, -400, 800), (800, -200, 800, -800)) costs dozens of bytes of
+# heap per segment and has to be in RAM as a whole. Here every segment is one
+# 36 byte record and play() reads chunk records at a time into one buffer and
+# pushes them into motion_queue, so RAM use is the same for 10 segments or 100 000.
+#
+#     motion_program.write("square.mpr", ((3200, 0, 0, 0), (0, 3200, 0, 0), (-3200, 0, 0, 0), (0, -3200, 0, 0)))
+#     motion_program.write("arm.mpr", kinematics.moves(points))       (any iterable, a generator is never held in RAM)
+#     motion_program.run("square.mpr")
+#
+# File:    header "MPRG", version, axes, record size, number of records (12 bytes)
+# Record:  x, y, z, r steps (int32), x, y, z, r delays (uint32), flags (uint32)
+
+         ### Settings ###
+chunk = 16           # Records read from the file at a time
+
+         ### Format ###
+_MAGIC = b"MPRG"
+_VERSION = 1
+_AXES = 4
+_HEADER = "<4sBBHI"                               # magic, version, axes, record size, records
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_RECORD = "<4i4II"                                # steps, delays, flags
+RECORD_SIZE = struct.calcsize(_RECORD)
+BASE_DELAY = 1                                    # Flag: no delays stored, motion_queue.base_delay is used
+DRAIN = 2                                         # Flag: wait until this segment is done before the next one starts
+
+         ### Writing ###
+def _pack(buf, offset, segment, sync): # One instruction tuple into a record
+    x = int(segment[0])
+    y = int(segment[1])
+    z = int(segment[2])
+    r = int(segment[3])
+    flags = segment[5] if len(segment) > 5 else 0
+    delays = segment[4] if len(segment) > 4 else None
+    if delays is None and sync is not None:
+        delays = sync(x, y, z, r)
+    if delays is None:
+        flags |= BASE_DELAY
+        delays = (0, 0, 0, 0)
+    struct.pack_into(_RECORD, buf, offset, x, y, z, r, int(delays[0]), int(delays[1]), int(delays[2]), int(delays[3]), flags)
+
+def write(path, instructions, sync=None): # Writes instruction tuples (x, y, z, r[, delays[, flags]]) to path, returns the records
+    buf = bytearray(chunk * RECORD_SIZE)          # sync can be experimental.motor_sync, like motion_queue.run()
+    count = 0
+    with open(path, "wb") as f:
+        f.write(struct.pack(_HEADER, _MAGIC, _VERSION, _AXES, RECORD_SIZE, 0))
+        n = 0
+        for segment in instructions:
+            _pack(buf, n * RECORD_SIZE, segment, sync)
+            n += 1
+            if n == chunk:
+                f.write(buf)
+                count += n
+                n = 0
+        if n:
+            f.write(memoryview(buf)[:n * RECORD_SIZE])
+            count += n
+        f.seek(0)                                 # The count is only known now
+        f.write(struct.pack(_HEADER, _MAGIC, _VERSION, _AXES, RECORD_SIZE, count))
+    return count
+
+         ### Reading ###
+def _open(path): # Opens a program and checks its header, returns (file, records)
+    f = open(path, "rb")
+    magic, version, axes, size, count = struct.unpack(_HEADER, f.read(_HEADER_SIZE))
+    if magic != _MAGIC or version != _VERSION or axes != _AXES or size != RECORD_SIZE:
+        f.close()
+        raise ValueError("not a motion program: " + path)
+    return f, count
+
+def info(path): # Number of records in a program
+    f, count = _open(path)
+    f.close()
+    return count
+
+def read(path): # Yields (x, y, z, r, delays or None, flags) per record, to check a program on a computer
+    f, count = _open(path)
+    try:
+        record = bytearray(RECORD_SIZE)
+        for _ in range(count):
+            f.readinto(record)
+            values = struct.unpack(_RECORD, record)
+            flags = values[8]
+            yield values[0], values[1], values[2], values[3], None if flags & BASE_DELAY else values[4:8], flags & ~BASE_DELAY
+    finally:
+        f.close()
+
+         ### Playing ###
+async def play(path): # Streams a program from the file into motion_queue and waits until it is done
+    f, count = _open(path)
+    buf = bytearray(chunk * RECORD_SIZE)
+    delays = array("i", [0, 0, 0, 0])
+    try:
+        left = count
+        while left:
+            n = min(left, chunk)
+            f.readinto(memoryview(buf)[:n * RECORD_SIZE])
+            for i in range(n):
+                x, y, z, r, dx, dy, dz, dr, flags = struct.unpack_from(_RECORD, buf, i * RECORD_SIZE)
+                delays[0] = dx
+                delays[1] = dy
+                delays[2] = dz
+                delays[3] = dr
+                if mq.depth() == mq.queue_size:
+                    mq.start()                    # Queue is full, release the motors with it preloaded
+                await mq.put(x, y, z, r, None if flags & BASE_DELAY else delays)
+                if flags & DRAIN:
+                    mq.start()
+                    await mq.drain()
+            left -= n
+    finally:
+        f.close()
+    mq.start()
+    await mq.drain()
+
+def run(path): # Blocking version of play(), hands the state machines back to stepper_controller when done
+    asyncio.run(play(path))
+    mq.stop()
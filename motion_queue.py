@@ -0,0 +1,288 @@
+         ### Libraries ###
+from array import array                     # Preallocated storage for queued segments
+import machine                              # disable_irq() while the queue is touched from both sides
+from machine import Pin                     # To hand the direction pins back to stepper_controller
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # Pins, activation pin and ThreadSafeFlag
+import telemetry                            # Segments and underruns, without printing from the IRQ
+asyncio = ctrl.asyncio
+
+# motion_queue streams segments (one step count per motor, like one element of
+# step_instructor()) into the state machines while the current segment is running.
+# Each motor's FIFOs are joined to 8 words and refilled from the completion IRQ,
+# so back-to-back segments run without the 0.5 s sleeps and the wait for all
+# four motors that runner() has between every segment.
+#
+# ctrl.steps() etc. can not be used while the queue is running, start() takes
+# over both PIO blocks and stop() hands them back to stepper_controller.
+#
+# Every segment starts on all four motors together, also when a motor has 0 steps
+# in it and is done at once: segment_counter waits for the activation pin at the
+# start of every segment, for 1 in even segments and 0 in odd ones. _gate() sets
+# the level of the next segment once every motor has finished the one before, so
+# an L-shaped path is stepped axis after axis. A motor that is done early waits
+# for a level, not for an edge, so there is no pulse it could miss. A segment
+# boundary takes one completion IRQ of the last motor to finish.
+
+         ### Queue settings ###
+queue_size = 32      # Segments the software queue can hold on top of what is loaded into the FIFOs
+hw_depth = 4         # Segments loaded into the state machines, the running one included
+base_delay = 200     # Delay used when push() gets no delays, same meaning as base_delay in experimental.py
+sc_freq = 1_000_000  # segment_counter frequency
+ss_freq = 1_000_000  # segment_speed frequency
+
+         ### Global Variables ###
+_ROW = 8                                          # x, y, z, r steps followed by their four delays
+_ring = array("i", [0] * (queue_size * _ROW))     # The software queue
+_head = 0                                         # Next row to load into the state machines
+_tail = 0                                         # Next free row
+_count = 0                                        # Rows waiting in _ring
+_loaded = 0                                       # Segments handed to the state machines since start()
+_released = 0                                     # Segments the activation pin has let start since start()
+_done = array("I", [0, 0, 0, 0])                  # Segments finished per motor, counted by the IRQ handlers
+_running = False
+_draining = False
+underruns = 0                                     # Times the motors ran dry while the queue was running
+_space = ctrl.ThreadSafeFlag()                    # Set by the IRQ handlers whenever a segment finishes
+_counters = []                                    # segment_counter state machines for x, y, z and r
+_speeds = []                                      # segment_speed state machines for x, y, z and r
+_words = None                                     # (counter words, speed words) per axis streamed by stream()
+_next = 0                                         # Next segment of _words to load
+_end = 0                                          # Segments in _words
+
+         ### PIO functions ###
+# segment_counter works like step_counter but pulls one word per segment,
+# steps << 1 | direction, and sets the direction pin itself so the direction
+# changes exactly at the segment boundary and not when Python gets around to it.
+# The IRQ flags are relative (rel) so the two motors sharing a PIO block no
+# longer share flags 4 and 5:
+#     state machine 0 (and 4) uses flags 4 and 5, state machine 2 (and 6) uses 6 and 7.
+# The program is two copies of one segment, the even one waits for the activation
+# pin to be 1 and the odd one for 0 (see _gate()).
+@asm_pio(sideset_init=PIO.OUT_LOW, out_init=PIO.OUT_LOW, out_shiftdir=PIO.SHIFT_RIGHT, fifo_join=PIO.JOIN_TX)
+def segment_counter():
+    pull(block)                    # wait for the next segment, then pull it to OSR
+    out(pins, 1)                   # direction bit goes straight onto the direction pin
+    mov(x, osr)                    # the rest of the word is the number of steps
+    wait(1, gpio, 25)              # waiting for every motor to be done with the last segment
+    label("count_even")
+    jmp(not_x, "end_even")         # if x is 0(zero), the segment is done
+    irq(rel(4)) .side(1) [1]       # starts this motor's segment_speed - Side Step Pin On
+    irq(block, rel(5)) .side(0)    # waiting for segment_speed to clear our flag - Side Step Pin Off
+    jmp(x_dec, "count_even")       # if x is NOT 0(zero), remove one (-1) from x and jump back to count
+    label("end_even")
+    irq(block, rel(0))             # tells the refill handler this segment is done
+    pull(block)                    # the odd segment, the same with wait(0)
+    out(pins, 1)
+    mov(x, osr)
+    wait(0, gpio, 25)
+    label("count_odd")
+    jmp(not_x, "end_odd")
+    irq(rel(4)) .side(1) [1]
+    irq(block, rel(5)) .side(0)
+    jmp(x_dec, "count_odd")
+    label("end_odd")
+    irq(block, rel(0))
+
+# segment_speed pulls the delay and the step count of each segment so it knows
+# when to move on to the next delay. The step count is kept in OSR between steps.
+@asm_pio(fifo_join=PIO.JOIN_TX)
+def segment_speed():
+    label("segment")
+    pull(block)                    # delay of the next segment
+    mov(y, osr)                    # kept in y for the whole segment
+    pull(block)                    # steps in the segment, same count as segment_counter got
+    label("step")
+    mov(x, osr)                    # steps left
+    jmp(not_x, "segment")          # segment done, fetch the next one
+    jmp(x_dec, "wait")             # one step less to go (x is not 0 here so this always jumps)
+    label("wait")
+    mov(osr, x)
+    wait(1, irq, rel(7))           # waiting for the step from segment_counter (flag 4 or 6)
+    mov(x, y)                      # load the delay
+    label("delay")
+    jmp(x_dec, "delay")            # delay loop
+    irq(clear, rel(4))             # clear flag 5 or 7, allowing segment_counter to continue
+    jmp("step")
+
+     ### PIO interupt handlers ###
+# segment_counter raises its own IRQ (rel(0)) after every segment.
+# The handler counts it and tops the FIFOs up again from _ring.
+def _fill(): # Loads segments from _ring, then from _words, into the state machines while there is room
+    global _head, _count, _loaded, _next
+    while _loaded - min(_done) < hw_depth:
+        if not _count:
+            if _next == _end:
+                break
+            counters, speeds = _words        # Already packed by program_cache, the words go in as they are
+            for axis in range(4):
+                _counters[axis].put(counters[axis][_next])
+                _speeds[axis].put(speeds[axis][2 * _next])
+                _speeds[axis].put(speeds[axis][2 * _next + 1])
+            _next += 1
+            _loaded += 1
+            continue
+        i = _head * _ROW
+        for axis in range(4):
+            steps = _ring[i + axis]
+            if steps < 0:
+                _counters[axis].put(-steps << 1 | 1)
+                steps = -steps
+            else:
+                _counters[axis].put(steps << 1)
+            _speeds[axis].put(_ring[i + 4 + axis])
+            _speeds[axis].put(steps)
+        _head = (_head + 1) % queue_size
+        _count -= 1
+        _loaded += 1
+    _gate()
+
+def _gate(): # Lets the next loaded segment start once every motor is done with the last one
+    global _released
+    if _running and _loaded > _released and min(_done) == _released:
+        ctrl.activation_pin.value(1 if _released % 2 == 0 else 0) # The level the segment waits for
+        _released += 1
+
+def _segment_done(axis):
+    global underruns
+    _done[axis] += 1
+    _fill()
+    telemetry.log(3, telemetry.SEGMENT, axis, _done[axis], depth())
+    if min(_done) == _loaded and _running and not _draining:
+        underruns += 1               # Every motor is out of segments but the job is not finished
+        telemetry.log(1, telemetry.UNDERRUN, underruns)
+    _space.set()
+
+def pio_0_handler(sm): # Motor 1
+    _segment_done(0)
+
+def pio_1_handler(sm): # Motor 2
+    _segment_done(1)
+
+def pio_2_handler(sm): # Motor 3
+    _segment_done(2)
+
+def pio_3_handler(sm): # Motor 4
+    _segment_done(3)
+
+     ### Queue functions ###
+def start(): # Takes over the state machines and starts streaming whatever is queued
+    global _loaded, _released, _running, _counters, _speeds
+    if _running:
+        return
+    ctrl.release_state_machines()
+    #                   (counter, speed, step pin,       direction pin,   handler)
+    motors = ((0, 1, ctrl.step_pin_1, ctrl.dir_pin_1, pio_0_handler),   # Motor 1 - Pio Block 0
+              (4, 5, ctrl.step_pin_2, ctrl.dir_pin_2, pio_1_handler),   # Motor 2 - Pio Block 1
+              (2, 3, ctrl.step_pin_3, ctrl.dir_pin_3, pio_2_handler),   # Motor 3 - Pio Block 0
+              (6, 7, ctrl.step_pin_4, ctrl.dir_pin_4, pio_3_handler))   # Motor 4 - Pio Block 1
+    _counters = []
+    _speeds = []
+    for counter, speed, step_pin, dir_pin, handler in motors:
+        sm = StateMachine(counter, segment_counter, freq=sc_freq, sideset_base=step_pin, out_base=dir_pin)
+        sm.irq(handler)
+        _counters.append(sm)
+        _speeds.append(StateMachine(speed, segment_speed, freq=ss_freq))
+    _loaded = _released = 0
+    ctrl.activation_pin.value(0)       # The first segment waits for 1
+    for axis in range(4):
+        _done[axis] = 0
+    for axis in range(4):
+        _counters[axis].active(1)
+        _speeds[axis].active(1)
+    _running = True
+    state = machine.disable_irq()
+    _fill()                          # Preloads the first segments and releases the first one
+    machine.enable_irq(state)
+
+def stop(): # Hands the state machines back to stepper_controller, await drain() first
+    global _running
+    ctrl.activation_pin.value(0)
+    for axis in range(4):
+        _counters[axis].active(0)
+        _speeds[axis].active(0)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(segment_counter)
+        rp2.PIO(block).remove_program(segment_speed)
+    for pin in (ctrl.dir_pin_1, ctrl.dir_pin_2, ctrl.dir_pin_3, ctrl.dir_pin_4):
+        pin.init(Pin.OUT, value=0)
+    _running = False
+    ctrl.setup_state_machines()
+
+def push(x, y, z, r, delays=None): # Adds one segment, returns False if the queue is full
+    global _tail, _count
+    if _words is not None:           # _fill() loads _ring first, the segment would jump ahead of the stream
+        raise RuntimeError("motion_queue is streaming, push() after stream() returns")
+    if _count == queue_size:
+        return False
+    i = _tail * _ROW
+    _ring[i] = x
+    _ring[i + 1] = y
+    _ring[i + 2] = z
+    _ring[i + 3] = r
+    for axis in range(4):
+        _ring[i + 4 + axis] = base_delay if delays is None else delays[axis]
+    ctrl.x_last += x                 # stepper_controller.position() follows the queued target
+    ctrl.y_last += y
+    ctrl.z_last += z
+    ctrl.r_last += r
+    state = machine.disable_irq()
+    _tail = (_tail + 1) % queue_size
+    _count += 1
+    if _running:
+        _fill()
+    machine.enable_irq(state)
+    return True
+
+async def put(x, y, z, r, delays=None): # push() that waits for room instead of returning False
+    while not push(x, y, z, r, delays):
+        await _space.wait()
+
+async def stream(counters, speeds, count, totals): # Streams count packed segments (program_cache) after what is queued
+    global _words, _next, _end
+    state = machine.disable_irq()
+    if _words is not None:
+        machine.enable_irq(state)
+        raise RuntimeError("motion_queue is already streaming")
+    _words = (counters, speeds)
+    _next = 0
+    _end = count
+    if _running:
+        _fill()
+    machine.enable_irq(state)
+    ctrl.x_last += totals[0]           # stepper_controller.position() follows the streamed target
+    ctrl.y_last += totals[1]
+    ctrl.z_last += totals[2]
+    ctrl.r_last += totals[3]
+    try:
+        start()
+        await drain()
+    finally:
+        _words = None
+        _next = _end = 0
+
+async def drain(): # Waits until every queued segment has been stepped
+    global _draining
+    _draining = True
+    while _count or _next != _end or min(_done) != _loaded:
+        await _space.wait()
+    _draining = False
+
+def depth(): # Segments waiting in the queue plus the ones loaded into the state machines
+    return _count + _end - _next + _loaded - min(_done)
+
+def stats(): # Returns (depth, underruns, segments completed by every motor)
+    return depth(), underruns, min(_done)
+
+async def run(instructions, sync=None): # Streams a step_instructor() style tuple and waits for it
+    for segment in instructions:        # sync can be experimental.motor_sync to get MOVL delays
+        x = int(segment[0])
+        y = int(segment[1])
+        z = int(segment[2])
+        r = int(segment[3])
+        if not _running and _count == queue_size:
+            start()                     # Queue is full, release the motors with it preloaded
+        await put(x, y, z, r, None if sync is None else sync(x, y, z, r))
+    start()
+    await drain()
@@ -0,0 +1,143 @@
+         ### Libraries ###
+import math                      # Once per curve: the angle step of an arc and the segment count of a cubic
+
+# path turns arcs and cubic curves into the short straight segments the motion
+# code moves: relative (x, y, z, r) step tuples, like kinematics.moves(). Every
+# function is a generator that works out the next segment when it is asked for it,
+# so a long curve takes no more memory than a short one and the segments can go
+# straight into instructor(), motion_queue, planner, motion_program or program_cache.
+#
+#     ctrl.instructor(tuple(path.arc((0, 0, 0, 0), (1600, 0))))      (full circle around 1600 steps to the right)
+#     planner.run(path.arc((3200, 0, 0, 0), (1600, 0)))               (half circle, planned on core 1)
+#     planner.run(path.arc((0, 3200, 800, 0), (0, 1600), clockwise=True))   (a helix, z follows linearly)
+#     planner.run(path.spline([(800, 400, 0, 0), (1600, 0, 0, 0), (2400, 400, 0, 0)]))  (through the points)
+#
+# All positions are absolute steps, start is where the motors are when the curve
+# begins. tolerance (or tol= per curve) is how far [steps] a segment may be from
+# the curve, the chord error, and sets how long the segments are: a bigger radius
+# or a flatter curve gets fewer, longer segments. The points are rounded to whole
+# steps on top of that, and every curve ends exactly on its end point.
+#
+# An arc rotates the radius from the center by one angle step per segment with
+# integers: cos and sin of the step are computed once per arc, in 1/2**30, and the
+# radius is kept in 1/65536 steps, so thousands of segments don't drift. A cubic
+# is forward differenced: its points times n**3 are integers, so three additions
+# per axis give the next point exactly. Products of the arc rotation don't fit in
+# a small int on the Pico, they still take only microseconds per segment.
+
+         ### Settings ###
+tolerance = 1        # [steps] chord error of the segments
+
+         ### Global Variables ###
+_ONE = 1 << 30       # cos and sin of an arc's angle step
+_SUB = 16            # An arc's radius in 1/2**16 steps
+
+         ### Arcs ###
+def arc(end, center, clockwise=False, start=(0, 0, 0, 0), plane=(0, 1), tol=None):
+    # Yields the segments of an arc (G2 / G3) from start to end around center, given
+    # relative to start like I and J. The arc is in the plane of the two axes in plane,
+    # the other axes move linearly. end in that plane the same as start is a full circle.
+    tol = tol or tolerance
+    a, b = plane
+    ca = start[a] + center[0]                # Center, absolute
+    cb = start[b] + center[1]
+    u = start[a] - ca                        # Radius vector at the start
+    v = start[b] - cb
+    radius = math.sqrt(u * u + v * v)
+    if not radius:
+        raise ValueError("the center of an arc can't be its start")
+    sweep = math.atan2(end[b] - cb, end[a] - ca) - math.atan2(v, u)
+    if clockwise:
+        sweep = -sweep
+    while sweep <= 1e-12:                    # Up to a full circle in the direction asked for
+        sweep += 2 * math.pi
+    step = 2 * math.acos(1 - tol / radius) if tol < radius else math.pi / 2 # Longest chord within tol
+    n = max(1, math.ceil(sweep / min(step, math.pi / 2)))
+    angle = (-sweep if clockwise else sweep) / n
+    c = round(math.cos(angle) * _ONE)
+    s = round(math.sin(angle) * _ONE)
+    u <<= _SUB
+    v <<= _SUB
+    half = 1 << (_SUB - 1)
+    last = list(start)
+    moves = [0, 0, 0, 0]
+    for k in range(1, n + 1):
+        if k == n:
+            point_a = end[a]
+            point_b = end[b]
+        else:
+            u, v = (u * c - v * s) >> 30, (u * s + v * c) >> 30
+            point_a = ca + ((u + half) >> _SUB)
+            point_b = cb + ((v + half) >> _SUB)
+        for axis in range(4):
+            if axis == a:
+                position = point_a
+            elif axis == b:
+                position = point_b
+            else:                            # Linear from start to end, rounded
+                position = start[axis] + ((end[axis] - start[axis]) * 2 * k + n) // (2 * n)
+            moves[axis] = position - last[axis]
+            last[axis] = position
+        yield moves[0], moves[1], moves[2], moves[3]
+
+         ### Cubic curves ###
+def _cubic(p0, p1, p2, p3, tol): # Segments of the cubic Bezier curve p0 -> p3 with control points p1 and p2
+    coefficients = []                        # A t**3 + B t**2 + C t + p0 per axis
+    start = 0                                # Squared length of the second derivative 6 A t + 2 B at t = 0
+    end = 0                                  # and at t = 1, it is linear in t so the longest is at one of them
+    for axis in range(4):
+        A = p3[axis] - p0[axis] + 3 * (p1[axis] - p2[axis])
+        B = 3 * (p0[axis] - 2 * p1[axis] + p2[axis])
+        C = 3 * (p1[axis] - p0[axis])
+        coefficients.append((A, B, C))
+        start += (2 * B) ** 2
+        end += (6 * A + 2 * B) ** 2
+    bend = math.sqrt(max(start, end))        # The vector, not one axis: a diagonal bends more than either axis
+    n = max(1, math.ceil(math.sqrt(bend / (8 * tol)))) # Chord error is at most bend / (8 n**2)
+    n3 = n * n * n
+    f = [0, 0, 0, 0]                         # n**3 (P(k / n) - p0)
+    d1 = [0, 0, 0, 0]                        # Its first, second and third forward differences
+    d2 = [0, 0, 0, 0]
+    d3 = [0, 0, 0, 0]
+    for axis in range(4):
+        A, B, C = coefficients[axis]
+        d1[axis] = A + B * n + C * n * n
+        d2[axis] = 6 * A + 2 * B * n
+        d3[axis] = 6 * A
+    last = [0, 0, 0, 0]
+    moves = [0, 0, 0, 0]
+    for k in range(n):
+        for axis in range(4):
+            f[axis] += d1[axis]
+            d1[axis] += d2[axis]
+            d2[axis] += d3[axis]
+            offset = (2 * f[axis] + n3) // (2 * n3)   # Rounded
+            moves[axis] = offset - last[axis]
+            last[axis] = offset
+        yield moves[0], moves[1], moves[2], moves[3]
+
+def bezier(p1, p2, end, start=(0, 0, 0, 0), tol=None): # Yields the segments of a cubic Bezier curve from start to end
+    return _cubic(start, p1, p2, end, tol or tolerance)
+
+def spline(points, start=(0, 0, 0, 0), tol=None):
+    # Yields the segments of a Catmull-Rom spline from start through every point. Each
+    # span is a cubic whose tangent at a point is parallel to the line between its
+    # neighbours, so the path goes through the points without corners. points can be
+    # a generator, only four of them are kept at a time.
+    tol = tol or tolerance
+    previous = current = tuple(start)
+    following = None
+    for point in points:
+        if following is None:
+            following = tuple(point)
+            continue
+        after = tuple(point)
+        yield from _span(previous, current, following, after, tol)
+        previous, current, following = current, following, after
+    if following is not None:
+        yield from _span(previous, current, following, following, tol)
+
+def _span(before, p0, p3, after, tol): # The cubic from p0 to p3 of a Catmull-Rom spline
+    p1 = tuple(p0[axis] + (p3[axis] - before[axis]) // 6 for axis in range(4))
+    p2 = tuple(p3[axis] - (after[axis] - p0[axis]) // 6 for axis in range(4))
+    return _cubic(p0, p1, p2, p3, tol)
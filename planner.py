@@ -0,0 +1,146 @@
+         ### Libraries ###
+import time                                 # Planning time and how long segments wait in the ring
+import _thread                              # The planner runs on core 1
+from array import array                     # The ring of planned segments
+import stepper_controller as ctrl
+import motion_queue as mq                   # Core 0 streams the planned segments into the queue
+asyncio = ctrl.asyncio
+_perf = getattr(time, "perf_counter", None) # Only on a computer, see _wall_us()
+
+# planner moves motion planning to the second core. Core 1 runs through the
+# instructions, which can be a generator that does the work (kinematics.moves(points),
+# a file being parsed...), computes the delays that make every motor end its
+# segment together and writes ready segments into a ring. Core 0 only copies them
+# from the ring into motion_queue, so it stays free for comms and the user program.
+#
+#     planner.run(kinematics.moves(points))                    (blocking)
+#     planner.start(kinematics.moves(points)); await planner.play()   (from a task)
+#     planner.stats()                                          (planned, segments/s, queue latency)
+#
+# The ring is one preallocated array with a single writer per index: core 1 fills
+# a row and only then moves _tail on, core 0 reads a row and only then moves _head
+# on. There is no lock, and the planner makes no objects per segment itself (the
+# instructions it is given may, a generator yields a tuple per segment).
+
+         ### Settings ###
+ring_size = 64       # Segments planned ahead, a power of two
+OVERHEAD = 9         # segment_speed cycles per step on top of the delay, like gcode.py
+
+         ### Global Variables ###
+_ROW = 9                                          # x, y, z, r steps, their four delays and when it was planned
+_ring = array("i", [0] * (ring_size * _ROW))
+_head = 0                                         # Segments read by core 0, only core 0 writes it
+_tail = 0                                         # Segments written by core 1, only core 1 writes it
+_busy = False                                     # The planner is running on core 1
+_stop = False                                     # Asks the planner to give up
+_error = None                                     # What stopped the planner, raised again on core 0
+planned = 0                                       # Segments planned since start()
+_plan_us = 0                                      # Time core 1 spent planning them, waits for room not counted
+_wait_sum = 0                                     # Time the segments spent in the ring in total
+_wait_max = 0
+
+         ### Planning (core 1) ###
+def _wall_us(): # Time core 1 spends. On a computer the planner is a real thread that the emulator clock doesn't see
+    if _perf:
+        return int(_perf() * 1_000_000)
+    return time.ticks_us()
+
+def _sync(i, x, y, z, r): # Delays of row i that make every motor end together, in integers and in place
+    longest = abs(x)
+    if abs(y) > longest:
+        longest = abs(y)
+    if abs(z) > longest:
+        longest = abs(z)
+    if abs(r) > longest:
+        longest = abs(r)
+    cycles = (mq.base_delay + OVERHEAD) * longest # The longest axis runs at base_delay
+    for axis in range(4):
+        n = abs(_ring[i + axis])
+        _ring[i + 4 + axis] = cycles // n - OVERHEAD if n else mq.base_delay
+
+def _plan(instructions, sync): # Core 1: plans every segment into the ring, waits while the ring is full
+    global _tail, _busy, _error, planned, _plan_us
+    try:
+        start = _wall_us()
+        for segment in instructions:
+            x = int(segment[0])
+            y = int(segment[1])
+            z = int(segment[2])
+            r = int(segment[3])
+            _plan_us += time.ticks_diff(_wall_us(), start)
+            while _tail - _head == ring_size: # Full, core 0 is behind
+                if _stop:
+                    return
+            start = _wall_us()
+            i = (_tail & (ring_size - 1)) * _ROW
+            _ring[i] = x
+            _ring[i + 1] = y
+            _ring[i + 2] = z
+            _ring[i + 3] = r
+            if sync is None:
+                _sync(i, x, y, z, r)
+            else:
+                delays = sync(x, y, z, r)
+                for axis in range(4):
+                    _ring[i + 4 + axis] = int(delays[axis])
+            _ring[i + 8] = time.ticks_us()
+            _tail += 1                        # The row is complete, core 0 may read it
+            planned += 1
+            if _stop:
+                return
+    except Exception as e:
+        _error = e
+    finally:
+        _busy = False
+
+def start(instructions, sync=None): # Starts planning step_instructor() style segments on core 1
+    global _head, _tail, _busy, _stop, _error, planned, _plan_us, _wait_sum, _wait_max
+    if _busy:                                # sync can be experimental.motor_sync, the default needs no floats
+        raise RuntimeError("planner is already running")
+    _head = _tail = planned = _plan_us = _wait_sum = _wait_max = 0
+    _stop = False
+    _error = None
+    _busy = True
+    _thread.start_new_thread(_plan, (instructions, sync))
+
+def stop(): # Makes the planner give up, play() then finishes what is in the ring
+    global _stop
+    _stop = True
+
+         ### Executing (core 0) ###
+async def play(): # Copies planned segments into motion_queue until the planner is done, then waits for the motors
+    global _head, _wait_sum, _wait_max
+    delays = array("i", [0, 0, 0, 0])
+    while True:
+        if _head == _tail:
+            if not _busy:
+                break
+            await asyncio.sleep_ms(1)
+            continue
+        i = (_head & (ring_size - 1)) * _ROW
+        for axis in range(4):
+            delays[axis] = _ring[i + 4 + axis]
+        wait = time.ticks_diff(time.ticks_us(), _ring[i + 8])
+        _wait_sum += wait
+        if wait > _wait_max:
+            _wait_max = wait
+        if mq.depth() == mq.queue_size:
+            mq.start()                       # Queue is full, release the motors with it preloaded
+        await mq.put(_ring[i], _ring[i + 1], _ring[i + 2], _ring[i + 3], delays)
+        _head += 1                           # The row is copied, core 1 may write it again
+    if _error is not None:
+        raise _error
+    mq.start()
+    await mq.drain()
+
+def run(instructions, sync=None): # Blocking: plans on core 1, steps on core 0 and hands the state machines back when done
+    start(instructions, sync)
+    try:
+        asyncio.run(play())
+    finally:
+        stop()
+        mq.stop()
+
+def stats(): # Returns (segments planned, segments planned per second of core 1, average and longest wait in the ring [us])
+    rate = planned * 1_000_000 // _plan_us if _plan_us else 0
+    return planned, rate, _wait_sum // _head if _head else 0, _wait_max
@@ -0,0 +1,125 @@
+         ### Libraries ###
+import time                                 # ticks_us() timestamps
+from array import array                     # The preallocated stats
+
+# profiler shows where the time of a move goes: argument handling in steps() /
+# angle(), motor_sync(), the exec() clears, the FIFO put()s, the sleeps and the
+# wait for the motors. move_steps() timestamps the end of each phase with
+# ticks_us() and the time since the last timestamp is added to that phase: count,
+# sum, min, max and a histogram, all in arrays made once. Nothing is allocated
+# per move, so it can stay on in production.
+#
+#     profiler.enabled = True
+#     ctrl.steps(3200, 0, 0, 0)
+#     profiler.report()                      (a line per phase, times in us)
+#     profiler.stats()                       ({"put": (count, min, avg, max, histogram), ...})
+#     profiler.reset_stats()
+#
+# Switched off, a move only checks enabled once per phase. A phase that happens
+# twice in a move (experimental puts and sleeps twice) is recorded twice. move
+# is the whole move from the first timestamp to the last, so it adds up the other
+# phases.
+
+         ### Settings ###
+enabled = False      # Timestamps the phases of every move
+buckets_us = (10, 100, 1000, 10_000, 100_000, 1_000_000) # Histogram bucket limits, one more bucket for everything above
+                     # reset_stats() after changing them
+
+         ### Phases ###
+CALL = 0             # steps() / angle(): arguments and asyncio.run() until move_steps() runs
+ARGS = 1             # move_steps(): positions, rounding, direction pins
+SYNC = 2             # motor_sync() delays (experimental)
+CLEAR = 3            # exec() clears of the step_speed state machines (experimental)
+PUT = 4              # FIFO put()s of the steps and delays
+SLEEP = 5            # Sleeps while the state machines take their values (experimental)
+START = 6            # From the last put() until the motors are released
+WAIT = 7             # Until every motor is done
+FINISH = 8           # State machines held, direction pins back, DONE record
+MOVE = 9             # The whole move
+NAMES = ("call", "args", "sync", "clear", "put", "sleep", "start", "wait", "finish", "move")
+
+         ### Global Variables ###
+_PHASES = len(NAMES)
+_count = array("i", [0] * _PHASES)
+_sum = array("q", [0] * _PHASES)                  # [us], 64 bit so it doesn't overflow with days of moves
+_min = array("i", [0x7FFFFFFF] * _PHASES)
+_max = array("i", [0] * _PHASES)
+_hist = array("i", [0] * (_PHASES * (len(buckets_us) + 1)))
+_t = 0                                            # ticks_us() of the last timestamp
+_first = 0                                        # ticks_us() the move started
+_open = False                                     # A move is being timed
+
+         ### Timing ###
+def _add(phase, us): # Adds one time to a phase
+    _count[phase] += 1
+    _sum[phase] += us
+    if us < _min[phase]:
+        _min[phase] = us
+    if us > _max[phase]:
+        _max[phase] = us
+    bucket = 0
+    for limit in buckets_us:
+        if us < limit:
+            break
+        bucket += 1
+    _hist[phase * (len(buckets_us) + 1) + bucket] += 1
+
+def begin(): # Starts timing a move, steps() and angle() call it so CALL is timed too
+    global _t, _first, _open
+    _t = _first = time.ticks_us()
+    _open = True
+
+def lap(phase): # Adds the time since the last timestamp to phase. A move that wasn't begin()ed starts here
+    global _t, _first, _open
+    now = time.ticks_us()
+    if _open:
+        _add(phase, time.ticks_diff(now, _t))
+    else:
+        _first = now
+        _open = True
+    _t = now
+
+def end(phase): # Last lap of a move, adds the whole move to MOVE
+    global _open
+    lap(phase)
+    _add(MOVE, time.ticks_diff(_t, _first))
+    _open = False
+
+         ### Results ###
+def stats(): # {phase name: (count, min, avg, max, histogram)} of every phase timed since reset_stats(), in us
+    width = len(buckets_us) + 1
+    result = {}
+    for phase in range(_PHASES):
+        n = _count[phase]
+        if n:
+            result[NAMES[phase]] = (n, _min[phase], _sum[phase] // n, _max[phase],
+                                    tuple(_hist[phase * width:(phase + 1) * width]))
+    return result
+
+def reset_stats():
+    global _hist, _open
+    for phase in range(_PHASES):
+        _count[phase] = _sum[phase] = _max[phase] = 0
+        _min[phase] = 0x7FFFFFFF
+    width = len(buckets_us) + 1
+    if len(_hist) != _PHASES * width:
+        _hist = array("i", [0] * (_PHASES * width))
+    else:
+        for i in range(len(_hist)):
+            _hist[i] = 0
+    _open = False
+
+def report(out=None): # Prints a line per phase (or out(line) for each): count, min, avg, max [us] and the histogram
+    limits = " ".join("<{}".format(limit) for limit in buckets_us) + " more"
+    _write("{:8} {:>6} {:>8} {:>8} {:>8}  {}".format("phase", "count", "min", "avg", "max", limits), out)
+    result = stats()
+    for name in NAMES:                           # In phase order, MicroPython dicts may not keep it
+        if name in result:
+            n, low, avg, high, histogram = result[name]
+            _write("{:8} {:>6} {:>8} {:>8} {:>8}  {}".format(name, n, low, avg, high, " ".join(str(b) for b in histogram)), out)
+
+def _write(line, out):
+    if out is None:
+        print(line)
+    else:
+        out(line)
@@ -0,0 +1,113 @@
+         ### Libraries ###
+from array import array                     # The packed words of a compiled program
+import stepper_controller as ctrl           # step_angle for programs in degrees
+import motion_queue as mq                   # Plays the compiled words
+asyncio = ctrl.asyncio
+
+# program_cache compiles a step_instructor() / angle_instructor() style tuple into
+# the words motion_queue puts into the state machines, and keeps the last few
+# compiled programs. A production task that runs the same tuple again and again
+# then skips the int(.../step_angle) conversions, the motor_sync() delays, the
+# direction split and abs() of every segment, and starts right away.
+#
+#     program_cache.run(((3200, 0, 0, 0), (0, 3200, 0, 0)))              (compiled on the first run only)
+#     program_cache.run(((90, 45, 0, 0), (-90, -45, 0, 0)), angles=True)  (degrees, like angle_instructor())
+#     program_cache.run(task, sync=experimental.motor_sync)               (MOVL delays, like motion_queue.run())
+#     await program_cache.play(task)                                      (from a task)
+#
+# A compiled program is (segments, totals, counters, speeds):
+#     totals    steps of the whole program per axis, for x_last etc.
+#     counters  per axis: one segment_counter word per segment, steps << 1 | direction
+#     speeds    per axis: two segment_speed words per segment, delay and steps
+# so each axis is one buffer per state machine, ready for put() or DMA.
+#
+# The cache is looked up by hash() of the tuple and then compared with the tuple
+# itself, which it keeps a reference to (a program that is run again is normally
+# a constant anyway). Only tuples of tuples are cached, lists and generators are
+# compiled every time. Programs are dropped least recently used first when there
+# are more than entries or their words take more than budget bytes, a program
+# bigger than budget on its own is compiled and played without being kept.
+
+         ### Settings ###
+budget = 16 * 1024   # [bytes] of compiled words kept, 48 bytes per segment
+entries = 8          # Programs kept at most
+
+         ### Global Variables ###
+_cache = []                                       # [key, source, program, bytes], most recently used first
+_bytes = 0                                        # Words kept in _cache [bytes]
+hits = 0
+misses = 0
+
+         ### Compiling ###
+def pack(instructions, sync=None, angles=False): # Packs instruction tuples (x, y, z, r[, delays]) into a program
+    source = instructions if isinstance(instructions, (tuple, list)) else tuple(instructions) # len() and a second pass
+    n = len(source)
+    totals = [0, 0, 0, 0]
+    counters = [array("I", [0] * n) for _ in range(4)]
+    speeds = [array("I", [0] * (2 * n)) for _ in range(4)]
+    steps = [0, 0, 0, 0]
+    for i in range(n):
+        segment = source[i]
+        for axis in range(4):
+            steps[axis] = int(segment[axis] / ctrl.step_angle) if angles else int(segment[axis])
+        delays = segment[4] if len(segment) > 4 else None
+        if delays is None and sync is not None:
+            delays = sync(steps[0], steps[1], steps[2], steps[3])
+        for axis in range(4):
+            count = steps[axis]
+            totals[axis] += count
+            if count < 0:
+                count = -count
+                counters[axis][i] = count << 1 | 1
+            else:
+                counters[axis][i] = count << 1
+            speeds[axis][2 * i] = mq.base_delay if delays is None else int(delays[axis])
+            speeds[axis][2 * i + 1] = count
+    return n, totals, counters, speeds
+
+def _size(program): # Bytes of words in a program
+    return program[0] * 12 * 4
+
+def _key(instructions, sync, angles):
+    return hash(instructions), len(instructions), sync, angles, mq.base_delay, ctrl.step_angle if angles else 0
+
+def get(instructions, sync=None, angles=False): # The compiled program of instructions, from the cache when it has been compiled before
+    global _bytes, hits, misses
+    try:
+        key = _key(instructions, sync, angles)
+    except TypeError:                             # A list or a generator, hash() can't look at it
+        misses += 1
+        return pack(instructions, sync, angles)
+    for i in range(len(_cache)):
+        entry = _cache[i]
+        if entry[0] == key and (entry[1] is instructions or entry[1] == instructions):
+            if i:
+                _cache.insert(0, _cache.pop(i))   # Most recently used first
+            hits += 1
+            return entry[2]
+    misses += 1
+    program = pack(instructions, sync, angles)
+    size = _size(program)
+    if size <= budget:
+        while _cache and (len(_cache) >= entries or _bytes + size > budget):
+            _bytes -= _cache.pop()[3]             # Least recently used last
+        _cache.insert(0, [key, instructions, program, size])
+        _bytes += size
+    return program
+
+def clear(): # Drops every compiled program
+    global _bytes, hits, misses
+    _cache.clear()
+    _bytes = hits = misses = 0
+
+def stats(): # Returns (programs kept, bytes kept, hits, misses)
+    return len(_cache), _bytes, hits, misses
+
+         ### Playing ###
+async def play(instructions, sync=None, angles=False): # Compiles (or finds) instructions and streams them through motion_queue
+    n, totals, counters, speeds = get(instructions, sync, angles)
+    await mq.stream(counters, speeds, n, totals)
+
+def run(instructions, sync=None, angles=False): # Blocking version of play(), hands the state machines back when done
+    asyncio.run(play(instructions, sync, angles))
+    mq.stop()
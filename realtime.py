@@ -0,0 +1,111 @@
+         ### Libraries ###
+import gc                                   # Collected between jobs, off while the motors move
+import machine                              # idle() while waiting for the motors
+from array import array                     # A job is one flat array of step counts
+import stepper_controller as ctrl           # The state machines, pins and positions the moves use
+import sync_start                           # Releases the step counters together
+import telemetry                            # MOVE and DONE records, like steps()
+
+# realtime runs stepper_controller moves without allocating anything per move, so
+# the garbage collector never has a reason to stop the CPU in the middle of loading
+# the FIFOs. steps() allocates on every move: asyncio.run() makes a task and a
+# coroutine, angle() divides floats, instructor() indexes a nested tuple per field.
+# Here a job is packed once into a flat array("i") of whole steps, moves are plain
+# function calls with integers that wait for the motors by polling the completion
+# flags, and the garbage collector is run before the job and kept off during it.
+#
+#     job = realtime.pack(((3200, 0, 0, 0), (0, -3200, 0, 0)))       (steps, or angles=True for degrees)
+#     realtime.run(job)                                              (collects, moves, turns gc back on)
+#     realtime.start(); realtime.play(job); realtime.play(job); realtime.stop()   (several jobs in one go)
+#     realtime.move(100, 0, -50, 0)                                  (one move, inside start() / stop())
+#
+# The moves go through stepper_controller's state machines at its feed_rate(), they
+# keep x_last etc., steps_now(), feed_hold() and abort() up to date like steps()
+# does. Code that allocates between start() and stop() grows the heap until it runs
+# out instead of collecting, so keep the rest of the loop allocation-free too.
+
+         ### Global Variables ###
+_was_enabled = True                               # gc state before start()
+position_now = array("i", [0, 0, 0, 0])           # Filled by position(), no tuple per call
+_move = array("i", [0, 0, 0, 0])                  # The steps of the move being loaded
+
+         ### Jobs ###
+def pack(instructions, angles=False): # Packs instructor() style tuples (x, y, z, r) into a job, degrees with angles=True
+    job = array("i")
+    for segment in instructions:
+        for axis in range(4):
+            job.append(round(segment[axis] / ctrl.step_angle) if angles else int(segment[axis]))
+    return job
+
+def start(): # Collects the garbage and turns the collector off until stop(), sets up stepper_controller if nothing has
+    global _was_enabled
+    if not ctrl._ready:
+        ctrl.init()
+    _was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+
+def stop(): # Turns the collector back on if start() found it on
+    if _was_enabled:
+        gc.enable()
+
+         ### Moving ###
+def move(x, y, z, r): # One move of whole steps, returns when every motor is done. Allocates nothing
+    _move[0] = x
+    _move[1] = y
+    _move[2] = z
+    _move[3] = r
+    for motor in range(ctrl.motors, 4):
+        if _move[motor]:
+            raise ValueError("only {} motors are set up, see ctrl.init()".format(ctrl.motors))
+    ctrl._origin[0] = ctrl.x_last
+    ctrl._origin[1] = ctrl.y_last
+    ctrl._origin[2] = ctrl.z_last
+    ctrl._origin[3] = ctrl.r_last
+    ctrl.x_last += x
+    ctrl.y_last += y
+    ctrl.z_last += z
+    ctrl.r_last += r
+    ctrl._counts[0] = x
+    ctrl._counts[1] = y
+    ctrl._counts[2] = z
+    ctrl._counts[3] = r
+    finished = ctrl.finished
+    for motor in range(4):
+        finished[motor] = motor >= ctrl.motors    # The motors init() didn't set up are done
+    pairs = ctrl._pairs
+    dirs = ctrl._dirs
+    for motor in range(len(pairs)):
+        steps = _move[motor]
+        dirs[motor].value(steps < 0)
+        pairs[motor][0].put(-steps if steps < 0 else steps)
+    ctrl.activation_pin.value(1)
+    sync_start.release(ctrl._counters, ctrl._speeds)
+    ctrl._moving = True
+    telemetry.log(1, telemetry.MOVE, x, y, z, r)
+    while not (finished[0] and finished[1] and finished[2] and finished[3]):
+        machine.idle()                   # Woken by the completion IRQs
+    ctrl._moving = False
+    sync_start.hold(ctrl._counters)
+    for pin in dirs:
+        pin.value(0)
+    ctrl.activation_pin.value(0)
+    telemetry.log(1, telemetry.DONE, ctrl.x_last, ctrl.y_last, ctrl.z_last, ctrl.r_last)
+
+def play(job): # Every move of a packed job, inside start() / stop()
+    for i in range(0, len(job), 4):
+        move(job[i], job[i + 1], job[i + 2], job[i + 3])
+
+def run(job): # A whole job with the collector off, collected before it
+    start()
+    try:
+        play(job)
+    finally:
+        stop()
+
+def position(): # Fills position_now with x_last etc. and returns it
+    position_now[0] = ctrl.x_last
+    position_now[1] = ctrl.y_last
+    position_now[2] = ctrl.z_last
+    position_now[3] = ctrl.r_last
+    return position_now
@@ -0,0 +1,128 @@
+         ### Libraries ###
+from array import array                     # Positions of up to 8 axes
+from machine import Pin
+import rp2
+from rp2 import PIO, StateMachine, asm_pio  # Is used to make PIO programs
+import stepper_controller as ctrl           # Activation pin, step angle and ThreadSafeFlag
+asyncio = ctrl.asyncio
+
+# step_driver runs each motor on one state machine instead of two. Counting,
+# the step pulse, the delay and the direction pin are all done by one PIO
+# program, so there is no IRQ 4/5 handshake between state machines and all 8
+# state machines can drive a motor each: 8 axes on one RP2040.
+#
+# The axes are not x, y, z and r here but a list, axis 0 runs on state machine 0,
+# axis 1 on state machine 1 and so on:
+#     step_driver.axes = [(17, 16), (4, 5), (6, 7), (8, 9), (10, 11), (12, 13), (14, 15), (18, None)]
+#     step_driver.steps(3200, -1200, 0, 0, 800, 800, 0, 100)
+# An axis without a direction pin (None) always turns the same way.
+
+         ### Settings ###
+axes = [(17, 16), (4, 5), (6, 7), (8, 9)] # (step pin, direction pin or None) per axis, at most 8
+                                          # Same pins as stepper_controller's motors by default
+freq = 1_000_000     # step_driver frequency, one delay count is 1 us at 1 MHz
+delay = 200          # Delay used when a move gets no delays
+start_pin = 25       # Pin the moves wait for, the activation pin. chain.py uses its sync wire instead
+OVERHEAD = 4         # PIO cycles per step on top of the delay: step period = (delay + OVERHEAD) / freq
+
+         ### Global Variables ###
+position = array("i", [0] * 8)                    # Steps from origin per axis
+_done = [ctrl.ThreadSafeFlag() for _ in range(8)] # Set by the completion IRQ of each axis
+_sms = []                                         # One step_driver state machine per axis
+_running = False
+
+         ### PIO functions ###
+# step_driver pulls two words per move: the delay, kept in ISR, and
+# steps << 1 | direction. The direction bit goes straight onto the out pin
+# (none is written when the axis has no direction pin), then the steps are
+# counted in x and the delay loop in y. The step pin is side-set and the
+# pin the move waits for is in_base, so it doesn't have to be GPIO 25.
+# The completion IRQ is relative, each state machine in a block has its own flag 0-3.
+@asm_pio(sideset_init=PIO.OUT_LOW, out_init=PIO.OUT_LOW, out_shiftdir=PIO.SHIFT_RIGHT, fifo_join=PIO.JOIN_TX)
+def step_driver():
+    pull(block)                    # delay of the next move
+    mov(isr, osr)                  # kept in ISR, we never push
+    pull(block)                    # steps << 1 | direction
+    out(pins, 1)                   # direction bit goes straight onto the direction pin
+    out(x, 31)                     # the rest of the word is the number of steps
+    wait(1, pin, 0)                # waiting for start_pin, "activation_pin.value(1)"
+    jmp(x_dec, "step")             # x = steps - 1, so the loop makes exactly x steps
+    jmp("end")                     # no steps in this move
+    label("step")
+    mov(y, isr) .side(1) [1]       # load the delay - Side Step Pin On for 2 cycles
+    label("delay")
+    jmp(y_dec, "delay") .side(0)   # delay loop - Side Step Pin Off
+    jmp(x_dec, "step")             # if x is NOT 0(zero), remove one (-1) from x and make the next step
+    label("end")
+    irq(block, rel(0))             # Signals the IRQ handler that all steps have been made and waits for it
+
+     ### PIO interupt handler ###
+def pio_handler(sm): # Every axis, the state machine tells which one is done
+    _done[_sms.index(sm)].set()
+
+     ### Step driver mode ###
+def start(): # Takes over the state machines, like motion_queue.start()
+    global _sms, _running
+    if _running:
+        return
+    if len(axes) > 8:
+        raise ValueError("at most 8 axes")
+    ctrl.release_state_machines()
+    _sms = []
+    for i in range(len(axes)):
+        step_pin, dir_pin = axes[i]
+        sm = StateMachine(i, step_driver, freq=freq, sideset_base=step_pin, out_base=dir_pin, in_base=start_pin)
+        sm.irq(pio_handler)
+        _sms.append(sm)
+    for sm in _sms:
+        sm.active(1)
+    _running = True
+
+def stop(): # Hands the state machines back to stepper_controller
+    global _running
+    for sm in _sms:
+        sm.active(0)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(step_driver)
+    for step_pin, dir_pin in axes:
+        if dir_pin is not None:
+            Pin(dir_pin, Pin.OUT, value=0)
+    _running = False
+    ctrl.setup_state_machines()
+
+def running(): # True while step_driver has the state machines, between start() and stop()
+    return _running
+
+def load(steps, delays=None): # Puts one move into the FIFOs, it starts when the activation pin goes high
+    start()
+    n = len(_sms)
+    if len(steps) > n:
+        raise ValueError("more steps than axes")
+    for axis in range(n):
+        _done[axis].clear()
+        count = round(steps[axis]) if axis < len(steps) else 0
+        _sms[axis].put(delay if delays is None else delays[axis])
+        _sms[axis].put(-count << 1 | 1 if count < 0 else count << 1)
+        position[axis] += count
+
+async def wait(): # Waits until every axis has made the steps of the loaded move
+    for axis in range(len(_sms)):
+        await _done[axis].wait()
+
+async def move_steps(*steps, delays=None): # One step count per axis, missing ones are 0
+    load(steps, delays)
+    ctrl.activation_pin.value(1)
+    await wait()
+    ctrl.activation_pin.value(0)
+
+def steps(*steps, delays=None): # Blocking version of move_steps()
+    asyncio.run(move_steps(*steps, delays=delays))
+
+async def move_angle(*degrees, delays=None):
+    await move_steps(*[round(deg / ctrl.step_angle) for deg in degrees], delays=delays)
+
+def angle(*degrees, delays=None):
+    asyncio.run(move_angle(*degrees, delays=delays))
+
+def zero(): # Back to where every axis started
+    steps(*[-position[axis] for axis in range(len(axes))])
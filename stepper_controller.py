@@ -1,13 +1,18 @@
          ### Libraries ###
 import time                      # To be able to add delays (sleep)
+import machine                   # Gives us idle() while waiting for the motors
 from machine import Pin          # To allow software to manipulate board pins
 import rp2                       # Is used to make PIO programs
+import units                     # Motor settings and step / angle conversions, no hardware behind them
+import telemetry                 # Records moves without printing from the motion path
+import sync_start                # Starts the step counters of both PIO blocks together
+import profiler                  # Times the phases of a move when profiler.enabled
+try:
+    import asyncio               # Lets motion, comms and UI run together on one core
+except ImportError:
+    import uasyncio as asyncio   # Older MicroPython firmware ships it as uasyncio
 
          ### Global Variables ###
-motor_1 = False                   # To be able to check if a motor is completed
-motor_2 = False                   # - " -
-motor_3 = False
-motor_4 = False
 x_last = 0                        # To store relative position in steps
 y_last = 0                        # - " -
 z_last = 0                        # - " -
@@ -18,35 +23,65 @@ r_last = 0                        # - " -
 # r_speed = 10                      # - " -
 
          ### Stepper motor setup ###
-# These settings are made for rotational movement only. (Belts, gears etc)
-# This means if you want to use a trapetziod for a linear actuator, use the other motor settings.
-drv_ms = 16               # resolution of microstepping 1 / 1, 2, 4, 8, 16, 32, 64, 128, write the denominator only
-motor_steps_per_rev = 200 # steps per full revolution, often 200 or 400
-gear_ratio = 1            # how many times the motor needs to spin to turn output one time. Gear ratio 5:1 means 5 times for one full turn
-steps_per_rev = motor_steps_per_rev * drv_ms * gear_ratio # This is the number of steps to move output.
-step_angle = 360 / steps_per_rev # This is the step resolution in degrees
-lead_screw_pitch = 2 # This is how far each rotation will move something. 2 [mm] pitch is common for 3D printers.
-step_pitch = lead_screw_pitch / steps_per_rev # This is how far along the lead screw we are moved for each step.
-print("For gears, belts and arms.")
-print("Steps per revolution:", steps_per_rev, "steps.",
-      "\nOne step is", step_angle, "degrees.\n")
-print("For lead screws.")
-print ("[mm] per revolution:", lead_screw_pitch,
-       "\nOne steps is", step_pitch, "[mm].\n")
-
-# Whith the example above, we get:
-# Belt, Gear or Arm 
-# Steps per revolution: 3200
-# Wormgear or Lead screw
-# [mm] per revolution: 2
-# One step is 0.1125 degrees
+# Microstepping, steps per revolution, gear ratio and lead screw pitch are set in
+# units.py, which needs no hardware so planning code and tools can import it on any
+# Python. These are copies for the code that reads them from here, init(config)
+# refreshes them. units.banner() (or info()) prints them.
+steps_per_rev = units.steps_per_rev # This is the number of steps to move output.
+step_angle = units.step_angle       # This is the step resolution in degrees
+step_pitch = units.step_pitch       # This is how far along the lead screw we are moved for each step.
+
+         ### Start-up ###
+# Importing stepper_controller has no side effects: no pins are set up, no PIO
+# program is assembled and nothing is printed, so it can be imported for planning
+# or tooling. init() assembles step_counter and step_speed once, sets up the pins
+# and starts the state machines of the motors in config only. The first move calls
+# init() itself when nothing else has.
+#
+#     ctrl.init()                                          (every motor, with the settings in this file and units.py)
+#     ctrl.init({"motors": 2, "drv_ms": 32, "sc_freq": 5_000_000})
+#     ctrl.info()                                          (prints the configuration)
+motors = 4                        # Motors init() brings up: 1 = x, 2 = x and y, ... 4 = x, y, z and r
+CONFIG = ("motors", "sc_freq", "ss_freq", "pulse_us") # What init(config) takes besides units.SETTINGS
+_ready = False                    # The state machines are set up
+
+         ### Motor completion flags ###
+# The PIO interrupt handlers set one flag per motor when its last step is made.
+# On the Pico this is asyncio.ThreadSafeFlag, which is safe to set from an IRQ
+# and wakes the waiting task right away instead of it polling every n ms.
+# A Linux host with machine/rp2 stubbed out has no ThreadSafeFlag, so it gets
+# a small stand-in that idles the "CPU" between checks.
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+except AttributeError:
+    class ThreadSafeFlag:
+        def __init__(self):
+            self._flag = False
+
+        def set(self):
+            self._flag = True
+
+        def clear(self):
+            self._flag = False
+
+        async def wait(self):
+            while not self._flag:
+                machine.idle()           # Lets a stubbed machine module run its PIO
+                await asyncio.sleep(0)
+            self._flag = False
+
+motor_done = [ThreadSafeFlag() for _ in range(4)] # One flag for each motor x, y, z and r
+finished = bytearray(4)                           # Set with the flags, for code that polls instead of awaiting (realtime.py)
 
 
          ### Synchronization Pin ###
-activation_pin = Pin(25, Pin.OUT) # Pin 25 is used to trigger our PIO programs/functions
-                                  # and is mandatory to have synchronous activation of motors
-                                  # For Pi Pico W, chose another Pin and add LED activation for
-                                  # visual feedback.
+activation = 25                   # Pin 25 is high while the motors move, the LED gives visual feedback.
+                                  # motion_queue, interpolator and step_driver still trigger their PIO
+                                  # programs with it. step_counter no longer waits for it: the counters
+                                  # are held (disabled) between moves and sync_start releases them,
+                                  # so stepper_controller itself does not need the pin (Pico W: pin 25
+                                  # is not the LED there, pick another pin).
+activation_pin = None             # Pin(activation), made by init()
 
          ### PIO functions ###
 # step_counter is a PIO program that takes in a value (desired number of steps)
@@ -60,54 +95,64 @@ activation_pin = Pin(25, Pin.OUT) # Pin 25 is used to trigger our PIO programs/f
 #           -- PIO block 0 --           -- PIO block 1 --
 #        State machine 0, 1, 2, 3    State machine 4, 5, 6, 7
 
-@rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW) # Assembly decorator, sideset pin default Low
-                                           # and that it's assigned Pin should be Low / Off 
-                                           # when the program starts.
-def step_counter():
+# They are assembled by _assemble() the first time init() runs, with
+# rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW) for step_counter: the sideset pin
+# default Low, and its assigned Pin should be Low / Off when the program starts.
+step_counter = None               # The assembled programs, every state machine loads the same ones
+step_speed = None
+
+def _step_counter():
     pull(block)                    # wait for FIFO to fill (put), then pull data to OSR
-    mov(x, osr)                    # copy OSR data into X (load our steps into x)
-    wait(1, gpio, 25)              # waiting for Pin 25 to activate
+    mov(x, osr)                    # copy OSR data into X (load our steps into x), runs when sync_start releases us
     label("count")                 # this is a header we jump back to for counting steps
-    jmp(not_x, "end") .side(1) [1] # if x is 0(zero), jmp to end - Side Step Pin On
-    irq(5) .side(0)                # sets IRQ 5 high, starting step_speed() - Side Step Pin Off
-    irq(block, 4)                  # waiting for IRQ flag 4 to clear
+    jmp(not_x, "end")              # if x is 0(zero), jmp to end before the pin goes high, so a 0 step move makes no pulse
+    irq(rel(5)) .side(1) [1]       # sets IRQ 5 (7 on state machine 2 and 6) high, starting step_speed() - Side Step Pin On
+    irq(block, rel(4)) .side(0)    # waiting for IRQ flag 4 (6) to clear - Side Step Pin Off
     jmp(x_dec, "count")            # if x is NOT 0(zero), remove one (-1) from x and jump back to count, Else, continue
     label("end")                   # This is a header we can jmp to if x is 0.
     irq(block, rel(0))             # Signals IRQ handler that all steps have been made and waits for handler to clear the flag (block)
 
-@rp2.asm_pio(autopull=True)                         # Tells the program that this is a PIO program/function.
-def step_speed():
-    wait(1, irq, 5)         # waiting for IRQ flag 5 from step_counter and then clears it
-    set(y, 5)               # set y to the value 31 (which is 0-31 = 32)
+# step_speed keeps the delay of its motor in x, feed_rate() writes it there with exec().
+# The IRQ flags are rel(), so the two motors of a PIO block each have their own pair:
+# step_counter on state machine 0 / 4 talks to step_speed on 1 / 5 through flags 4 and 5,
+# step_counter on 2 / 6 to step_speed on 3 / 7 through flags 6 and 7.
+def _step_speed():
+    wait(1, irq, rel(4))    # waiting for IRQ flag 5 (7) from step_counter and then clears it
+    mov(y, x)               # load the delay of this motor into y
     label("delay")          # this is a header we jump back to for adding a delay
-    nop() [9]               # do nothing for [n] instructions (which is 20 instructions)
     jmp(y_dec, "delay")     # if y not 0(zero), remove one (-1) from y make jump to delay, Else, continue
-    irq(clear, 4)           # clear IRQ flag 4, allowing step_counter() to continue
+    irq(clear, rel(7))      # clear IRQ flag 4 (6), allowing step_counter() to continue
+
+def _assemble(): # Assembles the PIO programs the first time, later calls reuse them
+    global step_counter, step_speed
+    if step_counter is None:
+        step_counter = rp2.asm_pio(sideset_init=rp2.PIO.OUT_LOW)(_step_counter)
+        step_speed = rp2.asm_pio()(_step_speed)
 
      ### PIO interupt handlers ###
 # These are triggered by step_counter in each PIO block and thus
 # there are two similar functions that does the same thing.
-# When they are triggered, motor_n turns True and
-# they print x or y steps to REPL and which statemachine is done.
+# When they are triggered, they set the motor's flag in motor_done and
+# log the motor's steps from origin to telemetry (printing here would hold up the IRQ).
 def pio_0_handler(sm): # Motor 1
-    global motor_1
-    motor_1 = True
-    print(sm, "x:", x_last)
+    motor_done[0].set()
+    finished[0] = 1
+    telemetry.log(2, telemetry.AXIS, 0, round(x_last))
 
 def pio_1_handler(sm): # Motor 2
-    global motor_2
-    motor_2 = True
-    print(sm, "y:", y_last)
+    motor_done[1].set()
+    finished[1] = 1
+    telemetry.log(2, telemetry.AXIS, 1, round(y_last))
 
 def pio_2_handler(sm): # Motor 3
-    global motor_3
-    motor_3 = True
-    print(sm, "z:", z_last)
+    motor_done[2].set()
+    finished[2] = 1
+    telemetry.log(2, telemetry.AXIS, 2, round(z_last))
 
 def pio_3_handler(sm): # Motor 4
-    global motor_4
-    motor_4 = True
-    print(sm, "r:", r_last)
+    motor_done[3].set()
+    finished[3] = 1
+    telemetry.log(2, telemetry.AXIS, 3, round(r_last))
 
      ### Setting up state machines ###
 # Motor 1 is separated in the code to better explain each step.
@@ -117,59 +162,210 @@ sc_freq = 1_000_000 # step_counter frequency
 ss_freq = 1_000_000 # step_speed frequency
                     # 1_000_000 Hz = 1 MHz means each instruction in PIO is 1us long
                     # 4_000_000 Hz = 4 MHz means each instruction in PIO is 0.25 us long
-# Motor 1 - Pio Block 0
-step_pin_1 = Pin(17, Pin.OUT)
-dir_pin_1 = Pin(16, Pin.OUT)         # Defines Pin 16 as direction pin of motor 1 and as an Output pin
-sm_0 = rp2.StateMachine(0,           # Creates object called sm_0 and binds it to state machine 0 inPIO block 0
-    step_counter,                    # Assigns step_counter as PIO program/function
-    freq=sc_freq,                    # Sets the PIO frequency to sc_freq
-    sideset_base=step_pin_1          # Sets Pin 17 as first sideset pin of PIO program/function
-)
-
-sm_0.irq(pio_0_handler)              # Directs interrupts from sm_0 to the interrupt handler pio_0_handler()
-sm_1 = rp2.StateMachine(1,           # Creates object called sm_1 and binds it to state machine 1 in PIO block 0
-                        step_speed,  # Assigns step_speed as PIO program/function
-                        freq=ss_freq # Sets the PIO frequency to ss_freq
-)
-
-# Motor 2 - Pio Block 1
-step_pin_2 = Pin(4, Pin.OUT)                                                  # Step Pin 4
-dir_pin_2 = Pin(5, Pin.OUT)                                                   # Direction Pin 5
-sm_4 = rp2.StateMachine(4, step_counter, freq=sc_freq, sideset_base=step_pin_2) # Statemachine 4 - PIO block 1
-sm_4.irq(pio_1_handler)                                                        #
-sm_5 = rp2.StateMachine(5, step_speed, freq=ss_freq)                        # Statemachine 5 - PIO block 1
-
-# Motor 3 - Pio Block 0
-step_pin_3 = Pin(6, Pin.OUT)                                                  # Step Pin 5
-dir_pin_3 = Pin(7, Pin.OUT)                                                   # Direction Pin 6
-sm_2 = rp2.StateMachine(2, step_counter, freq=sc_freq+10, sideset_base=step_pin_2) # Statemachine 2 - PIO block 0
-sm_2.irq(pio_2_handler)                                                        #
-sm_3 = rp2.StateMachine(3, step_speed, freq=ss_freq+10)                        # Statemachine 3 - PIO block 0
-
-# Motor 4 - Pio Block 1
-step_pin_4 = Pin(8, Pin.OUT)                                                  # Step Pin 8
-dir_pin_4 = Pin(9, Pin.OUT)                                                   # Direction Pin 9
-sm_6 = rp2.StateMachine(6, step_counter, freq=sc_freq+10, sideset_base=step_pin_2) # Statemachine 6 - PIO block 1
-sm_6.irq(pio_3_handler)                                                        #
-sm_7 = rp2.StateMachine(7, step_speed, freq=ss_freq+10)                        # Statemachine 7 - PIO block 1
-
-# Activating all state machine
-sm_0.active(1), sm_1.active(1) # Motor 1 State machine 0 and 1 in PIO block 0
-sm_4.active(1), sm_5.active(1) # Motor 2 State machine 4 and 5 in PIO block 1
-sm_2.active(1), sm_3.active(1) # Motor 3 State machine 2 and 3 in PIO block 0
-sm_6.active(1), sm_7.active(1) # Motor 4 State machine 6 and 7 in PIO block 1
-
-def steps(x, y, z, r): # Feeds the PIO programs and activates them.
-    global motor_1, motor_2, motor_3, motor_4
-    global x_last, y_last, z_last, r_last
+step_pin_1 = dir_pin_1 = None        # Pin objects, made by init() for the motors it brings up
+step_pin_2 = dir_pin_2 = None
+step_pin_3 = dir_pin_3 = None
+step_pin_4 = dir_pin_4 = None
+sm_0 = sm_1 = sm_2 = sm_3 = sm_4 = sm_5 = sm_6 = sm_7 = None
+_pairs = ()                          # (step_counter, step_speed) of every motor that is set up
+_dirs = ()                           # Direction pins of those motors
+_COUNTERS = (0, 4, 2, 6)             # step_counter state machine of each motor
+_counters = ()                       # The ones that are set up, released together by sync_start
+_SPEEDS = (1, 5, 3, 7)               # step_speed state machine of each motor
+_speeds = ()                         # The ones that are set up, their dividers restart with the counters
+
+def _setup_pins(n): # Makes the Pin objects of the first n motors and the activation pin, the ones that exist are kept
+    global activation_pin, step_pin_1, dir_pin_1, step_pin_2, dir_pin_2, step_pin_3, dir_pin_3, step_pin_4, dir_pin_4
+    if activation_pin is None:
+        activation_pin = Pin(activation, Pin.OUT)
+    if n > 0 and step_pin_1 is None:
+        step_pin_1 = Pin(17, Pin.OUT)        # Motor 1 - Pio Block 0
+        dir_pin_1 = Pin(16, Pin.OUT)         # Defines Pin 16 as direction pin of motor 1 and as an Output pin
+    if n > 1 and step_pin_2 is None:
+        step_pin_2 = Pin(4, Pin.OUT)         # Motor 2 - Pio Block 1, Step Pin 4
+        dir_pin_2 = Pin(5, Pin.OUT)          # Direction Pin 5
+    if n > 2 and step_pin_3 is None:
+        step_pin_3 = Pin(6, Pin.OUT)         # Motor 3 - Pio Block 0, Step Pin 6
+        dir_pin_3 = Pin(7, Pin.OUT)          # Direction Pin 7
+    if n > 3 and step_pin_4 is None:
+        step_pin_4 = Pin(8, Pin.OUT)         # Motor 4 - Pio Block 1, Step Pin 8
+        dir_pin_4 = Pin(9, Pin.OUT)          # Direction Pin 9
+
+def setup_state_machines(): # Loads step_counter / step_speed into the state machines of the motors init() brings up and activates them.
+    global sm_0, sm_1, sm_2, sm_3, sm_4, sm_5, sm_6, sm_7, _pairs, _dirs, _counters, _speeds, _ready
+    _assemble()
+    _setup_pins(motors)
+    # Motor 1 - Pio Block 0
+    sm_0 = rp2.StateMachine(0,           # Creates object called sm_0 and binds it to state machine 0 inPIO block 0
+        step_counter,                    # Assigns step_counter as PIO program/function
+        freq=sc_freq,                    # Sets the PIO frequency to sc_freq
+        sideset_base=step_pin_1          # Sets Pin 17 as first sideset pin of PIO program/function
+    )
+
+    sm_0.irq(pio_0_handler)              # Directs interrupts from sm_0 to the interrupt handler pio_0_handler()
+    sm_1 = rp2.StateMachine(1,           # Creates object called sm_1 and binds it to state machine 1 in PIO block 0
+                            step_speed,  # Assigns step_speed as PIO program/function
+                            freq=ss_freq # Sets the PIO frequency to ss_freq
+    )
+
+    if motors > 1:
+        # Motor 2 - Pio Block 1
+        sm_4 = rp2.StateMachine(4, step_counter, freq=sc_freq, sideset_base=step_pin_2) # Statemachine 4 - PIO block 1
+        sm_4.irq(pio_1_handler)                                                        #
+        sm_5 = rp2.StateMachine(5, step_speed, freq=ss_freq)                        # Statemachine 5 - PIO block 1
+
+    if motors > 2:
+        # Motor 3 - Pio Block 0
+        sm_2 = rp2.StateMachine(2, step_counter, freq=sc_freq, sideset_base=step_pin_3) # Statemachine 2 - PIO block 0
+        sm_2.irq(pio_2_handler)                                                        #
+        sm_3 = rp2.StateMachine(3, step_speed, freq=ss_freq)                           # Statemachine 3 - PIO block 0
+
+    if motors > 3:
+        # Motor 4 - Pio Block 1
+        sm_6 = rp2.StateMachine(6, step_counter, freq=sc_freq, sideset_base=step_pin_4) # Statemachine 6 - PIO block 1
+        sm_6.irq(pio_3_handler)                                                        #
+        sm_7 = rp2.StateMachine(7, step_speed, freq=ss_freq)                           # Statemachine 7 - PIO block 1
+
+    _pairs = ((sm_0, sm_1), (sm_4, sm_5), (sm_2, sm_3), (sm_6, sm_7))[:motors]
+    _dirs = (dir_pin_1, dir_pin_2, dir_pin_3, dir_pin_4)[:motors]
+    _counters = _COUNTERS[:motors]
+    _speeds = _SPEEDS[:motors]
+    # Activating the step_speed state machines, the step_counters are held until move_steps() releases them
+    for counter, speed in _pairs:
+        speed.active(1)
+    for motor in range(motors):
+        _apply(motor)  # The feed rate of every motor, see feed_rate()
+    _ready = True
+
+# Other motion modes (motion_queue.py etc.) load their own PIO programs into the same
+# state machines. A PIO block only has room for 32 instructions, so they call
+# release_state_machines() before taking over and setup_state_machines() to hand back.
+# The other modes drive all four motors, so the pins of every motor are made here
+# when init() hasn't made them.
+def release_state_machines():
+    global _ready
+    _setup_pins(4)
+    if not _ready:
+        return
+    for counter, speed in _pairs:
+        counter.active(0)
+        speed.active(0)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(step_counter)
+        rp2.PIO(block).remove_program(step_speed)
+    _ready = False
+
+def init(config=None): # Brings up the motors in config, a dict of CONFIG and units.SETTINGS keys. Again to change them
+    global motors, sc_freq, ss_freq, pulse_us, steps_per_rev, step_angle, step_pitch
+    config = config or {}
+    for key in config:
+        if key not in CONFIG and key not in units.SETTINGS:
+            raise ValueError("unknown setting " + key)
+    if not 1 <= config.get("motors", motors) <= 4:
+        raise ValueError("motors is 1 to 4")
+    release_state_machines()         # Nothing to release the first time, only the pins are made
+    units.setup(config)
+    steps_per_rev = units.steps_per_rev
+    step_angle = units.step_angle
+    step_pitch = units.step_pitch
+    motors = config.get("motors", motors)
+    sc_freq = config.get("sc_freq", sc_freq)
+    ss_freq = config.get("ss_freq", ss_freq)
+    pulse_us = config.get("pulse_us", pulse_us)
+    setup_state_machines()
+
+def info(): # Prints the motor settings and what init() has brought up
+    units.banner()
+    print("Motors:", motors, "set up" if _ready else "not set up yet, init() or the first move does it")
+
+         ### Feed rate ###
+# How fast a motor steps is the delay loop of its step_speed and the frequency of its
+# two state machines, a step takes delay + STEP_CYCLES cycles. feed_rate() picks both
+# for a rate in steps/s: the state machines run as fast as the step pulse allows (the
+# pulse is 2 cycles of step_counter and has to last pulse_us at least), the delay fills
+# up the step and the fractional clock divider (1/256 steps) trims the frequency, so
+# the rate is not rounded to a whole number of cycles. Slow rates get the longest
+# delay and a slower clock. Rates outside rate_range() raise ValueError. The two state
+# machines of a motor have their clock dividers restarted together, by feed_rate() and
+# at the start of every move, so the IRQ handshake between them always takes the same
+# cycles. With the dividers out of phase a step would take 7 or 8 of them.
+#
+#     feed_rate(3000, 3000, None, 500)         [steps/s] per motor, None keeps its rate
+#     feed_rate_deg(90, 90, None, 15)          [deg/s]
+#     feed_rate()                              (returns the rates delivered, in steps/s)
+#
+# Until feed_rate() sets a motor, it steps every 73 cycles at sc_freq / ss_freq, as
+# the fixed delay loop step_speed used to have.
+pulse_us = 2              # Shortest step pulse the drivers take [us], 1.9 for a DRV8825, 1 for an A4988
+STEP_CYCLES = 8           # PIO cycles per step on top of the delay: 4 of step_counter, 4 of step_speed
+_MAX_DELAY = 0xFFFFFFFF
+_MAX_CLKDIV = 0xFFFFFF    # 65535 + 255/256, in 1/256
+_delay = [65, 65, 65, 65] # step_speed delay per motor
+_clkdiv = [0, 0, 0, 0]    # Clock divider of each motor's state machines in 1/256, 0 = sc_freq / ss_freq
+_MOTOR_SMS = ((0, 1), (4, 5), (2, 3), (6, 7)) # (step_counter, step_speed) of each motor
+
+def _fastest_freq(): # Highest state machine frequency that still makes a pulse_us step pulse
+    return min(machine.freq(), 2_000_000 / pulse_us)
+
+def rate_range(): # (slowest, fastest) rate [steps/s] feed_rate() can set
+    return machine.freq() * 256 / _MAX_CLKDIV / (_MAX_DELAY + STEP_CYCLES), _fastest_freq() / STEP_CYCLES
+
+def _timing(rate): # (clock divider in 1/256, delay) for rate [steps/s]
+    slowest, fastest = rate_range()
+    if not slowest <= rate <= fastest:
+        raise ValueError("{} steps/s is outside {:.2g} - {:.0f} steps/s".format(rate, slowest, fastest))
+    delay = min(int(_fastest_freq() / rate) - STEP_CYCLES, _MAX_DELAY)
+    clkdiv = round(machine.freq() * 256 / (rate * (delay + STEP_CYCLES)))
+    return max(256, min(clkdiv, _MAX_CLKDIV)), delay
+
+def _rate(motor): # Rate [steps/s] the motor steps at
+    if _clkdiv[motor]:
+        return machine.freq() * 256 / _clkdiv[motor] / (_delay[motor] + STEP_CYCLES)
+    return 1 / (4 / sc_freq + (_delay[motor] + 4) / ss_freq) # To a cycle, step_speed answers on its own clock
+
+def _apply(motor): # Writes the clock divider and the delay of a motor into its state machines
+    counter, speed = _MOTOR_SMS[motor]
+    if _clkdiv[motor]:
+        for i in (counter, speed):
+            machine.mem32[(0x50200000 if i < 4 else 0x50300000) + 0x0C8 + 0x18 * (i & 3)] = _clkdiv[motor] << 8 # SMx_CLKDIV
+        sync_start.restart(_MOTOR_SMS[motor]) # Both in phase, or the handshake between them takes a cycle more or less
+    sm = _pairs[motor][1]
+    sm.put(_delay[motor])
+    sm.exec("pull()")
+    sm.exec("mov(x, osr)")  # Used from the next step on, also in the middle of a move
+
+def feed_rate(x=None, y=None, z=None, r=None): # [steps/s] per motor, None keeps its rate. Returns the rates delivered
+    timings = [None if rate is None else _timing(abs(rate)) for rate in (x, y, z, r)] # Every rate is checked before any is set
+    for motor in range(4):
+        if timings[motor]:
+            _clkdiv[motor], _delay[motor] = timings[motor]
+            if motor < len(_pairs):
+                _apply(motor)        # The others get it when init() sets them up
+    return tuple(_rate(motor) for motor in range(4))
+
+def feed_rate_deg(x_deg=None, y_deg=None, z_deg=None, r_deg=None): # [deg/s] per motor, returns the rates delivered in deg/s
+    rates = feed_rate(*[None if deg is None else deg / step_angle for deg in (x_deg, y_deg, z_deg, r_deg)])
+    return tuple(rate * step_angle for rate in rates)
+
+async def move_steps(x, y, z, r): # Feeds the PIO programs, activates them and awaits all motors.
+    global x_last, y_last, z_last, r_last, _moving
+    profiling = profiler.enabled         # Read once, so a move is timed all the way or not at all
+    if not _ready:
+        init()                           # The first move sets up what init() hasn't
+    if motors < 4 and (r or motors < 3 and z or motors < 2 and y):
+        raise ValueError("only {} motors are set up, see init()".format(motors))
+    if profiling:
+        profiler.lap(profiler.CALL)
+    _origin[0] = x_last                  # Where the move starts, for steps_now()
+    _origin[1] = y_last
+    _origin[2] = z_last
+    _origin[3] = r_last
     x_last = x + x_last
     y_last = y + y_last
     z_last += z
     r_last += r
-    motor_1 = False
-    motor_2 = False
-    motor_3 = False
-    motor_4 = False
+    for flag in motor_done:
+        flag.clear()
     x_steps = round(x)
     y_steps = round(y)
     z_steps = round(z)
@@ -186,27 +382,49 @@ def steps(x, y, z, r): # Feeds the PIO programs and activates them.
     if int(r) < 0:
         dir_pin_4.value(1)
         r_steps = r_steps * (-1)
+    if profiling:
+        profiler.lap(profiler.ARGS)
     sm_0.put(x_steps)
-    sm_4.put(y_steps)
-    sm_2.put(z_steps)
-    sm_6.put(r_steps)
+    if motors > 1:
+        sm_4.put(y_steps)
+    if motors > 2:
+        sm_2.put(z_steps)
+    if motors > 3:
+        sm_6.put(r_steps)
+    if profiling:
+        profiler.lap(profiler.PUT)
+    _counts[0] = -x_steps if int(x) < 0 else x_steps
+    _counts[1] = -y_steps if int(y) < 0 else y_steps
+    _counts[2] = -z_steps if int(z) < 0 else z_steps
+    _counts[3] = -r_steps if int(r) < 0 else r_steps
 #     sm_1.put(x_speed)
 #     sm_5.put(y_speed)
 #     sm_3.put(z_speed)
 #     sm_7.put(r_speed)
     activation_pin.value(1)
-    print("\n### Stepping the steps ###")
-    print("\nstepping to: " + "\nx:" +  str(x_last) + "\ny:" + str(y_last), "\nz:" +  str(z_last) + "\nr:" + str(r_last))
-    while True:
-        if motor_1 and motor_2 and motor_3 and motor_4:
-            dir_pin_1.value(0)
-            dir_pin_2.value(0)
-            dir_pin_3.value(0)
-            dir_pin_4.value(0)
-            activation_pin.value(0) # This is active until both processes have signaled that they are done.
-            position()
-            return
-        time.sleep_ms(1)
+    sync_start.release(_counters, _speeds) # Every step_counter starts on the same cycle within a block, sync_start.skew apart between blocks,
+                                           # and ticks in phase with its step_speed
+    _moving = True
+    telemetry.log(1, telemetry.MOVE, round(x), round(y), round(z), round(r))
+    if profiling:
+        profiler.lap(profiler.START)
+    for motor in range(motors):  # Other tasks keep running while the motors step.
+        await motor_done[motor].wait() # Order does not matter, we continue once every flag has been set.
+    if profiling:
+        profiler.lap(profiler.WAIT)
+    _moving = False
+    sync_start.hold(_counters)
+    for pin in _dirs:
+        pin.value(0)
+    activation_pin.value(0) # This is active until all processes have signaled that they are done.
+    telemetry.log(1, telemetry.DONE, round(x_last), round(y_last), round(z_last), round(r_last)) # position() prints it when asked
+    if profiling:
+        profiler.end(profiler.FINISH)
+
+def steps(x, y, z, r): # Blocking version of move_steps() for the REPL and simple scripts.
+    if profiler.enabled:
+        profiler.begin()
+    asyncio.run(move_steps(x, y, z, r))
 
 # def steps(x, y, z, r):
 #     x_steps = int(x)
@@ -215,13 +433,17 @@ def steps(x, y, z, r): # Feeds the PIO programs and activates them.
 #     r_steps = int(r)
 #     steps(x_steps, y_steps, z_steps, r_steps)
 
-def angle(x_deg, y_deg, z_deg, r_deg):
-    global step_angle
+async def move_angle(x_deg, y_deg, z_deg, r_deg):
     x_steps = round(x_deg / step_angle)
     y_steps = round(y_deg / step_angle)
     z_steps = round(z_deg / step_angle)
     r_steps = round(r_deg / step_angle)
-    steps(x_steps, y_steps, z_steps, r_steps)
+    await move_steps(x_steps, y_steps, z_steps, r_steps)
+
+def angle(x_deg, y_deg, z_deg, r_deg):
+    if profiler.enabled:
+        profiler.begin()
+    asyncio.run(move_angle(x_deg, y_deg, z_deg, r_deg))
 
 def instructor(aquired_tuple):
     instruction_tuple = aquired_tuple
@@ -234,10 +456,11 @@ def instructor(aquired_tuple):
 
 def position(x = 0, y = 0, z=0, r=0):
     global x_last, y_last, z_last, r_last
-    x_angle = step_angle * x_last
-    y_angle = step_angle * y_last
-    z_angle = step_angle * z_last
-    r_angle = step_angle * r_last
+    x_now, y_now, z_now, r_now = steps_now() # Where the motors are, also in the middle of a move
+    x_angle = step_angle * x_now
+    y_angle = step_angle * y_now
+    z_angle = step_angle * z_now
+    r_angle = step_angle * r_now
     if x != 0 and y != 0 and z != 0 and r != 0:
 #         print("x at:", x_angle, "\u00B0")
 #         print("y at:", y_angle, "\u00B0")
@@ -265,6 +488,81 @@ def position(x = 0, y = 0, z=0, r=0):
 def zero():
     angle(-1 * position (1, 0, 0, 0), -1 * position (0, 1, 0, 0), -1 * position (0, 0, 1, 0), -1 * position (0, 0, 0, 1))
 
+         ### Live position, feed hold and abort ###
+# x_last etc. hold the target of a move as soon as it starts. To know where the
+# motors really are in the middle of a move, step_speed is held for a moment:
+# every step_counter then finishes the step pulse it is making and parks at
+# irq(block, 4), right after the pulse and before x is decremented. Its x, the
+# steps still to go, is copied out through the RX FIFO with exec(), and step_speed
+# carries on with the delay where it stopped. feed_hold() and abort() use the same
+# hold, so the motors stop within 3 PIO cycles and the position is exact.
+_origin = [0, 0, 0, 0]                 # x_last etc. before the move in flight
+_counts = [0, 0, 0, 0]                 # Steps of the move in flight, negative = CCW
+_moving = False                        # A move_steps() is running
+_held = False                          # feed_hold() is in effect
+
+def _hold(held): # Stops or restarts every step_speed
+    if not held:
+        sync_start.release(_speeds, _counters) # In phase with the step_counters again, see feed_rate()
+        return
+    for counter, speed in _pairs:
+        speed.active(0)
+    cycle_us = max(1_000_000 // sc_freq, max(_clkdiv) * 1_000_000 // (256 * machine.freq())) # Slowest motor, see feed_rate()
+    time.sleep_us(8 * cycle_us + 1) # Lets every step_counter finish its pulse and park
+
+def _made(): # Steps made by each motor in the move in flight, step_speed must be held
+    made = [0, 0, 0, 0]
+    state = machine.disable_irq()      # The completion IRQ must not move a counter on while it is read
+    for axis in range(len(_pairs)):    # The motors that aren't set up made none
+        sm = _pairs[axis][0]
+        sm.exec("mov(isr, x)")
+        sm.exec("push(noblock)")
+        left = sm.get()
+        count = abs(_counts[axis])
+        if left == 0 or left == 0xFFFFFFFF: # At "end" (or past it): every step is made, "end" makes no pulse
+            made[axis] = count
+        else:                          # Parked in irq(block) after the pulse of step count - left + 1, x counts down after it
+            made[axis] = count - left + 1
+    machine.enable_irq(state)
+    return made
+
+def steps_now(): # (x, y, z, r) steps from origin right now, read from the state machines during a move
+    if not _moving:
+        return x_last, y_last, z_last, r_last
+    if not _held:
+        _hold(True)
+    made = _made()
+    if not _held:
+        _hold(False)
+    return tuple(_origin[axis] + (made[axis] if _counts[axis] >= 0 else -made[axis]) for axis in range(4))
+
+def feed_hold(): # Pauses the motors within a few PIO cycles, resume() continues the move exactly where it stopped
+    global _held
+    _hold(True)
+    _held = True
+    telemetry.log(1, telemetry.HOLD, *[round(steps) for steps in steps_now()])
+
+def resume():
+    global _held
+    _held = False
+    _hold(False)
+
+def abort(): # Stops the move for good, x_last etc. become the exact position the motors stopped at
+    global x_last, y_last, z_last, r_last, _held
+    if not _moving:
+        return
+    if not _held:
+        _hold(True)
+        _held = True                   # steps_now() must not restart step_speed
+    x_last, y_last, z_last, r_last = steps_now()
+    _held = False
+    release_state_machines()           # Throws the rest of the move away
+    setup_state_machines()
+    for axis in range(4):              # move_steps() returns as if the move had ended here
+        motor_done[axis].set()
+        finished[axis] = 1
+    telemetry.log(1, telemetry.ABORT, round(x_last), round(y_last), round(z_last), round(r_last))
+
 # def motor_speed(x, y, z, r):
 #     global x_speed, y_speed, z_speed, r_speed
 #     min_limit = 5
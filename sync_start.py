@@ -0,0 +1,89 @@
+         ### Libraries ###
+import time                                 # measure() lets the timers run for a moment
+import machine                              # System clock, the timers run at it
+import micropython                          # viper, for two register writes as close together as possible
+import rp2
+from rp2 import StateMachine, asm_pio      # The timer program of measure()
+
+# sync_start starts state machines in both PIO blocks together without a GPIO.
+# The state machines that have to start together are loaded while they are held
+# (disabled) and release() enables them with one write to CTRL per block. A CTRL
+# write enables its state machines on the same system clock cycle and restarts their
+# clock dividers, so they also tick in phase. The two blocks are two writes, made
+# back to back by native code, so block 1 starts a fixed number of cycles after
+# block 0. measure() finds that number, the worst-case start skew between any two
+# state machines, and keeps it in skew.
+#
+#     sync_start.release((0, 4, 2, 6))       (state machine numbers, as rp2.StateMachine)
+#     sync_start.release((0, 4), (1, 5))     (1 and 5 run already, only their dividers restart with 0 and 4)
+#     sync_start.restart((0, 1))             (only the dividers, the state machines stay as they are)
+#     sync_start.hold((0, 4, 2, 6))
+#     sync_start.measure()                   (needs state machines 0 and 4 free, returns cycles)
+#
+# Waiting for a GPIO, like wait(1, gpio, 25) on the activation pin, starts both
+# blocks on the same cycle too but needs a free pin, and pin 25 is the LED on a
+# Pico and is used by the wireless chip on a Pico W.
+
+         ### Registers ###
+_CTRL = (0x50200000, 0x50300000)                  # CTRL of PIO block 0 and 1
+_SET = 0x2000                                     # Atomic set alias, only the bits written are set
+_CLR = 0x3000                                     # Atomic clear alias
+_CLKDIV_RESTART = 8                               # CTRL bits 8-11, SM_ENABLE is bits 0-3
+_SET_0 = _CTRL[0] + _SET                          # The addresses are above MicroPython's small ints, adding them up
+_SET_1 = _CTRL[1] + _SET                          # on every call would allocate, so release() and hold() use these
+_CLR_0 = _CTRL[0] + _CLR
+_CLR_1 = _CTRL[1] + _CLR
+
+         ### Global Variables ###
+skew = None                                       # [system clock cycles] block 1 starts after block 0, from measure()
+
+@micropython.viper
+def _write_both(a: uint, b: uint, value_a: uint, value_b: uint): # Two register writes a few cycles apart
+    ptr32(a)[0] = value_a
+    ptr32(b)[0] = value_b
+
+def _mask(ids, block): # SM_ENABLE bits of one block for state machine numbers 0-7, an int and not a tuple of both
+    mask = 0
+    for i in ids:
+        if i >> 2 == block:
+            mask |= 1 << (i & 3)
+    return mask
+
+def release(ids, clocked=()): # Enables the state machines, every block in one write with its clock dividers restarted. Allocates nothing
+    mask_0 = _mask(ids, 0)           # clocked: state machines that only get their dividers restarted in the same write
+    mask_1 = _mask(ids, 1)
+    _write_both(_SET_0, _SET_1, (mask_0 | _mask(clocked, 0)) << _CLKDIV_RESTART | mask_0,
+                (mask_1 | _mask(clocked, 1)) << _CLKDIV_RESTART | mask_1)
+
+def restart(ids): # Restarts the clock dividers of the state machines together, enabled or not. Allocates nothing
+    _write_both(_SET_0, _SET_1, _mask(ids, 0) << _CLKDIV_RESTART, _mask(ids, 1) << _CLKDIV_RESTART)
+
+def hold(ids): # Disables the state machines, they keep their place in the program and their FIFOs. Allocates nothing
+    _write_both(_CLR_0, _CLR_1, _mask(ids, 0), _mask(ids, 1))
+
+         ### Measuring the skew ###
+# A timer in each block counts x down on every system clock cycle. They are
+# started block 0 first and stopped block 1 first with the same code, so the
+# timer in block 0 runs 2 * skew cycles longer than the one in block 1.
+@asm_pio()
+def _timer():
+    label("count")
+    jmp(x_dec, "count")            # x counts down every cycle (it wraps and goes on at 0)
+
+def measure(): # Measures skew with state machines 0 and 4, which must be free, returns it
+    global skew
+    timers = (StateMachine(0, _timer, freq=machine.freq()), StateMachine(4, _timer, freq=machine.freq()))
+    for sm in timers:
+        sm.exec("set(x, 0)")
+    release((0, 4))
+    time.sleep_us(100)
+    _write_both(_CLR_1, _CLR_0, 1, 1)
+    counts = []
+    for sm in timers:
+        sm.exec("mov(isr, x)")
+        sm.exec("push(noblock)")
+        counts.append(-sm.get() & 0xFFFFFFFF)
+    for block in (0, 1):
+        rp2.PIO(block).remove_program(_timer)
+    skew = (counts[0] - counts[1]) // 2
+    return skew
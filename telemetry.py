@@ -0,0 +1,117 @@
+         ### Libraries ###
+import time                                 # Timestamps
+import machine                              # disable_irq() while a record is claimed
+from array import array                     # The preallocated log
+
+# telemetry is an event log for the motion code. Moves, finished axes, queue
+# depth and so on used to be print()ed from the move functions and even from the
+# PIO interrupt handlers, which costs milliseconds per move over USB serial and
+# holds up the interrupt. log() only writes a few integers into a preallocated
+# ring of fixed-size records: no formatting, no allocation, no console I/O, so it
+# can be called from an IRQ handler. The records are printed later, by drain()
+# when you ask for them or by task() running in the background at low priority.
+#
+#     telemetry.level = 2                    (more detail)
+#     ctrl.steps(3200, -1200, 0, 0)
+#     telemetry.drain()                      (prints what happened, oldest first)
+#     asyncio.create_task(telemetry.task())  (or keep printing in the background)
+#
+# When the ring is full new records are dropped and counted in dropped, the
+# records that are already in the ring are kept.
+
+         ### Settings ###
+size = 128           # Records in the ring, a power of two. Each record is 6 words (24 bytes)
+level = 1            # 0 = nothing, 1 = moves and errors, 2 = + every axis and delays, 3 = + every queue segment
+
+         ### Events ###
+#                      a, b, c, d
+MOVE = 1             # x, y, z, r steps of a move that starts
+DONE = 2             # x, y, z, r steps from origin when every motor is done
+AXIS = 3             # axis, steps from origin, -, -       one motor has made its last step
+DELAYS = 4           # x, y, z, r delays computed for a move
+SEGMENT = 5          # axis, segments done, queue depth, - motion_queue finished a segment on one axis
+UNDERRUN = 6         # underruns so far, -, -, -           every motor ran out of queued segments
+HOLD = 7             # x, y, z, r steps from origin where feed_hold() stopped the motors
+ABORT = 8            # x, y, z, r steps from origin where abort() stopped the motors
+STALL = 9            # axis, commanded steps, measured steps, -  an encoder stopped moving during a move
+CORRECT = 10         # axis, steps corrected, try, -         correction move after an encoder check
+NAMES = (None, "move", "done", "axis", "delays", "segment", "underrun", "hold", "abort", "stall", "correct")
+
+         ### Global Variables ###
+_WORDS = 6                                        # ticks_us, event, a, b, c, d
+_log = array("i", [0] * (size * _WORDS))
+_head = 0                                         # Oldest record
+_count = 0                                        # Records in the ring
+dropped = 0                                       # Records lost because the ring was full
+
+         ### Logging ###
+def log(lvl, event, a=0, b=0, c=0, d=0): # Records an event if lvl <= level, safe in an IRQ handler
+    global _count, dropped
+    if lvl > level:
+        return
+    state = machine.disable_irq()
+    if _count == size:
+        dropped += 1
+        machine.enable_irq(state)
+        return
+    i = ((_head + _count) & (size - 1)) * _WORDS
+    _count += 1
+    machine.enable_irq(state)
+    _log[i] = time.ticks_us() & 0x3FFFFFFF
+    _log[i + 1] = event
+    _log[i + 2] = a
+    _log[i + 3] = b
+    _log[i + 4] = c
+    _log[i + 5] = d
+
+def pop(record): # Moves the oldest record into record (6 ints), returns False if there is none
+    global _head, _count
+    if not _count:
+        return False
+    i = _head * _WORDS
+    for w in range(_WORDS):
+        record[w] = _log[i + w]
+    state = machine.disable_irq()
+    _head = (_head + 1) & (size - 1)
+    _count -= 1
+    machine.enable_irq(state)
+    return True
+
+def clear():
+    global _head, _count, dropped
+    state = machine.disable_irq()
+    _head = _count = dropped = 0
+    machine.enable_irq(state)
+
+         ### Output ###
+def text(record): # One record as a line of text
+    event = record[1]
+    name = NAMES[event] if 0 < event < len(NAMES) else str(event)
+    return "{:>10} {:8} {} {} {} {}".format(record[0], name, record[2], record[3], record[4], record[5])
+
+def drain(out=None): # Prints every record (or out(line) for each), returns how many there were
+    global dropped
+    record = array("i", [0] * _WORDS)
+    n = 0
+    while pop(record):
+        _write(text(record), out)
+        n += 1
+    if dropped:
+        _write("{} records dropped".format(dropped), out)
+        dropped = 0
+    return n
+
+def _write(line, out):
+    if out is None:
+        print(line)
+    else:
+        out(line)
+
+async def task(period_ms=200, out=None): # Drains the log in the background, between moves and other tasks
+    try:
+        import asyncio
+    except ImportError:
+        import uasyncio as asyncio
+    while True:
+        drain(out)
+        await asyncio.sleep_ms(period_ms)
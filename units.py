@@ -0,0 +1,59 @@
+# units holds the motor settings of stepper_controller and the conversions between
+# steps, degrees and mm. Planning code, tests and tools on a computer can import it
+# without MicroPython and without bringing up any hardware. stepper_controller
+# copies steps_per_rev, step_angle and step_pitch from here when it is imported and
+# again in init(config).
+#
+#     units.to_steps(90)                      (800 steps with 3200 steps per revolution)
+#     units.to_angle(800)                     (90.0 degrees)
+#     units.mm_to_steps(0.5), units.to_mm(800)
+#     units.setup({"drv_ms": 32})             (other settings, conversions recomputed)
+
+         ### Stepper motor setup ###
+# These settings are made for rotational movement only. (Belts, gears etc)
+# This means if you want to use a trapetziod for a linear actuator, use the other motor settings.
+drv_ms = 16               # resolution of microstepping 1 / 1, 2, 4, 8, 16, 32, 64, 128, write the denominator only
+motor_steps_per_rev = 200 # steps per full revolution, often 200 or 400
+gear_ratio = 1            # how many times the motor needs to spin to turn output one time. Gear ratio 5:1 means 5 times for one full turn
+lead_screw_pitch = 2      # This is how far each rotation will move something. 2 [mm] pitch is common for 3D printers.
+SETTINGS = ("drv_ms", "motor_steps_per_rev", "gear_ratio", "lead_screw_pitch") # What setup(config) takes
+
+# Whith the example above, we get:
+# Belt, Gear or Arm
+# Steps per revolution: 3200
+# Wormgear or Lead screw
+# [mm] per revolution: 2
+# One step is 0.1125 degrees
+
+def setup(config=None): # Takes the settings in config (a dict, other keys are left alone) and recomputes the conversions
+    global steps_per_rev, step_angle, step_pitch
+    if config:
+        for key in SETTINGS:
+            if key in config:
+                globals()[key] = config[key]
+    steps_per_rev = motor_steps_per_rev * drv_ms * gear_ratio # This is the number of steps to move output.
+    step_angle = 360 / steps_per_rev # This is the step resolution in degrees
+    step_pitch = lead_screw_pitch / steps_per_rev # This is how far along the lead screw we are moved for each step.
+
+def banner(): # Prints the settings, stepper_controller used to do this when imported
+    print("For gears, belts and arms.")
+    print("Steps per revolution:", steps_per_rev, "steps.",
+          "\nOne step is", step_angle, "degrees.\n")
+    print("For lead screws.")
+    print ("[mm] per revolution:", lead_screw_pitch,
+           "\nOne steps is", step_pitch, "[mm].\n")
+
+         ### Conversions ###
+def to_steps(degrees): # Whole steps for an angle
+    return round(degrees / step_angle)
+
+def to_angle(steps): # Degrees for a number of steps
+    return steps * step_angle
+
+def mm_to_steps(mm): # Whole steps for a distance along the lead screw
+    return round(mm / step_pitch)
+
+def to_mm(steps):
+    return steps * step_pitch
+
+setup()